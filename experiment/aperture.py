@@ -0,0 +1,230 @@
+
+import numpy as np
+import os.path as op
+
+
+def get_bar_axis(bar_pass_direction):
+
+    """ get axis along which bar moves, for array of bar directions
+    returns 0 for horizontal bar passes (x bounds), 1 for vertical bar passes (y bounds)
+    and -1 when no bar on screen
+
+    Parameters
+    ----------
+    bar_pass_direction : arr
+        array of strings with bar direction(s)
+    """
+
+    bar_pass_direction = np.asarray(bar_pass_direction, dtype = str)
+
+    axis = np.full(bar_pass_direction.shape, -1, dtype = np.int8)
+    axis[np.isin(bar_pass_direction, ['L-R','R-L','horizontal'])] = 0
+    axis[np.isin(bar_pass_direction, ['U-D','D-U','vertical'])] = 1
+
+    return axis
+
+
+def format_bar_design(bar_midpoint_all, bar_pass_direction_all):
+
+    """ make bar midpoints and directions of all TRs into fixed shape arrays
+    (TR, bars, [x,y]) and (TR, bars), valid for single bar (pRF) or multiple bars (feature)
+
+    Parameters
+    ----------
+    bar_midpoint_all : arr
+        midpoint position (x,y) of bar(s) for all TRs (if empty, then nan)
+    bar_pass_direction_all : list/arr
+        bar direction(s) for all TRs (or 'empty')
+    """
+
+    midpoints = np.asarray(bar_midpoint_all, dtype = float)
+    if midpoints.ndim == 2:
+        midpoints = midpoints[:, np.newaxis, :]
+
+    num_TR, num_bars = midpoints.shape[:2]
+
+    directions = np.full((num_TR, num_bars), 'empty', dtype = object)
+    for t, val in enumerate(bar_pass_direction_all):
+        directions[t] = val # broadcasts strings over bars
+
+    axis = get_bar_axis(directions.astype(str))
+    axis[np.isnan(midpoints).any(axis = -1)] = -1
+
+    return midpoints, axis
+
+
+def make_mask_bank(midpoints, axis, bar_width_pix, screen = np.array([1080,1080]), downsample = 8):
+
+    """ make bank of binary masks (at downsampled resolution) for all unique
+    bar configurations in run
+
+    Parameters
+    ----------
+    midpoints : arr
+        bar midpoints (TR, bars, [x,y])
+    axis : arr
+        bar axis (TR, bars), 0 - horizontal pass, 1 - vertical pass, -1 - no bar
+    bar_width_pix : arr
+        width of bar in pixels for each resolution
+    screen : arr
+        array with display resolution
+    downsample : int
+        number of screen pixels per aperture pixel
+
+    Returns
+    -------
+    mask_bank : arr
+        boolean array (unique bars + 1, H, W), last mask is empty screen
+    bank_ind : arr
+        index in mask bank, per TR and bar (TR, bars)
+    """
+
+    bar_width_pix = np.broadcast_to(np.asarray(bar_width_pix, dtype = float), (2,))
+
+    # aperture pixel centers, row 0 is top of screen
+    width, height = (np.asarray(screen)/downsample).astype(int)
+    x_centers = (np.arange(width) + .5) * downsample - screen[0]/2
+    y_centers = screen[1]/2 - (np.arange(height) + .5) * downsample
+
+    # coordinate along axis of bar movement, for all bars
+    valid = axis >= 0
+    coord = np.where(axis == 0, midpoints[..., 0], midpoints[..., 1])
+
+    bar_keys = np.stack((axis[valid], coord[valid]), axis = -1)
+    unique_keys, inverse = np.unique(bar_keys, axis = 0, return_inverse = True)
+
+    num_masks = unique_keys.shape[0]
+    bank_ind = np.full(axis.shape, num_masks, dtype = np.int32) # default to empty mask
+    bank_ind[valid] = inverse.ravel()
+
+    # 1D masks along each axis, then broadcast to 2D
+    unique_axis = unique_keys[:, 0].astype(int)
+    half_width = bar_width_pix[unique_axis]/2
+
+    x_mask = np.abs(x_centers[np.newaxis] - unique_keys[:, [1]]) <= half_width[:, np.newaxis]
+    y_mask = np.abs(y_centers[np.newaxis] - unique_keys[:, [1]]) <= half_width[:, np.newaxis]
+
+    mask_bank = np.zeros((num_masks + 1, height, width), dtype = bool)
+    mask_bank[:num_masks] = np.where((unique_axis == 0)[:, np.newaxis, np.newaxis],
+                                     x_mask[:, np.newaxis, :],
+                                     y_mask[:, :, np.newaxis])
+
+    return mask_bank, bank_ind
+
+
+def encode_aperture_rle(aperture, chunk_size = 64):
+
+    """ run-length encode binary aperture (TR, H, W), over flattened frames
+
+    Parameters
+    ----------
+    aperture : arr
+        binary aperture array (can be memory-mapped)
+    chunk_size : int
+        number of TRs to encode at once
+
+    Returns
+    -------
+    rle_dict : dict
+        'starts' and 'lengths' of runs of ones (flat pixel index),
+        'frame_ptr' (TR + 1) with index of first run of each frame, and 'shape'
+    """
+
+    num_TR = aperture.shape[0]
+    all_starts = []
+    all_lengths = []
+    runs_per_frame = np.zeros(num_TR, dtype = np.int64)
+
+    for c in range(0, num_TR, chunk_size):
+
+        flat = np.asarray(aperture[c:c+chunk_size]).reshape(-1, int(np.prod(aperture.shape[1:]))).astype(np.int8)
+
+        # edges of runs, padding each frame with zeros
+        edges = np.diff(np.pad(flat, ((0,0),(1,1))), axis = -1)
+        frame_s, starts = np.nonzero(edges == 1)
+        _, ends = np.nonzero(edges == -1)
+
+        all_starts.append(starts)
+        all_lengths.append(ends - starts)
+        runs_per_frame[c:c+chunk_size] = np.bincount(frame_s, minlength = flat.shape[0])
+
+    return {'starts': np.concatenate(all_starts).astype(np.int32),
+            'lengths': np.concatenate(all_lengths).astype(np.int32),
+            'frame_ptr': np.concatenate(([0], np.cumsum(runs_per_frame))),
+            'shape': np.array(aperture.shape)}
+
+
+def decode_aperture_rle(rle_dict, frames = None):
+
+    """ decode run-length encoded aperture (see encode_aperture_rle)
+
+    Parameters
+    ----------
+    rle_dict : dict/NpzFile
+        run-length encoded aperture
+    frames : list/arr/None
+        TR indices to decode (if None, decodes all)
+    """
+
+    shape = tuple(rle_dict['shape'])
+    frames = np.arange(shape[0]) if frames is None else np.asarray(frames)
+
+    out = np.zeros((len(frames), int(np.prod(shape[1:]))), dtype = bool)
+
+    for i, f in enumerate(frames):
+        run_ind = slice(rle_dict['frame_ptr'][f], rle_dict['frame_ptr'][f+1])
+        for s, l in zip(rle_dict['starts'][run_ind], rle_dict['lengths'][run_ind]):
+            out[i, s:s+l] = True
+
+    return out.reshape((len(frames),) + shape[1:])
+
+
+def export_aperture(bar_midpoint_all, bar_pass_direction_all, bar_width_pix, output_path,
+                    screen = np.array([1080,1080]), downsample = 8, rle = True, chunk_size = 64):
+
+    """ render binary aperture of bar positions (TR, H, W) from mask bank,
+    and save as memory-mapped .npy (and run-length encoded .npz, if such is the case)
+
+    Parameters
+    ----------
+    bar_midpoint_all : arr
+        midpoint position (x,y) of bar(s) for all TRs (if empty, then nan)
+    bar_pass_direction_all : list/arr
+        bar direction(s) for all TRs (or 'empty')
+    bar_width_pix : arr
+        width of bar in pixels for each resolution
+    output_path : str
+        absolute path to output .npy file
+    screen : arr
+        array with display resolution
+    downsample : int
+        number of screen pixels per aperture pixel
+    rle : bool
+        if we also want to save run-length encoded version
+    chunk_size : int
+        number of TRs written at once (never holds whole run in memory)
+
+    Returns
+    -------
+    aperture : memmap
+        memory-mapped aperture array (TR, H, W)
+    """
+
+    midpoints, axis = format_bar_design(bar_midpoint_all, bar_pass_direction_all)
+    mask_bank, bank_ind = make_mask_bank(midpoints, axis, bar_width_pix,
+                                         screen = screen, downsample = downsample)
+
+    aperture = np.lib.format.open_memmap(output_path, mode = 'w+', dtype = np.uint8,
+                                         shape = (bank_ind.shape[0],) + mask_bank.shape[1:])
+
+    # union of masks of all bars on screen, per TR
+    for c in range(0, bank_ind.shape[0], chunk_size):
+        aperture[c:c+chunk_size] = mask_bank[bank_ind[c:c+chunk_size]].any(axis = 1)
+
+    aperture.flush()
+
+    if rle:
+        np.savez_compressed(op.splitext(output_path)[0] + '_rle.npz',
+                            **encode_aperture_rle(aperture, chunk_size = chunk_size))
+
+    return aperture
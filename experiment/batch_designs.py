@@ -0,0 +1,193 @@
+
+# import relevant packages
+import os
+import os.path as op
+import time
+import argparse
+import yaml
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from design import get_design, validate_design
+from rng import RNGRegistry
+from aperture import export_aperture
+from utils import get_display_screen
+from io_utils import save_bar_position, save_all_TR_info
+
+
+# task name dictionary (same as main.py)
+TASKS = {'standard': 'pRF', 'feature': 'FA', 'flicker': 'flicker'}
+
+
+def parse_list(arg_str):
+
+    """ parse comma separated list of numbers, with ranges (ex: '1-3,5' -> [1,2,3,5]) """
+
+    out = []
+    for val in arg_str.split(','):
+        if '-' in val:
+            start, end = val.split('-')
+            out += list(range(int(start), int(end)+1))
+        else:
+            out.append(int(val))
+
+    return out
+
+
+def make_run_seeds(sj_num, run_num, exp_type, settings, base_dir):
+
+    """ save seeds file of run in output folder, if not there yet 
+    (reused by the session when it is launched, so it gets the same design)
+    """
+
+    output_dir = op.join(base_dir, 'output', 'sourcedata', 'sub-{sj}'.format(sj = sj_num))
+    output_str = 'sub-{sj}_ses-1_task-{task}_run-{run}'.format(sj = sj_num, run = run_num, task = TASKS[exp_type])
+
+    if not op.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    seeds_file = op.join(output_dir, output_str+'_seeds.yml')
+    if not op.exists(seeds_file):
+        RNGRegistry(seed = settings['rng']['seed']).save(seeds_file)
+
+
+def make_design_job(sj_num, run_num, exp_type, settings_file, base_dir, att_color = None, win_size = None):
+
+    """ plan, validate and save design of one run, without window
+    (design is cached, so the session of the run loads it instead of planning again)
+
+    Parameters
+    ----------
+    sj_num : str
+        subject number (zero padded)
+    run_num : str
+        run number
+    exp_type : str
+        type of experiment ('standard', 'feature' or 'flicker')
+    settings_file : str
+        absolute path to settings file
+    base_dir : str
+        absolute path to folder where output folder is
+    att_color : str/None
+        attended color condition ('color_red' or 'color_green'), only for feature task
+    win_size : list/arr/None
+        window size [horizontal, vertical] in pixels (if None, uses settings)
+
+    Returns
+    -------
+    job_dict : dict
+        summary of job (timing, number of trials, validation errors)
+    """
+
+    start_time = time.time()
+
+    task = TASKS[exp_type]
+
+    with open(settings_file, 'r', encoding = 'utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+
+    output_dir = op.join(base_dir, 'output', 'sourcedata', 'sub-{sj}'.format(sj = sj_num))
+    output_str = 'sub-{sj}_ses-1_task-{task}_run-{run}'.format(sj = sj_num, run = run_num, task = task)
+
+    # folder for design preview files, so they don't collide with run outputs
+    design_dir = op.join(output_dir, settings['design']['cache_folder'])
+    os.makedirs(design_dir, exist_ok = True)
+
+    # seeds of run (made before jobs start, see make_run_seeds)
+    rng = RNGRegistry.from_file(op.join(output_dir, output_str+'_seeds.yml'))
+
+    win_size = settings['window_extra']['size'] if win_size is None else win_size
+    screen = get_display_screen(settings, win_size)
+
+    design = get_design(task, settings, screen, seed = rng.seeds['design'], rng = rng.get('design'),
+                        cache_dir = design_dir if settings['design']['cache'] else None,
+                        att_color = att_color, run_index = int(run_num))
+
+    errors = validate_design(design, task)
+
+    ## save trial tables, bar positions and aperture
+    if task == 'FA':
+        output_str += '_att-%s'%att_color.replace('color_', '')
+
+        save_bar_position(design['all_bar_pos'],
+                          op.join(design_dir, output_str+'_bar_positions.pkl'))
+
+        save_all_TR_info(bar_dict = design['all_bar_pos'], trial_type = design['trial_type_all'],
+                        task_colors = settings['stimuli']['feature']['task_colors'], task_color_ind = design['ctask_ind_all'],
+                        crossing_ind = design['drawing_ind'],
+                        ecc_ind = design['ecc_ind_all'],
+                        output_path = op.join(design_dir, output_str+'_trial_info.csv'))
+
+    if task in ['pRF', 'FA'] and settings['aperture']['export']:
+        export_aperture(design['bar_midpoint_all'], design['bar_pass_direction_all'], design['bar_width_pix'],
+                        op.join(design_dir, output_str+'_aperture.npy'),
+                        screen = screen,
+                        downsample = settings['aperture']['downsample'],
+                        rle = settings['aperture']['rle'])
+
+    return {'sj': sj_num, 'run': run_num, 'task': task, 'att_color': att_color,
+            'trial_number': design['trial_number'],
+            'valid': len(errors) == 0, 'errors': '; '.join(errors),
+            'time': time.time() - start_time}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Pre-generate and validate designs for all subjects and runs')
+    parser.add_argument('--subjects', type = str, required = True, help = 'subject numbers, ex: 1-40 or 1,3,5')
+    parser.add_argument('--runs', type = str, required = True, help = 'run numbers, ex: 1-4')
+    parser.add_argument('--exp_types', nargs = '+', default = ['standard', 'feature'], choices = list(TASKS.keys()))
+    parser.add_argument('--att_colors', nargs = '+', default = ['red', 'green'], choices = ['red', 'green'],
+                        help = 'attended colors to plan, for feature runs')
+    parser.add_argument('--settings_file', type = str, default = 'experiment_settings.yml')
+    parser.add_argument('--win_size', type = int, nargs = 2, default = None, help = 'window size in pixels (if not as in settings)')
+    parser.add_argument('--n_jobs', type = int, default = None, help = 'number of processes (default all cpus)')
+    args = parser.parse_args()
+
+    ## set path to store outcomes
+    # DEFAULTS TO ROOT FOLDER (as main.py)
+    base_dir = op.split(os.getcwd())[0]
+    settings_file = op.abspath(args.settings_file)
+
+    with open(settings_file, 'r', encoding = 'utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+
+    ## list all jobs
+    jobs = []
+    for sj in parse_list(args.subjects):
+        for run in parse_list(args.runs):
+            for exp_type in args.exp_types:
+
+                # same seeds for all attended colors of run
+                make_run_seeds(str(sj).zfill(3), str(run), exp_type, settings, base_dir)
+
+                att_colors = ['color_'+c for c in args.att_colors] if exp_type == 'feature' else [None]
+
+                for att_color in att_colors:
+                    jobs.append(dict(sj_num = str(sj).zfill(3), run_num = str(run), exp_type = exp_type,
+                                     settings_file = settings_file, base_dir = base_dir,
+                                     att_color = att_color, win_size = args.win_size))
+
+    print('Generating %i designs'%len(jobs))
+
+    start_time = time.time()
+
+    with ProcessPoolExecutor(max_workers = args.n_jobs) as executor:
+        futures = [executor.submit(make_design_job, **job) for job in jobs]
+        summary = [f.result() for f in futures]
+
+    df_summary = pd.DataFrame(summary)
+
+    print(df_summary.to_string(index = False))
+    print('%i designs in %.2f s (%.3f s per job on average), %i invalid'%(len(jobs), time.time() - start_time,
+                                                                           df_summary['time'].mean(),
+                                                                           (~df_summary['valid']).sum()))
+
+    summary_file = op.join(base_dir, 'output', 'sourcedata', 'batch_designs_summary.csv')
+    df_summary.to_csv(summary_file, index = False)
+    print('summary saved in %s'%summary_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+
+# import relevant packages
+import os
+import os.path as op
+import pickle
+
+from journal import consolidate_journal
+
+
+# bump when content of checkpoint changes, so old checkpoints are not loaded
+CHECKPOINT_VERSION = 1
+
+# session attributes saved at every trial boundary (if session has them)
+CHECKPOINT_COUNTERS = ['total_responses', 'correct_responses', 'bar_counter', 'thisResp',
+                       'ori_counter', 'ori_ind', 'ori_bool', 'lum_responses']
+
+
+def get_pre_resume_file(output_dir, output_str, n_resumes):
+
+    """ events file of run attempt that was interrupted after n_resumes resumes """
+
+    return op.join(output_dir, output_str+'_events_pre-resume-%i.tsv'%(n_resumes+1))
+
+
+def keep_interrupted_events(output_dir, output_str, n_resumes, journal_file = None):
+
+    """ save events of interrupted run attempt as _events_pre-resume-<N>.tsv, so the resumed run does not overwrite them.
+    The events file saved when session was closed (ex: quit with 'q') is renamed,
+    otherwise (crash) events are saved from the journal
+
+    Parameters
+    ----------
+    output_dir : str
+        absolute path to output folder
+    output_str : str
+        basename of run output files
+    n_resumes : int
+        number of times run was resumed before interrupted attempt
+    journal_file : str/None
+        absolute path to journal of interrupted attempt (_events_journal.tsv)
+
+    Returns
+    -------
+    pre_resume_file : str/None
+        events file of interrupted attempt (None if no events were saved)
+    """
+
+    pre_resume_file = get_pre_resume_file(output_dir, output_str, n_resumes)
+    events_file = op.join(output_dir, output_str+'_events.tsv')
+
+    # already kept when session closed
+    if op.exists(pre_resume_file):
+        return pre_resume_file
+
+    if op.exists(events_file):
+        os.replace(events_file, pre_resume_file)
+
+    elif journal_file is not None and op.exists(journal_file):
+        if consolidate_journal(journal_file, pre_resume_file) is None:
+            return None
+
+    else:
+        return None
+
+    return pre_resume_file
+
+
+def dump_pickle(obj, output_path):
+
+    """ save object in pickle file, writing to temporary file first
+    (so a crash never leaves a partial file) """
+
+    with open(output_path+'.tmp', 'wb') as f_out:
+        pickle.dump(obj, f_out, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(output_path+'.tmp', output_path)
+
+
+class RunCheckpoint(object):
+
+    def __init__(self, output_dir, output_str):
+
+        """ Initializes RunCheckpoint object, that keeps what is needed to resume an interrupted run.
+        The design is saved once, before the run starts (_checkpoint_design.pkl),
+        and the session state (next trial, counters, random generator states, condition settings)
+        at every trial boundary (_checkpoint.pkl)
+
+        Parameters
+        ----------
+        output_dir : str
+            Path to output-directory
+        output_str : str
+            Basename of run output-files, e.g., "sub-001_ses-1_task-FA_run-1"
+        """
+
+        self.state_file = op.join(output_dir, output_str+'_checkpoint.pkl')
+        self.design_file = op.join(output_dir, output_str+'_checkpoint_design.pkl')
+
+
+    def exists(self):
+
+        return op.exists(self.state_file) and op.exists(self.design_file)
+
+
+    def save_design(self, design):
+
+        """ save design of run (trial order, bar positions, timings) """
+
+        dump_pickle({'version': CHECKPOINT_VERSION, 'design': design}, self.design_file)
+
+
+    def save_state(self, state):
+
+        """ save session state (small, done at every trial boundary) """
+
+        dump_pickle(dict(state, version = CHECKPOINT_VERSION), self.state_file)
+
+
+    def load(self):
+
+        """ load checkpoint of run
+
+        Returns
+        -------
+        design : dict
+            design of run
+        state : dict
+            session state at last trial boundary
+        """
+
+        if not self.exists():
+            raise NameError('No checkpoint found in %s'%self.state_file)
+
+        with open(self.design_file, 'rb') as f_in:
+            design_dict = pickle.load(f_in)
+        with open(self.state_file, 'rb') as f_in:
+            state = pickle.load(f_in)
+
+        if design_dict['version'] != CHECKPOINT_VERSION or state['version'] != CHECKPOINT_VERSION:
+            raise ValueError('Checkpoint %s was saved by another version of the experiment code'%self.state_file)
+
+        return design_dict['design'], state
+
+
+    def remove(self):
+
+        for filename in [self.state_file, self.design_file]:
+            if op.exists(filename):
+                os.remove(filename)
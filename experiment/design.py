@@ -0,0 +1,735 @@
+
+import numpy as np
+import os
+import os.path as op
+import hashlib
+import json
+import pickle
+
+from utils import *
+from logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# increment when planners change, so that previously cached designs are not reused
+DESIGN_CACHE_VERSION = 4
+
+# settings read by each planner (also through utils, ex: get_ori_switch_times).
+# planners only get these settings in get_design, and design cache key hashes them,
+# so a setting missing here fails loudly instead of being left out of the key
+DESIGN_SETTINGS = {'pRF': [['mri', 'TR'], ['stimuli', 'ori_shift_rate'], ['stimuli', 'prf']],
+                   'FA': [['mri', 'TR'], ['stimuli', 'ori_shift_rate'], ['stimuli', 'feature']],
+                   'flicker': [['mri', 'TR'], ['stimuli', 'ori_shift_rate'], ['stimuli', 'flicker'],
+                               ['stimuli', 'conditions'], ['stimuli', 'feature', 'task_colors']]}
+
+
+def plan_prf_design(settings, screen, rng = None):
+
+    """ plan trial design of pRF run (without window),
+    used by PRFSession.create_trials and to rebuild run offline
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    screen : arr
+        array with display resolution
+    rng: numpy Generator/None
+        random generator for design (if None, uses a new unseeded one)
+
+    Returns
+    -------
+    design : dict
+        dictionary with all trial design arrays (names as session attributes)
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    design = {'expected_responses': 0}
+
+    # define bar width
+    bar_width_ratio = settings['stimuli']['prf']['bar_width_ratio']
+    design['bar_width_pix'] = screen*bar_width_ratio
+
+    # number of TRs per "type of stimuli"
+    bar_pass_hor_TR = settings['stimuli']['prf']['bar_pass_hor_TR']
+    bar_pass_ver_TR = settings['stimuli']['prf']['bar_pass_ver_TR']
+
+    # list with order of bar orientations throught experiment
+    bar_pass_direction = settings['stimuli']['prf']['bar_pass_direction']
+
+    # all possible positions in pixels [x,y] for for midpoint of
+    # vertical bar passes,
+    ver_y = screen[1]*np.linspace(-0.5,0.5, bar_pass_ver_TR)
+
+    ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
+
+    # horizontal bar passes
+    hor_x = screen[0]*np.linspace(-0.5,0.5, bar_pass_hor_TR)
+
+    hor_bar_pos_pix = np.array([np.array([x,0]) for _,x in enumerate(hor_x)])
+
+    #create as many trials as TRs
+    trial_number = 0
+    bar_pass_direction_all = [] # list of bar orientation at all TRs
+
+    bar_pos_array = [] # list with bar midpoint (x,y) for all TRs (if nan, then empty screen)
+
+    for _,bartype in enumerate(bar_pass_direction):
+        if 'empty' in bartype: # empty screen
+            trial_number += settings['stimuli']['prf'][bartype+'_TR']
+            bar_pass_direction_all = bar_pass_direction_all + np.repeat('empty',settings['stimuli']['prf'][bartype+'_TR']).tolist()
+            bar_pos_array.append([np.array([np.nan,np.nan]) for i in range(settings['stimuli']['prf'][bartype+'_TR'])])
+
+        elif bartype in np.array(['U-D','D-U']): # vertical bar pass
+            trial_number += bar_pass_ver_TR
+            design['expected_responses'] += bar_pass_ver_TR
+            bar_pass_direction_all =  bar_pass_direction_all + np.repeat(bartype,bar_pass_ver_TR).tolist()
+
+            # order depending on starting point for bar pass, and append to list
+            position_list = np.sort(ver_bar_pos_pix,axis=0) if bartype=='D-U' else np.sort(ver_bar_pos_pix,axis=0)[::-1]
+            bar_pos_array.append(position_list)
+
+        elif bartype in np.array(['L-R','R-L']): # horizontal bar pass
+            trial_number += bar_pass_hor_TR
+            design['expected_responses'] += bar_pass_hor_TR
+            bar_pass_direction_all =  bar_pass_direction_all + np.repeat(bartype,bar_pass_hor_TR).tolist()
+
+            # order depending on starting point for bar pass, and append to list
+            position_list = np.sort(hor_bar_pos_pix,axis=0) if bartype=='L-R' else np.sort(hor_bar_pos_pix,axis=0)[::-1]
+            bar_pos_array.append(position_list)
+
+    design['trial_number'] = trial_number # total number of trials
+    logger.info('Total number of (expected) TRs: %d', trial_number)
+    design['bar_pass_direction_all'] = bar_pass_direction_all # list of strings with bar orientation/empty
+
+    # list of midpoint position (x,y) of bar for all TRs (if empty, then nan)
+    design['bar_midpoint_all'] = np.array([val for sublist in bar_pos_array for val in sublist])
+
+    # make boolean array to see which trials are stim trials
+    bar_bool = [False if x == 'empty' else True for _,x in enumerate(bar_pass_direction_all)]
+    design['bar_bool'] = bar_bool
+
+    # if in scanner, we want it to be synced to trigger, so lets increase trial time (in seconds, like TR)
+    max_trial_time = 5 if settings['stimuli']['prf']['sync_scanner']==True else settings['mri']['TR']
+    design['max_trial_time'] = max_trial_time
+
+    # flicker frequency
+    flick_rate = settings['stimuli']['prf']['flick_rate']
+
+    # number of samples in trial
+    n_samples = max_trial_time * flick_rate
+
+    ## get condition names and randomize them for each trial
+
+    key_list = []
+    for key in settings['stimuli']['prf']['color_categories']:
+        # if showing red and green bars
+        if settings['stimuli']['prf']['task_on_main_categories']:
+            key_list.append(key)
+
+        else: # other color variants
+            for name in settings['stimuli']['prf']['task_colors'][key]:
+                key_list.append(name)
+
+    # define how many times bar features switch during TR, according to flick rate defined
+    if settings['stimuli']['prf']['flick_stim_rate'] == 'TR': # if changing features at every TR
+
+        phase_conditions = np.repeat(key_list, sum(bar_bool)/len(key_list)) # only do this for bar showing trials
+        rng.shuffle(phase_conditions) # randomized conditions, for attention to bar task
+
+        if settings['stimuli']['prf']['flick_on_off'] == True: # interleave with background if we want and on-off bar
+
+            phase_conditions = np.array([list(np.tile([val,'background'],int(np.round(n_samples)))) for _,val in enumerate(phase_conditions)])
+
+        else:
+            phase_conditions = np.array([list(np.tile(val,int(np.round(n_samples)))) for _,val in enumerate(phase_conditions)])
+
+    else: # if changing features randomly at flick rate
+
+        # repeat keys, so for each bar pass it shows each condition X times
+        key_list = np.array(key_list*round(n_samples/len(key_list)))
+
+        if settings['stimuli']['prf']['flick_on_off'] == True: # interleave with background if we want and on-off bar
+
+            on_list = list(key_list)
+            off_list = list(np.tile('background',len(on_list)))
+
+            key_list = on_list + off_list
+            key_list[::2] = on_list
+            key_list[1::2] = off_list
+        else:
+            key_list = list(key_list) + list(key_list)
+
+        phase_conditions = key_list
+
+        # stack them in trial
+        for r in range(sum(bar_bool)-1):
+            phase_conditions = np.vstack((phase_conditions,key_list))
+
+    # define list with number of phases and their duration (duration of each must be the same)
+    design['phase_durations'] = np.repeat(max_trial_time/phase_conditions.shape[-1], phase_conditions.shape[-1])
+
+    ## now make phase condition array the same size as task,
+    # i.e. fill non bar trials with background
+    all_phase_conditions = (np.stack([np.tile('background', phase_conditions.shape[-1]) for i in range(trial_number)]))
+    all_phase_conditions[bar_bool] = phase_conditions.copy()
+
+    design['phase_conditions'] = all_phase_conditions.copy()
+
+    # total experiment time (in seconds)
+    design['total_time'] = trial_number * max_trial_time
+
+    # define time points for element orientation to change
+    design['ori_switch_times'] = get_ori_switch_times(settings, design['total_time'])
+
+    # for counting bars and checking responses in real time
+    design['bar_timing'] = [i*settings['mri']['TR'] for i,x in enumerate(bar_pass_direction_all) if x!='empty']
+
+    return design
+
+
+def plan_feature_design(settings, screen, att_color = 'color_green', rng = None, run_index = 0):
+
+    """ plan trial design of feature run (without window),
+    used by FeatureSession.create_trials and to rebuild run offline
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    screen : arr
+        array with display resolution
+    att_color : str
+        attended color condition
+    rng: numpy Generator/None
+        random generator for design (if None, uses a new unseeded one)
+    run_index : int
+        run number, to select chunk of bar position pairs (only if bar_pairs blocks_per_run is set)
+
+    Returns
+    -------
+    design : dict
+        dictionary with all trial design arrays (names as session attributes)
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    design = {}
+
+    ## set attended bar color
+    att_condition = [val for val in settings['stimuli']['feature']['conditions'] if att_color in val][0]
+    unatt_condition = [val for val in settings['stimuli']['feature']['conditions'] if att_color not in val][0]
+    design['att_condition'] = att_condition
+    design['unatt_condition'] = unatt_condition
+
+    ## get all possible bar positions
+
+    # define bar width
+    bar_width_ratio = settings['stimuli']['feature']['bar_width_ratio']
+    bar_width_pix = screen * bar_width_ratio
+    design['bar_width_pix'] = bar_width_pix
+
+    # define number of bars per direction
+    num_bars = np.array(settings['stimuli']['feature']['num_bar_position'])
+
+    # all possible positions in pixels [x,y] for midpoint of
+    # vertical bar passes,
+    ver_y = np.sort(np.concatenate((-np.arange(bar_width_pix[1]/2,screen[1]/2,bar_width_pix[1])[0:int(num_bars[1]/2)],
+                                    np.arange(bar_width_pix[1]/2,screen[1]/2,bar_width_pix[1])[0:int(num_bars[1]/2)])))
+
+    ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
+
+    # horizontal bar passes
+    hor_x = np.sort(np.concatenate((-np.arange(bar_width_pix[0]/2,screen[0]/2,bar_width_pix[0])[0:int(num_bars[0]/2)],
+                                    np.arange(bar_width_pix[0]/2,screen[0]/2,bar_width_pix[0])[0:int(num_bars[0]/2)])))
+
+    hor_bar_pos_pix = np.array([np.array([x,0]) for _,x in enumerate(hor_x)])
+
+    design['hor_bar_pos_pix'] = hor_bar_pos_pix
+    design['ver_bar_pos_pix'] = ver_bar_pos_pix
+
+    # bar position pairs of run - all possible pairs, 
+    # or balanced chunk of pairs (for finer grids, where all pairs would make run too long)
+    bar_pairs = None
+    if settings['stimuli']['feature']['bar_pairs']['blocks_per_run'] is not None:
+        bar_pairs = get_run_bar_pairs({'horizontal': hor_bar_pos_pix.shape[0], 'vertical': ver_bar_pos_pix.shape[0]}, 
+                                      run_index = run_index,
+                                      blocks_per_run = settings['stimuli']['feature']['bar_pairs']['blocks_per_run'],
+                                      orientations = ['vertical','horizontal'],
+                                      seed = settings['stimuli']['feature']['bar_pairs']['seed'])
+
+    # set bar midpoint position and direction for each condition
+    all_bar_pos = set_bar_positions(pos_dict = {'horizontal': hor_bar_pos_pix, 'vertical': ver_bar_pos_pix},
+                                    attend_condition = att_condition,
+                                    unattend_condition = unatt_condition,
+                                    attend_orientation = ['vertical','horizontal'],
+                                    unattend_orientation = ['vertical','horizontal'],
+                                    rng = rng,
+                                    pairs = bar_pairs)
+    design['all_bar_pos'] = all_bar_pos
+
+    # list with order of "type of stimuli" throughout experiment (called bar direction to make analogous with other class)
+    bar_pass_direction = settings['stimuli']['feature']['bar_pass_direction']
+
+    # number of TRs per "type of stimuli"
+    empty_TR = settings['stimuli']['feature']['empty_TR']
+    task_trial_TR = settings['stimuli']['feature']['task_trial_TR']
+
+    # set number of trials,
+    # codes of type of trial (empty, task) for all TRs,
+    # codes of bar direction/orientation (TR, bars), -1 if empty,
+    # midpoint position (x,y) of bars for all TRs (if empty, then nan)
+    trial_arrays = make_feature_trial_arrays(bar_pass_direction,
+                                             all_bar_pos,
+                                             empty_TR = empty_TR,
+                                             task_trial_TR = task_trial_TR)
+    trial_number = trial_arrays['trial_number']
+    trial_type_all, bar_pass_direction_all = decode_feature_trial_arrays(trial_arrays)
+
+    design['trial_number'] = trial_number
+    design['trial_type_codes'] = trial_arrays['trial_type_codes']
+    design['bar_direction_codes'] = trial_arrays['direction_codes']
+    design['trial_type_all'] = trial_type_all
+    design['bar_pass_direction_all'] = bar_pass_direction_all
+    design['bar_midpoint_all'] = trial_arrays['midpoints']
+
+    logger.info('Total number of (expected) TRs: %d', trial_number)
+
+    ## get eccentricity indice for all trials
+    # of attended and UNattended bar
+    ecc_ind_all = {}
+    ecc_ind_all[att_condition] = get_bar_eccentricity(all_bar_pos,
+                                                    hor_bar_pos_pix = hor_bar_pos_pix,
+                                                    ver_bar_pos_pix = ver_bar_pos_pix,
+                                                    bar_key = 'attended_bar')
+    ecc_ind_all[unatt_condition] = get_bar_eccentricity(all_bar_pos,
+                                                    hor_bar_pos_pix = hor_bar_pos_pix,
+                                                    ver_bar_pos_pix = ver_bar_pos_pix,
+                                                    bar_key = 'unattended_bar')
+    design['ecc_ind_all'] = ecc_ind_all
+
+    ## randomly assign which color the bar will have,
+    # for target bar (attended color)
+    ctask_ind_all = {}
+    ctask_ind_all[att_condition] = rng.integers(2, size = len(all_bar_pos['attended_bar']['bar_pass_direction_at_TR']))
+    # for distractor bar (unattended color)
+    ctask_ind_all[unatt_condition] = rng.integers(2, size = len(all_bar_pos['unattended_bar']['bar_pass_direction_at_TR']))
+    design['ctask_ind_all'] = ctask_ind_all
+
+    # set plotting order index, to randomize which bars appear on top, for all trials in all miniblocks
+    drawing_ind = []
+
+    for _, val in enumerate(trial_type_all):
+
+        if 'task' in val:
+            ind_list = np.arange(settings['stimuli']['feature']['num_bars'])
+            rng.shuffle(ind_list)
+
+            drawing_ind.append(ind_list)
+
+        else: # if not in miniblock, these are nan
+            drawing_ind.append([np.nan])
+
+    design['drawing_ind'] = drawing_ind
+
+    # if in scanner, we want it to be synced to trigger, so lets increase trial time (in seconds, like TR)
+    max_trial_time = 5 if settings['stimuli']['feature']['sync_scanner']==True else settings['mri']['TR']
+    design['max_trial_time'] = max_trial_time
+
+    # set phase conditions (for logging) and durations, for all trials
+    phase_conditions = []
+    phase_durations = []
+
+    for i in range(trial_number):
+
+        if 'task' in trial_type_all[i]:
+            phase_conditions.append(tuple(['stim','background']))
+            phase_durations.append(tuple([settings['stimuli']['feature']['bars_phase_dur'],
+                                          max_trial_time-settings['stimuli']['feature']['bars_phase_dur']]))
+
+        else:
+            phase_conditions.append(tuple([trial_type_all[i]]))
+            phase_durations.append(tuple([max_trial_time]))
+
+    design['phase_conditions'] = phase_conditions
+    design['phase_durations'] = phase_durations
+
+    # total experiment time (in seconds)
+    design['total_time'] = trial_number * max_trial_time
+
+    # define time points for element orientation to change
+    design['ori_switch_times'] = get_ori_switch_times(settings, design['total_time'])
+
+    # make boolean array to see which trials are stim trials
+    bar_bool = [True if x == 'task' else False for _,x in enumerate(trial_type_all)]
+    design['bar_bool'] = bar_bool
+    # time in seconds for when bar trial on screen
+    design['bar_timing'] = [x * settings['mri']['TR'] for x in np.where(bar_bool)[0]]
+
+    return design
+
+
+def plan_flicker_design(settings, screen, rng = None):
+
+    """ plan trial design of flicker run (without window),
+    used by FlickerSession.create_trials and to rebuild run offline
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    screen : arr
+        array with display resolution
+    rng: numpy Generator/None
+        random generator for design (if None, uses a new unseeded one)
+
+    Returns
+    -------
+    design : dict
+        dictionary with all trial design arrays (names as session attributes)
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    design = {}
+
+    ## get all possible bar positions
+
+    # define bar width
+    bar_width_ratio = settings['stimuli']['flicker']['bar_width_ratio']
+    bar_width_pix = screen * bar_width_ratio
+    design['bar_width_pix'] = bar_width_pix
+
+    # define number of bars per direction
+    num_bars = np.array(screen)/bar_width_pix; num_bars = np.array(num_bars,dtype=int)
+
+    # all possible positions in pixels [x,y] for for midpoint of
+    # vertical bar passes
+    ver_y = np.linspace((-screen[1]/2 + bar_width_pix[1]/2),
+                        (screen[1]/2 - bar_width_pix[1]/2),
+                        num_bars[1])
+
+    ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
+
+    # bar eccentricities we want to go through
+    design['bar_ecc_ind'] = settings['stimuli']['flicker']['bar_ecc_index']
+    # number of repetitions per ecc
+    design['num_rep_ecc'] = settings['stimuli']['flicker']['num_rep_ecc']
+
+    ## positions to put bars of square, per trial
+    # we swap so that 0 - furthest ecc; 3 - closest ecc (different from yml)
+    # to save coding hassle for now
+    bar_ecc_index_arr = np.tile(np.abs(np.array(design['bar_ecc_ind']) - 3), design['num_rep_ecc'])
+
+    ## make it a dict, for bookeeping
+    # set color comparisons first
+    ref_color = settings['stimuli']['flicker']['ref_color']
+    design['ref_color'] = ref_color
+
+    if ref_color in list(settings['stimuli']['conditions'].keys()): # if comparing red and green
+        updat_colors_keys = [c for c in list(settings['stimuli']['conditions'].keys()) if c not in ['background', ref_color] ]
+
+    else:
+        updat_colors_keys = []
+        for key in list(settings['stimuli']['feature']['task_colors'].keys()):
+            for name in settings['stimuli']['feature']['task_colors'][key]:
+                if name != ref_color:
+                    updat_colors_keys.append(name) # update all task colors that are not reference color
+
+    # color names to be updated
+    design['updat_colors_keys'] = np.array(updat_colors_keys)
+
+    # now make bar ecc index dictionary
+    bar_ecc_index_dict = {}
+    # and get eccentricity (in pixels) of bar position for trial (if empty, then nan)
+    ecc_midpoint_dict = {}
+
+    for col in updat_colors_keys:
+
+        bar_ecc_index_dict[col] = bar_ecc_index_arr.copy()
+        # shuffle it to make it random
+        rng.shuffle(bar_ecc_index_dict[col])
+
+        ecc_midpoint_dict[col] = ver_bar_pos_pix[bar_ecc_index_dict[col]][...,1]
+
+    # save here so accessible throughout
+    design['bar_ecc_index_dict'] = bar_ecc_index_dict
+    design['ecc_midpoint_dict'] = ecc_midpoint_dict
+
+    ## save eccentricities in array, to use in file naming
+    all_ecc_array = (np.hstack([bar_ecc_index_dict[x] for x in bar_ecc_index_dict.keys()]))
+    design['all_ecc_array'] = all_ecc_array*-1 +3
+
+    # save total number of trials (one eccentricity per trial)
+    trial_number = len(bar_ecc_index_arr)*len(updat_colors_keys)
+    design['trial_number'] = trial_number
+    logger.info('Total number of trials: %d', trial_number)
+
+    # max trial time
+    max_trial_time = settings['stimuli']['flicker']['max_trial_time']*60
+    design['max_trial_time'] = max_trial_time
+
+    # define how many times square colors switch, according to flick rate defined
+    flick_rate = settings['stimuli']['flicker']['flick_rate']
+
+    # number of samples in trial
+    n_samples = max_trial_time * flick_rate
+
+    # get condition names for each trial
+    for i, cname in enumerate(updat_colors_keys):
+
+        key_list = []
+
+        if ref_color in list(settings['stimuli']['conditions'].keys()): # if comparing red and green
+
+            for key in settings['stimuli']['conditions']:
+                if key != 'background':
+                    key_list.append(key)
+
+        else: # other color variants
+            key_list = [ref_color, cname]
+
+        # repeat keys, so for each trial it shows each condition X times
+        key_list = np.array(key_list*round(n_samples/len(key_list)))
+        key_list = list(key_list) + list(key_list)
+        phase_conditions = key_list
+
+        for r in range(len(bar_ecc_index_arr)-1):
+            phase_conditions = np.vstack((phase_conditions,key_list))
+
+        if i == 0:
+            all_phase_conditions = phase_conditions.copy()
+        else:
+            all_phase_conditions = np.vstack((all_phase_conditions,phase_conditions))
+
+    # define list with number of phases and their duration (duration of each must be the same)
+    design['phase_durations'] = np.repeat(max_trial_time/all_phase_conditions.shape[-1], all_phase_conditions.shape[-1])
+    design['phase_conditions'] = all_phase_conditions
+
+    # eccentricity index and midpoint of each trial
+    bar_ecc_index_all = []
+    ecc_midpoint_all = []
+    c_counter = 0
+    for i in range(trial_number):
+        if i in [int(len(bar_ecc_index_arr)*d) for d in np.arange(len(updat_colors_keys)) if d]:
+            c_counter += 1 # cheap trick to not worry about colors and trial numbers
+
+        bar_ecc_index_all.append(bar_ecc_index_dict[updat_colors_keys[c_counter]][int(i-len(bar_ecc_index_arr)*c_counter)])
+        ecc_midpoint_all.append(ecc_midpoint_dict[updat_colors_keys[c_counter]][int(i-len(bar_ecc_index_arr)*c_counter)])
+
+    design['bar_ecc_index_all'] = np.array(bar_ecc_index_all)
+    design['ecc_midpoint_all'] = np.array(ecc_midpoint_all)
+
+    # total experiment time (in seconds)
+    design['total_time'] = trial_number * max_trial_time
+
+    # define time points for element orientation to change
+    design['ori_switch_times'] = get_ori_switch_times(settings, design['total_time'])
+
+    return design
+
+
+def get_design_settings(settings, task):
+
+    """ get settings read by design planner of task (nested dict, with only the settings in DESIGN_SETTINGS)
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    task : str
+        task name ('pRF', 'FA' or 'flicker')
+    """
+
+    design_settings = {}
+
+    for path in DESIGN_SETTINGS[task]:
+        val = settings
+        out = design_settings
+
+        for name in path[:-1]:
+            val = val[name]
+            out = out.setdefault(name, {})
+
+        out[path[-1]] = val[path[-1]]
+
+    return design_settings
+
+
+def get_design_key(settings, task, seed, screen, att_color = None, run_index = 0):
+
+    """ get hash of everything the trial design depends on
+    (settings read by planner, task, design seed and display resolution)
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    task : str
+        task name ('pRF', 'FA' or 'flicker')
+    seed : int
+        seed of design random generator
+    screen : arr
+        array with display resolution
+    att_color : str/None
+        attended color condition (only for feature task)
+    run_index : int
+        run number (only for feature task, if bar pairs are chunked per run)
+
+    Returns
+    -------
+    key : str
+        hexadecimal hash string
+    """
+
+    relevant = {'version': DESIGN_CACHE_VERSION,
+                'task': task,
+                'seed': int(seed),
+                'screen': [float(val) for val in np.asarray(screen)],
+                'settings': get_design_settings(settings, task)}
+
+    if task == 'FA':
+        relevant['att_color'] = att_color
+
+        if settings['stimuli']['feature']['bar_pairs']['blocks_per_run'] is not None:
+            relevant['run_index'] = int(run_index)
+
+    return hashlib.sha1(json.dumps(relevant, sort_keys = True, default = str).encode('utf8')).hexdigest()
+
+
+def get_design(task, settings, screen, seed, rng = None, cache_dir = None, att_color = 'color_green', run_index = 0):
+
+    """ get trial design of run, loading it from cache if it was already planned
+    with the same settings and seed (otherwise plan it and store in cache)
+
+    Parameters
+    ----------
+    task : str
+        task name ('pRF', 'FA' or 'flicker')
+    settings : dict
+        experiment settings dict
+    screen : arr
+        array with display resolution
+    seed : int
+        seed of design random generator (used in cache key)
+    rng: numpy Generator/None
+        random generator for design, seeded with seed
+    cache_dir : str/None
+        absolute path to cache folder (if None, design is not cached)
+    att_color : str
+        attended color condition (only for feature task)
+    run_index : int
+        run number (only for feature task, selects chunk of bar position pairs)
+
+    Returns
+    -------
+    design : dict
+        dictionary with all trial design arrays (names as session attributes)
+    """
+
+    if task not in DESIGN_SETTINGS:
+        raise NameError('No design planner for task %s'%task)
+
+    # planner only sees settings hashed in cache key
+    design_settings = get_design_settings(settings, task)
+
+    if task == 'pRF':
+        planner = lambda: plan_prf_design(design_settings, screen, rng = rng)
+    elif task == 'FA':
+        planner = lambda: plan_feature_design(design_settings, screen, att_color = att_color, rng = rng, run_index = run_index)
+    elif task == 'flicker':
+        planner = lambda: plan_flicker_design(design_settings, screen, rng = rng)
+
+    if cache_dir is None:
+        return planner()
+
+    key = get_design_key(settings, task, seed, screen, att_color = att_color if task == 'FA' else None, run_index = run_index)
+    cache_file = op.join(cache_dir, 'design_task-%s_%s.pkl'%(task, key))
+
+    if op.exists(cache_file):
+        logger.info('loading design from cache %s', cache_file)
+
+        with open(cache_file, 'rb') as f_in:
+            design = pickle.load(f_in)
+
+    else:
+        design = planner()
+
+        if not op.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        # write to temporary file first, so a crash never leaves a partial design in cache
+        with open(cache_file+'.tmp', 'wb') as f_out:
+            pickle.dump(design, f_out, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(cache_file+'.tmp', cache_file)
+
+    return design
+
+
+def validate_design(design, task):
+
+    """ sanity check planned trial design, 
+    to catch inconsistent designs before the participant is in the scanner
+
+    Parameters
+    ----------
+    design : dict
+        dictionary with all trial design arrays (as returned by planners)
+    task : str
+        task name ('pRF', 'FA' or 'flicker')
+
+    Returns
+    -------
+    errors : list
+        list of strings describing what is wrong (empty if design is valid)
+    """
+
+    errors = []
+    trial_number = design['trial_number']
+
+    if len(design['phase_conditions']) != trial_number:
+        errors.append('phase conditions for %i trials, expected %i'%(len(design['phase_conditions']), trial_number))
+
+    # phases should fill each trial
+    phase_durations = design['phase_durations'] if task == 'FA' else [design['phase_durations']]
+    if not np.all([np.isclose(np.sum(dur), design['max_trial_time']) for dur in phase_durations]):
+        errors.append('phase durations do not add up to trial time')
+
+    if not np.isclose(design['total_time'], trial_number * design['max_trial_time']):
+        errors.append('total time does not match number of trials')
+
+    if task in ['pRF', 'FA']:
+
+        for key in ['bar_pass_direction_all', 'bar_midpoint_all', 'bar_bool']:
+            if len(design[key]) != trial_number:
+                errors.append('%s has %i trials, expected %i'%(key, len(design[key]), trial_number))
+
+        num_bar_trials = int(np.sum(design['bar_bool']))
+
+        if len(design['bar_timing']) != num_bar_trials:
+            errors.append('%i bar onsets for %i bar trials'%(len(design['bar_timing']), num_bar_trials))
+
+        # bar trials must have a bar position
+        bar_midpoints = np.array([np.asarray(design['bar_midpoint_all'][i], dtype = float) for i in np.where(design['bar_bool'])[0]])
+        if np.isnan(bar_midpoints).any():
+            errors.append('bar trials without bar position')
+
+        if task == 'FA':
+            # attended and unattended bars should never be in the same place
+            if np.any(np.all(bar_midpoints[:, 0] == bar_midpoints[:, 1], axis = -1) & 
+                      np.array([np.all(np.asarray(design['bar_pass_direction_all'][i]) == design['bar_pass_direction_all'][i][0]) 
+                                for i in np.where(design['bar_bool'])[0]])):
+                errors.append('attended and unattended bars overlap')
+
+            for cond, ind in design['ctask_ind_all'].items():
+                if len(ind) != num_bar_trials:
+                    errors.append('%i task colors for %s, expected %i'%(len(ind), cond, num_bar_trials))
+
+    elif task == 'flicker':
+
+        if len(design['bar_ecc_index_all']) != trial_number:
+            errors.append('eccentricity for %i trials, expected %i'%(len(design['bar_ecc_index_all']), trial_number))
+
+    return errors
@@ -0,0 +1,170 @@
+
+import numpy as np
+
+from psychopy import visual, event
+import psychopy.tools.colorspacetools as ct
+
+from utils import get_element_state, near_power_of_2
+
+
+# max number of textures kept in cache (flicker task makes a new color every frame)
+MAX_TEX_CACHE = 256
+
+
+def update_elements(ElementArrayStim, condition_settings, this_phase, elem_positions, grid_pos,
+                   	monitor, screen = np.array([1680,1050]), position_jitter = None, orientation = True, 
+                    background_contrast = None, luminance = None, update_settings = False, new_color = False, 
+                    override_contrast = False, contrast_val = 1, ori_rng = None, jitter_rng = None, tex_cache = None, buffers = None):
+    
+    """ update element array settings
+    
+    Parameters
+    ----------
+    ElementArrayStim: Psychopy object
+    	ElementArrayStim to be updated 
+    condition_settings: dict
+        dictionary with all condition settings
+    this_phase: str
+        string with name of condition to be displayed
+    elem_positions: arr
+         numpy array with element positions to be updated and shown (N,2) -> (number of positions, [x,y])
+         to be used for opacity update
+    grid_pos: arr
+        numpy array with element positions (N,2) of whole grid -> (number of positions, [x,y])
+    monitor: object
+        monitor object (to get monitor references for deg2pix transformation)
+    screen: arr
+        array with display resolution
+    luminance: float or None
+        luminance increment to alter color (used for flicker task)
+    update_settings: bool
+        choose if we want to update settings or not (mainly for color changes)
+    new_color: array
+        if we are changing color to be one not represented in settings (ca also be False if no new color used)
+    ori_rng: numpy Generator/None
+        random generator for element orientations
+    jitter_rng: numpy Generator/None
+        random generator for element position jitter
+    tex_cache: dict/None
+        dictionary with textures already made, per resolution and color (if None, texture made every time)
+    buffers: dict/None
+        preallocated element arrays of this element array (see utils.make_element_buffers)
+        
+    """
+
+    element_state, condition_settings = get_element_state(condition_settings, this_phase, elem_positions, grid_pos, 
+                                                          position_jitter = position_jitter, 
+                                                          orientation = orientation, 
+                                                          luminance = luminance, 
+                                                          new_color = new_color, 
+                                                          override_contrast = override_contrast, 
+                                                          contrast_val = contrast_val,
+                                                          ori_rng = ori_rng,
+                                                          jitter_rng = jitter_rng,
+                                                          buffers = buffers)
+    hsv_color = element_state['hsv_color']
+
+    grat_res = near_power_of_2(ElementArrayStim.sizes[0][0],near='previous') # use power of 2 as grating res, to avoid error
+
+    tex_key = (grat_res, tuple(np.round(hsv_color, 6)))
+
+    if tex_cache is not None and tex_key in tex_cache:
+        elementTex = tex_cache[tex_key]
+    else:
+        # initialise grating
+        grating = visual.filters.makeGrating(res=grat_res)
+        grating_norm = (grating - np.min(grating))/(np.max(grating) - np.min(grating)) # normalize between 0 and 1
+        
+        # initialise a base texture 
+        colored_grating = np.ones((grat_res, grat_res, 3)) 
+
+        # replace the base texture red/green channel with the element color value, and the value channel with the grating
+
+        colored_grating[..., 0] = hsv_color[0]
+        colored_grating[..., 1] = hsv_color[1]
+        colored_grating[..., 2] = grating_norm * hsv_color[2]
+
+        elementTex = ct.hsv2rgb(colored_grating) # convert back to rgb
+
+        if tex_cache is not None:
+            if len(tex_cache) >= MAX_TEX_CACHE:
+                tex_cache.clear()
+            tex_cache[tex_key] = elementTex
+
+    if element_state['oris'] is not None:
+        ElementArrayStim.setOris(element_state['oris'])
+
+    if element_state['xys'] is not None:
+        ElementArrayStim.setXYs(element_state['xys'])
+
+    # set all of the above settings
+    # (texture only uploaded when it changed)
+    if getattr(ElementArrayStim, 'tex', None) is not elementTex:
+        ElementArrayStim.setTex(elementTex)
+    ElementArrayStim.setSfs(element_state['sfs'])
+    ElementArrayStim.setOpacities(element_state['opacities'])
+    ElementArrayStim.setColors(element_state['colors'], 'rgb')
+    ElementArrayStim.setContrs(element_state['contrs'])
+    #print(element_contrast[list_indices[0]])
+
+    # return updated settings, if such is the case
+    if update_settings == True: 
+        return(ElementArrayStim,condition_settings)
+    else:
+        return(ElementArrayStim)
+
+
+def make_instructions_text(win, instructions, color = (1, 1, 1), font = 'Helvetica Neue', pos = (0, 0), height = 40, 
+                           italic = True, anchorHoriz  = 'center', anchorVert = 'center'):
+
+    """ make text stimulus for instructions (see draw_instructions) """
+
+    return visual.TextStim(win = win,
+                        text = instructions,
+                        color = color, 
+                        font = font, 
+                        pos = pos, 
+                        height = height,
+                        italic = italic, 
+                        anchorHoriz = anchorHoriz, 
+                        anchorVert = anchorVert
+                        )
+
+
+def draw_instructions(win, instructions, keys = ['b'], visual_obj = [], 
+                      color = (1, 1, 1), font = 'Helvetica Neue', pos = (0, 0), height = 40, #.65,
+                        italic = True, anchorHoriz  = 'center', anchorVert = 'center', clear_events = True):
+    
+    """ draw instructions on screen
+    
+    Parameters
+    ----------
+    win : object
+        window object to draw on
+    instructions : str
+        instruction string to draw 
+    key: list
+        list of keys to skip instructions
+    visual_obj: list
+        if not empty, should have psychopy visual objects (to add to the display ex: side rectangles to limit display)
+    clear_events: bool
+        if False, keys pressed before instructions were drawn also count (ex: trigger during warm up)
+        
+    """
+    
+    text = make_instructions_text(win, instructions, color = color, font = font, pos = pos, height = height,
+                                  italic = italic, anchorHoriz = anchorHoriz, anchorVert = anchorVert)
+    
+    # draw text again
+    text.draw()
+
+    if len(visual_obj)>0:
+        for w in range(len(visual_obj)):
+            visual_obj[w].draw()
+            
+    win.flip()
+
+    key_pressed = event.waitKeys(keyList = keys, clearEvents = clear_events)
+
+    return(key_pressed)
+
@@ -0,0 +1,281 @@
+
+import queue
+import threading
+import numpy as np
+
+from logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# pylink value of gaze when eye is not tracked
+MISSING_GAZE = -32768
+
+
+def tracker_gaze_getter(tracker, win_size):
+
+    """ get function that returns newest gaze sample of (pylink) eyetracker,
+    in pixels relative to screen center (y up), or None if there is no new sample since last call
+
+    Parameters
+    ----------
+    tracker : pylink EyeLink/SimulatedTracker
+        eyetracker, with getNewestSample method
+    win_size : list/arr
+        window size [horizontal, vertical] in pixels
+    """
+
+    last_time = [None]
+
+    def get_gaze():
+
+        sample = tracker.getNewestSample()
+
+        # tracker returns same sample again if polled faster than its sample rate
+        if sample is None or sample.getTime() == last_time[0]:
+            return None
+        last_time[0] = sample.getTime()
+
+        if sample.isLeftSample():
+            x, y = sample.getLeftEye().getGaze()
+        elif sample.isRightSample():
+            x, y = sample.getRightEye().getGaze()
+        else:
+            return None
+
+        if x <= MISSING_GAZE or y <= MISSING_GAZE: # blink or eye lost
+            return np.nan, np.nan
+
+        return x - win_size[0]/2, win_size[1]/2 - y
+
+    return get_gaze
+
+
+class FixationMonitor(object):
+
+    def __init__(self, get_gaze, clock, radius = 50, min_break = .1, poll_interval = .002, buffer_size = 10000):
+
+        """ Initializes FixationMonitor object, that polls gaze from a background thread
+        (so nothing is added to the drawing loop), keeps the latest samples in a ring buffer,
+        and flags fixation breaks - gaze outside radius around fixation cross for at least min_break seconds.
+        Flags are collected at trial boundaries with get_breaks
+
+        Parameters
+        ----------
+        get_gaze : function
+            returns newest gaze (x, y) in pixels relative to screen center, nan if eye not tracked, or None
+        clock : psychopy Clock
+            session clock, to time stamp samples
+        radius : float
+            fixation radius (in pixels)
+        min_break : float
+            minimum time outside fixation radius counted as fixation break (in seconds)
+        poll_interval : float
+            time in between gaze polls (in seconds)
+        buffer_size : int
+            number of gaze samples kept in ring buffer
+        """
+
+        self.get_gaze = get_gaze
+        self.clock = clock
+        self.radius = radius
+        self.min_break = min_break
+        self.poll_interval = poll_interval
+
+        # ring buffer of (time, x, y) samples
+        self.buffer = np.full((buffer_size, 3), np.nan)
+        self.n_samples = 0
+        self.lock = threading.Lock()
+
+        # fixation breaks (start, end, max distance), handed over to session
+        self.breaks = queue.SimpleQueue()
+        self.n_breaks = 0
+
+        # state of current excursion outside radius
+        self.break_start = None
+        self.break_end = None
+        self.break_max_dist = 0
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+
+        """ start polling thread """
+
+        self.stop_event.clear()
+        self.thread = threading.Thread(target = self._poll_loop, daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+
+        """ stop polling thread (flags excursion still going on, if long enough) """
+
+        if self.thread is None:
+            return
+
+        self.stop_event.set()
+        self.thread.join()
+        self.thread = None
+
+        self._end_excursion()
+
+
+    def get_breaks(self):
+
+        """ fixation breaks flagged since last call (list of (start, end, max distance)) """
+
+        breaks = []
+        while True:
+            try:
+                breaks.append(self.breaks.get_nowait())
+            except queue.Empty:
+                return breaks
+
+
+    def discard_breaks(self):
+
+        """ drop fixation breaks flagged so far, and excursion going on (ex: when session clock is reset) """
+
+        self.get_breaks()
+        self.break_start = None
+
+
+    def latest(self, n = 1000):
+
+        """ copy of latest n samples in ring buffer (time, x, y), oldest first """
+
+        with self.lock:
+            n = min(n, self.n_samples, self.buffer.shape[0])
+            ind = (self.n_samples - n + np.arange(n)) % self.buffer.shape[0]
+
+            return self.buffer[ind].copy()
+
+
+    def add_sample(self, t, x, y):
+
+        """ add one gaze sample to ring buffer, and update fixation break state """
+
+        with self.lock:
+            self.buffer[self.n_samples % self.buffer.shape[0]] = (t, x, y)
+            self.n_samples += 1
+
+        dist = np.hypot(x, y)
+
+        if dist > self.radius: # nan (eye not tracked) is not counted as outside
+            if self.break_start is None:
+                self.break_start = t
+                self.break_max_dist = 0
+            self.break_end = t
+            self.break_max_dist = max(self.break_max_dist, dist)
+
+        elif not np.isnan(dist):
+            self._end_excursion()
+
+
+    def _end_excursion(self):
+
+        if self.break_start is not None and (self.break_end - self.break_start) >= self.min_break:
+            self.breaks.put((self.break_start, self.break_end, self.break_max_dist))
+            self.n_breaks += 1
+
+        self.break_start = None
+
+
+    def _poll_loop(self):
+
+        while not self.stop_event.wait(self.poll_interval):
+
+            gaze = self.get_gaze()
+
+            if gaze is not None:
+                self.add_sample(self.clock.getTime(), *gaze)
+
+        logger.debug('fixation monitor stopped, %i samples, %i breaks', self.n_samples, self.n_breaks)
+
+
+class SimulatedSample(object):
+
+    """ gaze sample of SimulatedTracker, with the pylink sample methods used by tracker_gaze_getter """
+
+    def __init__(self, time, x, y, eye = 'left'):
+
+        self.time = time
+        self.gaze = (x, y)
+        self.eye = eye
+
+    def getTime(self):
+        return self.time
+
+    def isLeftSample(self):
+        return self.eye == 'left'
+
+    def isRightSample(self):
+        return self.eye == 'right'
+
+    def getLeftEye(self):
+        return self
+
+    def getRightEye(self):
+        return self
+
+    def getGaze(self):
+        return self.gaze
+
+
+class SimulatedTracker(object):
+
+    def __init__(self, times, x, y, clock, eye = 'left'):
+
+        """ Initializes SimulatedTracker object, stand-in for the eyetracker
+        that replays a gaze trace in time with the session clock (to test gaze-contingent code without hardware)
+
+        Parameters
+        ----------
+        times : arr
+            time of samples (in seconds, session clock)
+        x : arr
+            horizontal gaze position (in pixels, tracker coordinates - origin top left)
+        y : arr
+            vertical gaze position (in pixels, tracker coordinates - origin top left, y down)
+        clock : psychopy Clock
+            session clock
+        eye : str
+            eye tracked ('left' or 'right')
+        """
+
+        self.times = np.asarray(times, dtype = float)
+        self.x = np.nan_to_num(np.asarray(x, dtype = float), nan = MISSING_GAZE)
+        self.y = np.nan_to_num(np.asarray(y, dtype = float), nan = MISSING_GAZE)
+        self.clock = clock
+        self.eye = eye
+
+        # samples are only made once, so same sample is returned until next one is due
+        self.last_ind = -1
+        self.last_sample = None
+
+
+    @classmethod
+    def from_gaze_file(cls, gaze_file, win_size, clock, eye = 'left'):
+
+        """ make tracker that replays gaze saved by gaze.ingest_asc (_gaze.npy) """
+
+        gaze = np.load(gaze_file, mmap_mode = 'r')
+
+        return cls(gaze[:, 0], gaze[:, 1] + win_size[0]/2, win_size[1]/2 - gaze[:, 2], clock, eye = eye)
+
+
+    def getNewestSample(self):
+
+        ind = np.searchsorted(self.times, self.clock.getTime(), side = 'right') - 1
+
+        if ind < 0:
+            return None
+
+        if ind != self.last_ind:
+            self.last_ind = ind
+            self.last_sample = SimulatedSample(self.times[ind]*1000, self.x[ind], self.y[ind], eye = self.eye)
+
+        return self.last_sample
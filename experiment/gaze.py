@@ -0,0 +1,343 @@
+
+# import relevant packages
+import io
+import re
+import struct
+import argparse
+import itertools
+import os.path as op
+import yaml
+import numpy as np
+import pandas as pd
+
+from timeline import Timeline
+from journal import NON_DISPLAY_EVENTS
+
+
+# columns of gaze array (time in seconds, gaze position in pixels relative to screen center, y up)
+GAZE_COLUMNS = ['time', 'x', 'y', 'pupil']
+
+# size of .npy header written before number of samples is known (rewritten at the end, same size)
+NPY_HEADER_SIZE = 128
+
+
+def write_npy_header(f_out, n_rows, n_cols = len(GAZE_COLUMNS)):
+
+    """ write header of float64 .npy file with fixed size (padded with spaces, as numpy does),
+    so it can be written again once the number of rows is known """
+
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%i, %i), }"%(n_rows, n_cols)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+
+    f_out.seek(0)
+    f_out.write(np.lib.format.magic(1, 0) + struct.pack('<H', len(header)) + header.encode('latin1'))
+
+
+def parse_asc_lines(lines):
+
+    """ parse lines of EyeLink ascii export (edf2asc), monocular recording
+
+    Parameters
+    ----------
+    lines : list
+        lines of asc file
+
+    Returns
+    -------
+    samples : arr
+        samples (#samples, 4) - tracker time (ms), x, y (pixels, origin top left) and pupil size,
+        nan when eye was not tracked
+    messages : list
+        (tracker time, message) of MSG lines
+    blinks : list
+        (start, end) tracker times of EBLINK lines
+    """
+
+    # sample lines start with time stamp
+    sample_lines = [line for line in lines if line[:1].isdigit()]
+
+    if len(sample_lines) > 0:
+        samples = pd.read_csv(io.StringIO(''.join(sample_lines)), sep = '\t', header = None, usecols = [0, 1, 2, 3],
+                              na_values = ['.'], skipinitialspace = True, dtype = float).values
+    else:
+        samples = np.zeros((0, 4))
+
+    messages = []
+    blinks = []
+
+    for line in lines:
+        if line.startswith('MSG'):
+            _, t, msg = line.rstrip('\n').split(None, 2)
+            messages.append((float(t), msg))
+
+        elif line.startswith('EBLINK'):
+            _, _, start, end = line.split()[:4]
+            blinks.append((float(start), float(end)))
+
+    return samples, messages, blinks
+
+
+def get_clock_offset(messages, events_df):
+
+    """ offset between tracker clock (in seconds) and session clock,
+    from phase onset messages sent by exptools trials (ex: 'start_type-stim_trial-3_phase-0')
+
+    Parameters
+    ----------
+    messages : pandas DataFrame
+        tracker messages, with 'time' (ms) and 'message' columns
+    events_df : pandas DataFrame
+        events of run (as in _events.tsv)
+    """
+
+    ids = messages['message'].str.extract(r'trial-(\d+)_phase-(\d+)').dropna().astype(int)
+    ids.columns = ['trial_nr', 'phase']
+    ids['tracker_time'] = messages.loc[ids.index, 'time'].values/1000
+
+    phase_df = events_df[~events_df['event_type'].isin(NON_DISPLAY_EVENTS)]
+    matched = ids.merge(phase_df[['trial_nr', 'phase', 'onset']], on = ['trial_nr', 'phase'])
+
+    if matched.shape[0] == 0:
+        raise ValueError('No phase onset messages of events file found in tracker messages')
+
+    return float(np.median(matched['tracker_time'] - matched['onset']))
+
+
+def ingest_asc(asc_file, output_file, win_size, events_df = None, chunk_lines = 500000):
+
+    """ read EyeLink ascii export in chunks, and write samples to float64 .npy file (to load memory-mapped).
+    Once all samples are written, time is aligned to session clock (in seconds) and gaze position
+    set relative to screen center (y up, as psychopy pixel units), in place
+
+    Parameters
+    ----------
+    asc_file : str
+        absolute path to asc file of run
+    output_file : str
+        absolute path to output gaze array (.npy)
+    win_size : list/arr
+        window size [horizontal, vertical] in pixels
+    events_df : pandas DataFrame/None
+        events of run, to align clocks (if None, time is tracker time in seconds)
+    chunk_lines : int
+        number of lines read at a time
+
+    Returns
+    -------
+    gaze : memmap
+        gaze array (#samples, 4), see GAZE_COLUMNS
+    events_df : pandas DataFrame
+        blinks (start/end in seconds) and tracker messages
+    """
+
+    all_messages = []
+    all_blinks = []
+    n_rows = 0
+
+    with open(asc_file, 'r', encoding = 'latin1') as f_in, open(output_file, 'wb') as f_out:
+
+        write_npy_header(f_out, 0)
+
+        while True:
+            lines = list(itertools.islice(f_in, chunk_lines))
+            if len(lines) == 0:
+                break
+
+            samples, messages, blinks = parse_asc_lines(lines)
+
+            samples.astype('<f8').tofile(f_out)
+            n_rows += samples.shape[0]
+
+            all_messages += messages
+            all_blinks += blinks
+
+        write_npy_header(f_out, n_rows)
+
+    messages = pd.DataFrame(all_messages, columns = ['time', 'message'])
+    offset = 0 if events_df is None else get_clock_offset(messages, events_df)
+
+    ## align, in place (chunks of memory-mapped array)
+    gaze = np.load(output_file, mmap_mode = 'r+')
+
+    for start in range(0, n_rows, chunk_lines):
+        chunk = gaze[start:start+chunk_lines]
+        chunk[:, 0] = chunk[:, 0]/1000 - offset
+        chunk[:, 1] = chunk[:, 1] - win_size[0]/2
+        chunk[:, 2] = win_size[1]/2 - chunk[:, 2]
+
+    gaze.flush()
+
+    blinks = np.array(all_blinks).reshape(-1, 2)/1000 - offset
+
+    gaze_events = pd.concat([pd.DataFrame({'type': 'blink', 'start': blinks[:, 0], 'end': blinks[:, 1], 'message': None}),
+                             pd.DataFrame({'type': 'message', 'start': messages['time'].values/1000 - offset,
+                                           'end': np.nan, 'message': messages['message'].values})], ignore_index = True)
+
+    return gaze, gaze_events
+
+
+def count_breaks(start_t, end_t, start_pos, min_break, n_trials):
+
+    """ number of fixation breaks per trial, from runs of samples outside fixation radius
+    (runs at least min_break long, counted in trial where they start) """
+
+    is_break = ((end_t - start_t) >= min_break) & (start_pos >= 0)
+
+    return np.bincount(start_pos[is_break].astype(int), minlength = n_trials)
+
+
+def gaze_per_trial(gaze, timeline, blinks = np.zeros((0, 2)), trial_duration = 1.6, radius = 1.5, pix_per_deg = 1,
+                   min_break = .1, chunk_rows = 1000000):
+
+    """ fixation metrics for each trial (TR) of run, vectorized over memory-mapped gaze array
+    (in chunks, so memory does not grow with recording length - fixation breaks going on at end of chunk are carried over)
+
+    Parameters
+    ----------
+    gaze : arr
+        gaze array (#samples, 4), see GAZE_COLUMNS (time in session clock)
+    timeline : Timeline
+        timeline of run (ex: Timeline.from_events), trial onsets and bar trials
+    blinks : arr
+        (start, end) of blinks (in seconds, session clock)
+    trial_duration : float
+        duration of trials (samples after last onset + duration are left out)
+    radius : float
+        fixation radius around fixation cross (screen center), in degrees
+    pix_per_deg : float
+        pixels per degree of visual angle
+    min_break : float
+        minimum time outside fixation radius counted as fixation break (in seconds)
+    chunk_rows : int
+        number of samples processed at a time
+
+    Returns
+    -------
+    trial_df : pandas DataFrame
+        one row per trial - number of samples, fraction of valid samples (eye tracked, not in blink),
+        mean and max distance from fixation (deg), fraction of valid samples outside radius,
+        number of fixation breaks and of blinks starting in trial
+    """
+
+    n_trials = len(timeline.trial_onsets)
+    n_samples = gaze.shape[0]
+
+    counts = {name: np.zeros(n_trials) for name in ['n_samples', 'n_valid', 'sum_dist', 'n_outside', 'n_breaks']}
+    max_dist = np.zeros(n_trials)
+
+    # run of samples outside radius still going on at end of previous chunk (start time, trial position),
+    # and time of last sample of previous chunk
+    open_run = None
+    last_t = np.nan
+
+    for start in range(0, n_samples, chunk_rows):
+        chunk = np.asarray(gaze[start:start+chunk_rows])
+        t = chunk[:, 0]
+
+        # position of trial in timeline (-1 if before first or after last trial)
+        pos = np.searchsorted(timeline.trial_onsets, t, side = 'right') - 1
+        pos[(pos >= 0) & (t >= timeline.trial_onsets[np.maximum(pos, 0)] + trial_duration)] = -1
+
+        # samples in blinks are not valid
+        in_blink = (np.searchsorted(blinks[:, 0], t, side = 'right') - np.searchsorted(blinks[:, 1], t, side = 'left')) > 0
+        dist = np.sqrt(chunk[:, 1]**2 + chunk[:, 2]**2)/pix_per_deg
+        valid = ~np.isnan(dist) & ~in_blink
+
+        in_run = pos >= 0
+        counts['n_samples'] += np.bincount(pos[in_run], minlength = n_trials)
+        counts['n_valid'] += np.bincount(pos[in_run & valid], minlength = n_trials)
+        counts['sum_dist'] += np.bincount(pos[in_run & valid], weights = dist[in_run & valid], minlength = n_trials)
+        counts['n_outside'] += np.bincount(pos[in_run & valid], weights = dist[in_run & valid] > radius, minlength = n_trials)
+        np.maximum.at(max_dist, pos[in_run & valid], dist[in_run & valid])
+
+        ## fixation breaks - runs of samples outside radius, counted in trial where they start
+        outside = valid & (dist > radius)
+        change = np.diff(np.r_[int(open_run is not None), outside.astype(np.int8), 0])
+        run_starts, run_ends = np.where(change == 1)[0], np.where(change == -1)[0]
+
+        start_t, start_pos = t[run_starts], pos[run_starts]
+        if open_run is not None:
+            start_t, start_pos = np.r_[open_run[0], start_t], np.r_[open_run[1], start_pos]
+
+        # time of last sample of each run (run that ends at first sample of chunk ended in previous chunk)
+        end_t = np.where(run_ends > 0, t[np.maximum(run_ends - 1, 0)], last_t)
+
+        # run still going on at end of chunk is carried over
+        open_run = None
+        if outside[-1]:
+            open_run = (start_t[-1], start_pos[-1])
+            start_t, start_pos, end_t = start_t[:-1], start_pos[:-1], end_t[:-1]
+
+        counts['n_breaks'] += count_breaks(start_t, end_t, start_pos, min_break, n_trials)
+        last_t = t[-1]
+
+    if open_run is not None:
+        counts['n_breaks'] += count_breaks(np.array([open_run[0]]), np.array([last_t]), np.array([open_run[1]]), 
+                                           min_break, n_trials)
+
+    blink_pos = np.searchsorted(timeline.trial_onsets, blinks[:, 0], side = 'right') - 1
+
+    n_valid = np.maximum(counts['n_valid'], 1)
+
+    return pd.DataFrame({'trial_nr': timeline.trial_nrs,
+                         'bar': np.isin(timeline.trial_nrs, timeline.bar_trials),
+                         'n_samples': counts['n_samples'].astype(int),
+                         'valid_fraction': counts['n_valid']/np.maximum(counts['n_samples'], 1),
+                         'mean_dist': np.where(counts['n_valid'] > 0, counts['sum_dist']/n_valid, np.nan),
+                         'max_dist': np.where(counts['n_valid'] > 0, max_dist, np.nan),
+                         'outside_fraction': counts['n_outside']/n_valid,
+                         'n_breaks': counts['n_breaks'].astype(int),
+                         'n_blinks': np.bincount(blink_pos[blink_pos >= 0], minlength = n_trials)})
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Ingest EyeLink ascii export of run, and compute fixation metrics per trial')
+    parser.add_argument('asc_file', type = str, help = 'path to asc file of run (<output_str>.asc)')
+    parser.add_argument('--events_file', type = str, default = None, help = 'events file of run (default <output_str>_events.tsv)')
+    parser.add_argument('--settings_file', type = str, default = None, help = 'settings of run (default <output_str>_expsettings.yml)')
+    parser.add_argument('--chunk_lines', type = int, default = 500000, help = 'number of lines read at a time')
+    args = parser.parse_args()
+
+    # imported here, only needed for CLI (to get bar trials of run)
+    from scoring import get_run_trial_table, load_events
+    from replay import deg2pix
+
+    output_base = args.asc_file[:-len('.asc')]
+    output_str = op.basename(output_base)
+
+    events_file = output_base+'_events.tsv' if args.events_file is None else args.events_file
+    settings_file = output_base+'_expsettings.yml' if args.settings_file is None else args.settings_file
+
+    with open(settings_file, 'r', encoding = 'utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+
+    events_df = load_events(events_file)
+
+    gaze, gaze_events = ingest_asc(args.asc_file, output_base+'_gaze.npy', settings['window_extra']['size'],
+                                   events_df = events_df, chunk_lines = args.chunk_lines)
+    gaze_events.to_csv(output_base+'_gaze_events.tsv', sep = '\t', index = False)
+    print('%i samples saved in %s'%(gaze.shape[0], output_base+'_gaze.npy'))
+
+    ## timeline of run, from logged onsets
+    task = re.search(r'task-(.+?)(_|$)', output_str).group(1)
+    bar_trials = get_run_trial_table(events_file, settings, task = task)['trial_num'].values if task in ['pRF', 'FA'] else []
+
+    timeline = Timeline.from_events(events_df, bar_trials = bar_trials, bar_window = settings['mri']['TR'],
+                                    phase_events = ~events_df['event_type'].isin(NON_DISPLAY_EVENTS))
+
+    blinks = gaze_events.loc[gaze_events['type'] == 'blink', ['start', 'end']].values
+
+    trial_df = gaze_per_trial(gaze, timeline, blinks = blinks, trial_duration = settings['mri']['TR'],
+                              radius = settings['eyetracker']['fixation_radius'], pix_per_deg = deg2pix(1, settings),
+                              min_break = settings['eyetracker']['min_break_duration'])
+    trial_df.to_csv(output_base+'_gaze_trials.tsv', sep = '\t', index = False)
+
+    print('%i fixation breaks (%i in bar trials), %i blinks'%(trial_df['n_breaks'].sum(),
+                                                               trial_df.loc[trial_df['bar'], 'n_breaks'].sum(),
+                                                               trial_df['n_blinks'].sum()))
+    print('fixation metrics per trial saved in %s'%(output_base+'_gaze_trials.tsv'))
+
+
+if __name__ == '__main__':
+    main()
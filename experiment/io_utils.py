@@ -0,0 +1,195 @@
+
+import numpy as np
+import os
+import os.path as op
+import pandas as pd
+import yaml
+
+from logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+def save_bar_position(bar_dict, output_path):
+    
+    """ get bar position dictionary (with all positions for whole run), convert to pandas df and 
+    save into appropriate output folder
+    
+    Parameters
+    ----------
+    bar_dict : dict
+        position dictionary
+    num_miniblock: int
+        number of miniblocks
+    output_path: str
+        absolute path to output file
+        
+    """
+    
+    df_bar_position = pd.DataFrame(columns=['attend_condition', 'color', 'bar_midpoint_at_TR', 'bar_pass_direction_at_TR'])
+
+    for key in bar_dict.keys():
+
+        attend = 1 if key == 'attended_bar' else 0 
+
+        df_bar_position = pd.concat([df_bar_position, pd.DataFrame({'attend_condition': [attend],
+                                                        'color': [bar_dict[key]['color']],
+                                                        'bar_midpoint_at_TR': [bar_dict[key]['bar_midpoint_at_TR']],
+                                                        'bar_pass_direction_at_TR': [bar_dict[key]['bar_pass_direction_at_TR']]
+                                                        })], 
+                                    ignore_index=True)  
+
+    df_bar_position.to_pickle(output_path)
+
+
+def save_all_TR_info(bar_dict = [], trial_type = [], ecc_ind = {},
+                     task_colors = {}, task_color_ind = {}, crossing_ind = [], output_path = ''):
+    
+    """ save all relevant trial infos in pandas df and 
+    save into appropriate output folder
+    
+    Parameters
+    ----------
+    bar_dict : dict
+        position dictionary
+    trial_type : list/arr
+        list of type of trial ('empty', 'task') for all TRs
+    attend_color: str
+        name of color that is attended
+    output_path: str
+        absolute path to output file
+    hemifield: list/arr
+        list of hemifield placement of attended bar, for all TRS (if no bar on screen then nan)
+    crossing_ind: list/arr
+        list of lists with plotting indices,for all TRS (if no bar on screen then nan)
+        [useful for crossings (to know which bars on top)]
+        
+    """
+    
+    # get colors for attended task
+    c_att = np.array([task_colors[bar_dict['attended_bar']['color']][v] for v in task_color_ind[bar_dict['attended_bar']['color']]])
+    attend_task_color = np.full(len(trial_type), None)
+    attend_task_color[np.where(trial_type == 'task')[0]] = c_att
+
+    # do same for unattended task
+    c_unatt = np.array([task_colors[bar_dict['unattended_bar']['color']][v] for v in task_color_ind[bar_dict['unattended_bar']['color']]])
+    unattend_task_color = np.full(len(trial_type), None)
+    unattend_task_color[np.where(trial_type == 'task')[0]] = c_unatt
+    
+    # get ecc - attended
+    ecc_att = ecc_ind[bar_dict['attended_bar']['color']]
+    attend_ecc = np.full(len(trial_type), None)
+    attend_ecc[np.where(trial_type == 'task')[0]] = ecc_att
+
+    # get ecc - unattended
+    ecc_unatt = ecc_ind[bar_dict['unattended_bar']['color']]
+    unattend_ecc = np.full(len(trial_type), None)
+    unattend_ecc[np.where(trial_type == 'task')[0]] = ecc_unatt
+
+    
+    df_out = pd.DataFrame(columns=['trial_num','trial_type', 
+                                   'attend_color', 'attend_task_color',
+                                   'unattend_color', 'unattend_task_color',
+                                   'bars', 'attend_ecc_ind', 'unattend_ecc_ind', 'crossing_ind'])
+    
+    for trl in range(len(trial_type)):
+        
+        df_out = pd.concat([df_out, pd.DataFrame({'trial_num': [trl], 
+                                                'trial_type': [trial_type[trl]],
+                                                'attend_color': [bar_dict['attended_bar']['color']],
+                                                'attend_task_color' : [attend_task_color[trl]],
+                                                'unattend_color': [bar_dict['unattended_bar']['color']],
+                                                'unattend_task_color': [unattend_task_color[trl]],
+                                                'bars': [bar_dict.keys()],
+                                                'attend_ecc_ind':[attend_ecc[trl]], 
+                                                'unattend_ecc_ind': [unattend_ecc[trl]],
+                                                'crossing_ind': [crossing_ind[trl]],
+                                            })], 
+                            ignore_index=True) 
+        
+    df_out.to_csv(output_path, index = False, header=True)
+
+
+def get_average_color(filedir, settings, updated_color_names = ['orange','yellow','blue'],
+                     color_categories = ['color_red', 'color_green'], average_ecc = True, ecc_ind = [0,1,2]):
+    
+    """ get average color 
+    
+    Parameters
+    ----------
+    filedir : str
+        absolute directory where the new settings files are
+    settings: dict
+        settings dict, to be updated
+    updated_color_names: array/list
+        array of strings with names of colors to be updated
+    color_categories: array/list
+        names of general color categories, for bookeeping
+    average_ecc: bool
+        average over eccentricities?
+    ecc_ind: array/list
+        eccentricity indices to consider
+            
+    """
+    
+    # get settings files for all trials of flicker task
+    flicker_files = [op.join(filedir,x) for _,x in enumerate(os.listdir(filedir)) if 'trial' in x and x.endswith('_updated_settings.yml')]
+    all_trials = []
+
+    if not average_ecc:
+        logger.warning('colors per eccentricity are only returned, settings are not updated')
+        
+    for col in updated_color_names:
+        
+        new_color = []
+        
+        # loop over eccentricities
+        for e in ecc_ind:
+            
+            # filenames for that color and ecc
+            c_files = [file for file in flicker_files if col in file and 'ecc-%i'%e in file]
+
+            if len(c_files) == 0:
+                logger.warning('No files found for color %s and ecc %i, keeping initial settings', col, e)
+            else:
+                ecc_color = []
+                for file in c_files:
+                
+                    # load updated settings for each trial 
+                    with open(file, 'r', encoding='utf8') as f_in:
+                        updated_settings = yaml.safe_load(f_in)
+
+                    if col in color_categories: # if general color category (red, green)
+                        ecc_color.append(updated_settings[col]['element_color'])
+                    
+                    elif col in ['pink','orange']: # if color variant from red
+                        ecc_color.append(updated_settings['color_red']['task_color'][col]['element_color'])
+                    
+                    elif col in ['yellow','blue']: # if color variant from red
+                        ecc_color.append(updated_settings['color_green']['task_color'][col]['element_color'])
+                
+                new_color.append(list(np.mean(ecc_color, axis=0)))
+            
+                # if we want to average over eccentricities
+                if average_ecc: 
+                    # actually update color in settings file
+                    mean_col = list(np.mean(new_color, axis=0))
+                    if col in color_categories:
+                        settings['stimuli']['conditions'][col]['element_color'] = mean_col
+                        logger.info('new rgb255 for %s is %s', col, settings['stimuli']['conditions'][col]['element_color'])
+                    elif col in ['pink','orange']:
+                        settings['stimuli']['conditions']['color_red']['task_color'][col]['element_color'] = mean_col
+                        logger.info('new rgb255 for %s is %s', col, settings['stimuli']['conditions']['color_red']['task_color'][col]['element_color'])
+                    elif col in ['yellow','blue']:
+                        settings['stimuli']['conditions']['color_green']['task_color'][col]['element_color'] = mean_col
+                        logger.info('new rgb255 for %s is %s', col, settings['stimuli']['conditions']['color_green']['task_color'][col]['element_color'])
+
+                else:
+                    all_trials.append(ecc_color)
+        
+    ###### for now, to check, NEED TO CHANGE #######
+    if average_ecc: 
+        return settings
+    else: 
+        return all_trials 
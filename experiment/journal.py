@@ -0,0 +1,266 @@
+
+# import relevant packages
+import os
+import os.path as op
+import io
+import queue
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+from logger import get_logger
+
+
+logger = get_logger(__name__)
+
+# event types that are not trial phases (so have no duration, as when exptools saves events)
+NON_PHASE_EVENTS = ['response', 'trigger', 'pulse', 'non_response_keypress', 'fixation_break']
+
+# event types that are not onsets of what is on screen (keys ending flicker trials are logged like phases, with a duration)
+NON_DISPLAY_EVENTS = NON_PHASE_EVENTS + ['end_trial']
+
+
+def format_events(global_log, exp_start, exp_stop, nr_frames = None):
+
+    """ format events data frame as exptools does when closing session
+    (adds absolute onset, phase durations and number of frames of each phase)
+
+    Parameters
+    ----------
+    global_log : pandas DataFrame
+        session data frame where all events are logged
+    exp_start : float
+        start time of experiment (session clock)
+    exp_stop : float
+        stop time of experiment (session clock)
+    nr_frames : int/None
+        number of frames of last phase (if None, unknown)
+
+    Returns
+    -------
+    events_df : pandas DataFrame
+        events data frame, indexed by trial number
+    """
+
+    events_df = pd.DataFrame(global_log).set_index('trial_nr')
+    events_df['onset_abs'] = events_df['onset'] + exp_start
+
+    # only phases have a duration
+    nonresp_idx = ~events_df.event_type.isin(NON_PHASE_EVENTS)
+    last_phase_onset = events_df.loc[nonresp_idx, 'onset'].iloc[-1]
+    durations = np.append(events_df.loc[nonresp_idx, 'onset'].diff().values[1:], exp_stop - last_phase_onset)
+    events_df.loc[nonresp_idx, 'duration'] = durations
+
+    # same for number of frames (logged with the next phase)
+    frames = np.append(events_df.loc[nonresp_idx, 'nr_frames'].values[1:], np.nan if nr_frames is None else nr_frames)
+    events_df.loc[nonresp_idx, 'nr_frames'] = frames if nr_frames is None else frames.astype(int)
+
+    return events_df.round({'onset': 5, 'onset_abs': 5, 'duration': 5})
+
+
+def load_journal(journal_file):
+
+    """ load events written to journal
+    (last line is dropped if incomplete, ex: when crash happened while it was written)
+
+    Parameters
+    ----------
+    journal_file : str
+        absolute path to journal file (_events_journal.tsv)
+    """
+
+    with open(journal_file, 'r', encoding = 'utf8') as f_in:
+        lines = f_in.read().split('\n')
+
+    # header not written yet
+    if len(lines) < 2:
+        return pd.DataFrame()
+
+    # last element is empty if file ends with complete line
+    return pd.read_csv(io.StringIO('\n'.join(lines[:-1])), sep = '\t')
+
+
+def consolidate_journal(journal_file, events_file):
+
+    """ save events of journal as events file (for runs that crashed before session was closed).
+    Stop time is the onset of the last event, and frames of last phase are unknown
+
+    Parameters
+    ----------
+    journal_file : str
+        absolute path to journal file (_events_journal.tsv)
+    events_file : str
+        absolute path to output events file (_events.tsv)
+
+    Returns
+    -------
+    events_df : pandas DataFrame/None
+        events data frame (None if journal has no events)
+    """
+
+    journal_df = load_journal(journal_file)
+
+    # nothing written yet (ex: crash before first TR)
+    if journal_df.shape[0] == 0:
+        return None
+
+    exp_start = (journal_df['onset_abs'] - journal_df['onset']).iloc[0]
+
+    events_df = format_events(journal_df.drop(columns = 'onset_abs'), exp_start, exp_stop = journal_df['onset'].max())
+    events_df.to_csv(events_file, sep = '\t', index = True)
+
+    return events_df
+
+
+class EventJournal(object):
+
+    def __init__(self, journal_file):
+
+        """ Initializes EventJournal object, that streams logged events to an append-only tsv,
+        so they are kept if the session crashes before it is closed.
+        New events are handed over at TR boundaries, and written (and synced to disk)
+        by a background thread. A journal left by an earlier attempt of the run is renamed
+        (_events_journal_stale-<N>.tsv) when the journal starts, so attempts are never mixed
+
+        Parameters
+        ----------
+        journal_file : str
+            absolute path to journal file (_events_journal.tsv)
+        """
+
+        self.journal_file = journal_file
+
+        # columns of journal (header is rewritten if events with new columns are logged)
+        self.columns = None
+
+        # number of rows of global log already handed over
+        self.n_written = 0
+
+        self.queue = queue.SimpleQueue()
+        self.thread = None
+
+
+    def start(self):
+
+        """ start writer thread (after moving away journal of earlier attempt, if any) """
+
+        if op.exists(self.journal_file):
+            n = 1
+            while op.exists(self.journal_file.replace('.tsv', '_stale-%i.tsv'%n)):
+                n += 1
+
+            os.replace(self.journal_file, self.journal_file.replace('.tsv', '_stale-%i.tsv'%n))
+            logger.warning('journal of earlier attempt of run moved to %s', self.journal_file.replace('.tsv', '_stale-%i.tsv'%n))
+
+        self.thread = threading.Thread(target = self._write_loop, daemon = True)
+        self.thread.start()
+
+
+    def write(self, global_log, exp_start):
+
+        """ hand over events logged since last call to writer thread (to call at TR boundaries)
+
+        Parameters
+        ----------
+        global_log : pandas DataFrame
+            session data frame where all events are logged
+        exp_start : float
+            start time of experiment (session clock)
+        """
+
+        n_rows = global_log.shape[0]
+
+        if n_rows > self.n_written:
+            self.queue.put((global_log.iloc[self.n_written:n_rows].copy(), exp_start))
+            self.n_written = n_rows
+
+
+    def close(self, global_log = None, exp_start = None):
+
+        """ hand over remaining events, and wait until writer thread is done """
+
+        if self.thread is None:
+            return
+
+        if global_log is not None:
+            self.write(global_log, exp_start)
+
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+
+    def _write_loop(self):
+
+        f_out = open(self.journal_file, 'w', encoding = 'utf8')
+
+        try:
+            while True:
+                item = self.queue.get()
+                if item is None:
+                    break
+
+                chunk, exp_start = item
+                chunk['onset_abs'] = chunk['onset'] + (np.nan if exp_start is None else exp_start)
+
+                header = self.columns is None
+                if header:
+                    self.columns = list(chunk.columns)
+
+                # columns logged for first time (ex: trial parameters, fixation breaks)
+                new_columns = [col for col in chunk.columns if col not in self.columns]
+                if len(new_columns) > 0:
+                    self.columns += new_columns
+                    f_out = self._rewrite_header(f_out)
+
+                chunk.reindex(columns = self.columns).to_csv(f_out, sep = '\t', header = header, index = False)
+
+                f_out.flush()
+                os.fsync(f_out.fileno())
+        finally:
+            f_out.close()
+
+        logger.debug('%i events written to %s', self.n_written, self.journal_file)
+
+
+    def _rewrite_header(self, f_out):
+
+        """ write journal again with all columns (to temporary file first, so events are never lost)
+        and return file reopened for appending """
+
+        f_out.close()
+
+        journal_df = load_journal(self.journal_file).reindex(columns = self.columns)
+
+        with open(self.journal_file+'.tmp', 'w', encoding = 'utf8') as f_tmp:
+            journal_df.to_csv(f_tmp, sep = '\t', index = False)
+            f_tmp.flush()
+            os.fsync(f_tmp.fileno())
+        os.replace(self.journal_file+'.tmp', self.journal_file)
+
+        return open(self.journal_file, 'a', encoding = 'utf8')
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Save events file of a run that crashed, from its events journal')
+    parser.add_argument('journal_file', type = str, help = 'path to _events_journal.tsv file of run')
+    parser.add_argument('--overwrite', action = 'store_true', help = 'overwrite events file if it exists')
+    args = parser.parse_args()
+
+    events_file = args.journal_file.replace('_events_journal.tsv', '_events.tsv')
+
+    if op.exists(events_file) and not args.overwrite:
+        print('%s already exists, use --overwrite to replace it'%events_file)
+    else:
+        events_df = consolidate_journal(args.journal_file, events_file)
+
+        if events_df is None:
+            print('no events in %s'%args.journal_file)
+        else:
+            print('%i events saved in %s'%(events_df.shape[0], events_file))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+
+import atexit
+import logging
+
+
+# name of experiment logger (modules log to children of it)
+LOGGER_NAME = 'famprf'
+
+# one line per record, tab separated (wall time, level, module, function, message)
+LOG_FORMAT = '%(asctime)s\t%(levelname)s\t%(module)s\t%(funcName)s\t%(message)s%(suppressed)s'
+CONSOLE_FORMAT = '%(message)s%(suppressed)s'
+
+
+def get_logger(name = None):
+
+    """ get logger of module (child of experiment logger)
+
+    Parameters
+    ----------
+    name : str/None
+        module name (if None, returns experiment logger)
+    """
+
+    return logging.getLogger(LOGGER_NAME if name is None else LOGGER_NAME+'.'+name)
+
+
+class RateLimitFilter(logging.Filter):
+
+    def __init__(self, min_interval = 1.):
+
+        """ Initializes RateLimitFilter object, that drops records logged from the same line
+        with the same message template within min_interval seconds
+        (number of dropped records is added to the next one that passes)
+
+        Parameters
+        ----------
+        min_interval : float
+            minimum time (in seconds) between records of same line and message template
+            (if 0, nothing is dropped)
+        """
+
+        super().__init__()
+
+        self.min_interval = min_interval
+        self.last_time = {}
+        self.suppressed = {}
+
+
+    def filter(self, record):
+
+        key = (record.pathname, record.lineno, str(record.msg))
+
+        if key in self.last_time and (record.created - self.last_time[key]) < self.min_interval:
+            self.suppressed[key] = self.suppressed.get(key, 0) + 1
+            return False
+
+        self.last_time[key] = record.created
+
+        n_suppressed = self.suppressed.pop(key, 0)
+        record.suppressed = ' [%i similar suppressed]'%n_suppressed if n_suppressed else ''
+
+        return True
+
+
+class RunLogger(object):
+
+    def __init__(self, level = 'INFO', console_level = 'INFO', rate_limit = 1.):
+
+        """ Initializes RunLogger object, queue-backed logger of the experiment.
+        Records are only put in a queue by the drawing thread; formatting for the terminal
+        and writing to the run log file is done by a background thread
+
+        Parameters
+        ----------
+        level : str
+            minimum level logged (ex: 'DEBUG', 'INFO', 'WARNING')
+        console_level : str
+            minimum level also shown in terminal
+        rate_limit : float
+            minimum time (in seconds) between repeated records of the same line
+        """
+
+        # only needed by the session, imported here so core utils (that log) still import fast
+        import queue
+        import logging.handlers
+
+        self.logger = get_logger()
+        self.logger.setLevel(level)
+        self.logger.propagate = False
+
+        self.queue = queue.SimpleQueue()
+
+        # filter before queueing, so dropped records cost nothing else
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(RateLimitFilter(min_interval = rate_limit))
+
+        self.console_handler = logging.StreamHandler()
+        self.console_handler.setLevel(console_level)
+        self.console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+        self.file_handler = None
+        self.listener = None
+
+        atexit.register(self.stop)
+
+
+    def start(self, log_file = None):
+
+        """ start writing records (stops previous run log, if any)
+
+        Parameters
+        ----------
+        log_file : str/None
+            absolute path to log file of run (if None, only logs to terminal)
+        """
+
+        self.stop()
+
+        handlers = [self.console_handler]
+
+        if log_file is not None:
+            self.file_handler = logging.FileHandler(log_file, mode = 'a', encoding = 'utf8')
+            self.file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            handlers.append(self.file_handler)
+
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level = True)
+        self.listener.start()
+
+        self.logger.addHandler(self.queue_handler)
+
+
+    def stop(self):
+
+        """ stop writing records - waits for queue to be emptied, and closes log file """
+
+        if self.listener is not None:
+            self.logger.removeHandler(self.queue_handler)
+            self.listener.stop()
+            self.listener = None
+
+        if self.file_handler is not None:
+            self.file_handler.close()
+            self.file_handler = None
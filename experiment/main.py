@@ -14,35 +14,42 @@ def main():
     
     # take user input
     
+    # resume interrupted run from its checkpoint (ex: python main.py 1 2 --resume)
+    resume = '--resume' in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--resume']
+
     # define participant number and open json parameter file
-    if len(sys.argv) < 2:
+    if len(argv) < 2:
         raise NameError('Please add subject number (ex:1) '
                         'as 1st argument in the command line!')
 
-    elif len(sys.argv) < 3:
+    elif len(argv) < 3:
         raise NameError('Please add run number (ex:1) '
                         'as 2nd argument in the command line!')
     
-    sj_num = str(sys.argv[1]).zfill(3) # subject number
-    run_num = str(sys.argv[2]) # run number
+    sj_num = str(argv[1]).zfill(3) # subject number
+    run_nums = str(argv[2]).split(',') # run number(s), ex: 1 or 1,2,3 to do several runs in same session
 
     # task name dictionary
     tasks = {'standard': 'pRF', 'feature': 'FA', 'flicker': 'flicker'}
     
-    print('Running experiment for subject-%s, run-%s'%(sj_num,run_num))
+    print('Running experiment for subject-%s, run-%s'%(sj_num,','.join(run_nums)))
 
     exp_type = ''
     while exp_type not in ('standard','feature','flicker'):
         exp_type = input('Standard pRF mapping or Feature mapping (standard/feature/flicker)?: ')
 
+    # attended color of each run
+    att_colors = []
     if exp_type == 'feature':
-        att_color = ''
-        while att_color not in ('red', 'green'):
-            att_color = input('Color of attended bar for run (red/green)?: ') 
-        print('Attending color %s'%att_color)
-        att_color = 'color_'+att_color
+        for run_num in run_nums:
+            att_color = ''
+            while att_color not in ('red', 'green'):
+                att_color = input('Color of attended bar for run-%s (red/green)?: '%run_num) 
+            print('Attending color %s'%att_color)
+            att_colors.append('color_'+att_color)
 
-    print('Running %s pRF mapping for subject-%s, run-%s'%(exp_type,sj_num,run_num))
+    print('Running %s pRF mapping for subject-%s, run-%s'%(exp_type,sj_num,','.join(run_nums)))
 
     ## set path to store outcomes 
     # DEFAULTS TO ROOT FOLDER
@@ -57,44 +64,62 @@ def main():
         os.makedirs(output_dir)
     print('saving files in %s'%output_dir)
 
-    # string for output data
-    output_str = 'sub-{sj}_ses-1_task-{task}_run-{run}'.format(sj=sj_num,run=run_num,task=tasks[exp_type])
+    # string for output data, per run
+    output_strs = ['sub-{sj}_ses-1_task-{task}_run-{run}'.format(sj=sj_num,run=run_num,task=tasks[exp_type]) for run_num in run_nums]
 
     # if file already exists
-    behav_file = op.join(output_dir,'{behav}_events.tsv'.format(behav=output_str))
-    if op.exists(behav_file): 
-        print('file already exists!')
+    # (first run is not checked if resuming, its events file is saved at the end)
+    for output_str in (output_strs[1:] if resume else output_strs):
+        behav_file = op.join(output_dir,'{behav}_events.tsv'.format(behav=output_str))
+        if op.exists(behav_file): 
+            print('file already exists!')
 
-        overwrite = ''
-        while overwrite not in ('y','yes','n','no'):
-            overwrite = input('overwrite %s\n(y/yes/n/no)?: '%behav_file)
+            overwrite = ''
+            while overwrite not in ('y','yes','n','no'):
+                overwrite = input('overwrite %s\n(y/yes/n/no)?: '%behav_file)
 
-        if overwrite in ['no','n']:
-            raise NameError('Run %s already in directory\nstopping experiment!'%behav_file)
+            if overwrite in ['no','n']:
+                raise NameError('Run %s already in directory\nstopping experiment!'%behav_file)
 
 
     # load approriate class object to be run
     if exp_type == 'standard': # run standard pRF mapper
 
-        exp_sess = PRFSession(output_str = output_str,
+        exp_sess = PRFSession(output_str = output_strs[0],
                               output_dir = output_dir,
                               settings_file = 'experiment_settings.yml',
                               eyetracker_on = False) #True)
 
     elif exp_type == 'feature': # run feature pRF mapper
-         exp_sess = FeatureSession(output_str = output_str,
+         exp_sess = FeatureSession(output_str = output_strs[0],
                                   output_dir = output_dir,
                                   settings_file = 'experiment_settings.yml',
                                   eyetracker_on = False, #True,
-                                  att_color = att_color)
+                                  att_color = att_colors[0])
 
     elif exp_type == 'flicker': # run feature pRF mapper
-         exp_sess = FlickerSession(output_str = output_str,
+         exp_sess = FlickerSession(output_str = output_strs[0],
                                   output_dir = output_dir,
                                   settings_file = 'experiment_settings.yml',
                                   eyetracker_on = False)
+
+    # continue first run from last completed trial
+    if resume:
+        exp_sess.resume()
+
+    # loop over runs, reusing same session (window and stimuli)
+    for i, output_str in enumerate(output_strs):
+
+        if i > 0:
+            if exp_type == 'feature':
+                exp_sess.reset_run(output_str, att_color = att_colors[i])
+            else:
+                exp_sess.reset_run(output_str)
+
+        # keep window open if more runs to do
+        exp_sess.keep_open = (i < len(output_strs) - 1)
    	                            
-    exp_sess.run()
+        exp_sess.run()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,343 @@
+
+# import relevant packages
+import time
+import queue
+import socket
+import argparse
+import threading
+import numpy as np
+import pandas as pd
+
+from logger import get_logger
+
+
+logger = get_logger(__name__)
+
+
+class TrackerMessenger(object):
+
+    def __init__(self, tracker, clock):
+
+        """ Initializes TrackerMessenger object, wrapper of the eyetracker that sends messages from a worker thread.
+        Messages are time stamped when sendMessage is called (on the thread that draws frames) and put in a queue,
+        the worker sends them with the time passed since (EyeLink message offset, in ms) so the tracker
+        logs them at the time of the event. Other tracker methods are passed on to the tracker,
+        so it can replace session.tracker (exptools trials send phase messages with session.tracker.sendMessage)
+
+        Parameters
+        ----------
+        tracker : pylink EyeLink/SocketTracker
+            eyetracker, with sendMessage method
+        clock : psychopy Clock
+            session clock, to time stamp messages
+        """
+
+        self.tracker = tracker
+        self.clock = clock
+
+        self.queue = queue.Queue()
+        self.thread = None
+
+        # tracker is also polled from other threads (ex: fixation monitor), calls are done one at a time
+        self.lock = threading.Lock()
+
+        # diagnostics, filled by worker
+        self.queue_depths = []
+        self.latencies = []
+        self.send_durations = []
+
+
+    def __getattr__(self, name):
+
+        # only called for attributes not set in wrapper
+        return getattr(self.tracker, name)
+
+
+    def start(self):
+
+        """ start worker thread """
+
+        self.thread = threading.Thread(target = self._send_loop, daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+
+        """ send messages still in queue, and stop worker thread
+        (messages sent after this are sent right away) """
+
+        if self.thread is None:
+            return
+
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+
+    def flush(self):
+
+        """ wait until all messages in queue are sent """
+
+        if self.thread is not None:
+            self.queue.join()
+
+
+    def sendMessage(self, message):
+
+        """ time stamp message, and put it in queue (or send it, if worker is not running) """
+
+        if self.thread is None:
+            with self.lock:
+                self.tracker.sendMessage(message)
+        else:
+            self.queue.put((self.clock.getTime(), message))
+
+
+    def getNewestSample(self):
+
+        with self.lock:
+            return self.tracker.getNewestSample()
+
+
+    def summary(self):
+
+        """ summary of messages sent by worker
+
+        Returns
+        -------
+        summary_dict : dict
+            number of messages, median and max queue depth (messages waiting when one is sent),
+            median and max latency (time from event to message sent, ms)
+            and median and max duration of tracker sendMessage calls (ms)
+        """
+
+        if len(self.latencies) == 0:
+            return {'messages': 0}
+
+        depths = np.array(self.queue_depths)
+        latencies = np.array(self.latencies) * 1000
+        durations = np.array(self.send_durations) * 1000
+
+        return {'messages': len(latencies),
+                'median_queue_depth': float(np.median(depths)),
+                'max_queue_depth': int(depths.max()),
+                'median_latency_ms': float(np.median(latencies)),
+                'max_latency_ms': float(latencies.max()),
+                'median_send_ms': float(np.median(durations)),
+                'max_send_ms': float(durations.max())}
+
+
+    def _send_loop(self):
+
+        while True:
+
+            item = self.queue.get()
+
+            if item is None:
+                self.queue.task_done()
+                break
+
+            self.queue_depths.append(self.queue.qsize())
+
+            event_time, message = item
+            send_time = self.clock.getTime()
+
+            # EyeLink subtracts number at start of message from time it is received
+            offset = int(round((send_time - event_time) * 1000))
+            with self.lock:
+                self.tracker.sendMessage('%i %s'%(offset, message) if offset > 0 else message)
+
+            self.latencies.append(send_time - event_time)
+            self.send_durations.append(self.clock.getTime() - send_time)
+
+            self.queue.task_done()
+
+
+class MessageServer(object):
+
+    def __init__(self, clock, delay = 0, host = '127.0.0.1', port = 0):
+
+        """ Initializes MessageServer object, local stand-in for the eyetracker host,
+        that receives messages over a socket, logs them as the tracker would
+        (receive time minus message offset) and replies after delay (network round trip)
+
+        Parameters
+        ----------
+        clock : psychopy Clock
+            clock to log receive time with
+        delay : float
+            time to wait before replying to each message (in seconds)
+        host : str
+            address to listen on
+        port : int
+            port to listen on (if 0, any free port)
+        """
+
+        self.clock = clock
+        self.delay = delay
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.address = self.server.getsockname()
+
+        # (receive time, message)
+        self.received = []
+        self.thread = None
+
+
+    def start(self):
+
+        """ start serving in background thread (one connection) """
+
+        self.thread = threading.Thread(target = self._serve, daemon = True)
+        self.thread.start()
+
+
+    def stop(self):
+
+        """ wait for connection to be closed, and stop server """
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.server.close()
+
+
+    def get_messages(self):
+
+        """ messages received, as logged by tracker
+
+        Returns
+        -------
+        messages_df : pandas DataFrame
+            time (event time, receive time minus offset, in seconds), offset (ms) and message
+        """
+
+        times = np.array([t for t, _ in self.received])
+        parts = [msg.split(' ', 1) for _, msg in self.received]
+
+        offsets = np.array([int(p[0]) if len(p) > 1 and p[0].isdigit() else 0 for p in parts])
+        messages = [p[1] if len(p) > 1 and p[0].isdigit() else ' '.join(p) for p in parts]
+
+        return pd.DataFrame({'time': times - offsets/1000, 'offset': offsets, 'message': messages})
+
+
+    def _serve(self):
+
+        conn, _ = self.server.accept()
+
+        with conn, conn.makefile('r', encoding = 'utf8') as f_in:
+            for line in f_in:
+                self.received.append((self.clock.getTime(), line.rstrip('\n')))
+
+                if self.delay > 0:
+                    time.sleep(self.delay)
+                conn.sendall(b'\n')
+
+
+class SocketTracker(object):
+
+    def __init__(self, address):
+
+        """ Initializes SocketTracker object, stand-in for the eyetracker that sends messages to a MessageServer,
+        and waits for its reply (so each call blocks for a round trip, as pylink sendMessage does)
+
+        Parameters
+        ----------
+        address : tuple
+            (host, port) of MessageServer
+        """
+
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+    def sendMessage(self, message):
+
+        self.sock.sendall((message+'\n').encode('utf8'))
+        self.sock.recv(1)
+
+
+    def close(self):
+
+        self.sock.close()
+
+
+def benchmark_messenger(n_messages = 500, interval = 1/120, delay = .005, queued = True):
+
+    """ send phase messages at frame rate to local MessageServer,
+    and time how long the drawing thread is blocked by each call
+
+    Parameters
+    ----------
+    n_messages : int
+        number of messages
+    interval : float
+        time in between messages (in seconds, one per frame)
+    delay : float
+        round trip time of server (in seconds)
+    queued : bool
+        if True, send with TrackerMessenger, else send directly
+
+    Returns
+    -------
+    out_dict : dict
+        blocking time of calls (ms), error of logged message times (ms), and messenger summary
+    """
+
+    from psychopy import core
+
+    clock = core.Clock()
+
+    server = MessageServer(clock, delay = delay)
+    server.start()
+    tracker = SocketTracker(server.address)
+
+    messenger = TrackerMessenger(tracker, clock)
+    if queued:
+        messenger.start()
+
+    event_times = np.zeros(n_messages)
+    blocked = np.zeros(n_messages)
+
+    for i in range(n_messages):
+        event_times[i] = clock.getTime()
+        messenger.sendMessage('start_type-stim_trial-%i_phase-0'%i)
+        blocked[i] = clock.getTime() - event_times[i]
+
+        # wait for next frame
+        core.wait(max(interval - blocked[i], 0), hogCPUperiod = 0)
+
+    messenger.stop()
+    tracker.close()
+    server.stop()
+
+    log_error = (server.get_messages()['time'].values - event_times) * 1000
+
+    return {'median_blocked_ms': float(np.median(blocked) * 1000),
+            'max_blocked_ms': float(blocked.max() * 1000),
+            'median_abs_time_error_ms': float(np.median(np.abs(log_error))),
+            'max_abs_time_error_ms': float(np.abs(log_error).max()),
+            **messenger.summary()}
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Compare direct and queued eyetracker messages, against local socket stand-in of tracker')
+    parser.add_argument('--n_messages', type = int, default = 500, help = 'number of messages')
+    parser.add_argument('--interval', type = float, default = 1/120, help = 'time in between messages in seconds (default one frame at 120 Hz)')
+    parser.add_argument('--delay', type = float, default = .005, help = 'round trip of stand-in tracker in seconds')
+    args = parser.parse_args()
+
+    for queued in [False, True]:
+        out_dict = benchmark_messenger(n_messages = args.n_messages, interval = args.interval, delay = args.delay, queued = queued)
+
+        print('queued' if queued else 'direct')
+        for name, val in out_dict.items():
+            print('  %s: %s'%(name, val))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+
+import numpy as np
+
+
+def make_kernel_grid(size_pix, downsample = 1):
+
+    """ make pixel offset grid of the (square) kernel that is stamped for each element
+
+    Parameters
+    ----------
+    size_pix : float
+        element size (diameter) in pixels
+    downsample : int
+        number of screen pixels per output pixel
+
+    Returns
+    -------
+    offsets : arr
+        (K,K,2) kernel pixel offsets [dx,dy] in output pixels (dy positive is down)
+    """
+
+    k = int(np.ceil(size_pix/downsample))
+    k += (k + 1) % 2 # make it odd, so kernel is centered on element
+
+    off = np.arange(k) - k//2
+    dx, dy = np.meshgrid(off, off)
+
+    return np.stack((dx, dy), axis = -1)
+
+
+def render_elements(xys, oris, sfs, contrs, colors, opacities, sizes,
+                    screen = np.array([1080,1080]), downsample = 1, background = [.5, .5, .5], phases = 0):
+
+    """ rasterize a gabor element array to a numpy frame,
+    stamping one (rotated) gabor kernel per element with vectorized scatter-add
+
+    Parameters
+    ----------
+    xys : arr
+        element positions (N,2) in pixels, center of screen is (0,0)
+    oris : arr
+        element orientations (N,) in degrees (clockwise, as in psychopy)
+    sfs : arr
+        element spatial frequency (N,), in cycles/gabor width
+    contrs : arr
+        element contrasts (N,)
+    colors : arr
+        peak color of element texture (N,3) or (3,), rgb in [0,1]
+    opacities : arr
+        element opacities (N,)
+    sizes : arr
+        element sizes (N,) or float, in pixels
+    screen : arr
+        array with display resolution
+    downsample : int
+        number of screen pixels per output pixel
+    background : list/arr
+        background rgb color, in [0,1] (psychopy window color [0,0,0] is mid grey),
+        or previously rendered frame (H, W, 3) to draw on top of
+    phases : float/arr
+        grating phase, in cycles
+
+    Returns
+    -------
+    frame : arr
+        rendered frame (H, W, 3), rgb in [0,1]
+    """
+
+    nElements = np.asarray(xys).shape[0]
+
+    def per_element(arr, shape = ()):
+        return np.broadcast_to(np.asarray(arr, dtype = float), (nElements,) + shape)
+
+    oris, sfs, contrs, opacities, sizes, phases = [per_element(a) for a in [oris, sfs, contrs, opacities, sizes, phases]]
+    colors = per_element(colors, (3,))
+
+    width, height = (np.asarray(screen)/downsample).astype(int)
+    num_pix = width * height
+
+    # only stamp elements that are visible
+    vis = np.where((opacities > 0) & (contrs != 0))[0]
+
+    alpha_sum = np.zeros(num_pix)
+    color_sum = np.zeros((3, num_pix))
+
+    if len(vis) > 0:
+
+        offsets = make_kernel_grid(sizes[vis].max(), downsample = downsample)
+
+        # element center in output pixels
+        cx = np.round((np.asarray(xys)[vis, 0] + screen[0]/2)/downsample).astype(int)
+        cy = np.round((screen[1]/2 - np.asarray(xys)[vis, 1])/downsample).astype(int)
+
+        # kernel coordinates in units of element width (N,K,K), y up
+        scale = downsample/sizes[vis][:, np.newaxis, np.newaxis]
+        x = offsets[np.newaxis, ..., 0] * scale
+        y = -offsets[np.newaxis, ..., 1] * scale
+
+        # rotate (clockwise) and make grating along rotated x axis, normalized between 0 and 1
+        theta = np.deg2rad(oris[vis])[:, np.newaxis, np.newaxis]
+        u = x * np.cos(theta) - y * np.sin(theta)
+        grating = .5 + .5 * np.cos(2 * np.pi * (sfs[vis][:, np.newaxis, np.newaxis] * u + phases[vis][:, np.newaxis, np.newaxis]))
+
+        # gaussian mask (psychopy 'gauss', sd = 1/6 of element size) and circular aperture
+        r2 = x**2 + y**2
+        mask = np.exp(-r2/(2 * (1/6)**2)) * (r2 <= .25)
+
+        alpha = opacities[vis][:, np.newaxis, np.newaxis] * mask
+
+        # scatter-add into flat frame, dropping kernel pixels outside of screen
+        rows = cy[:, np.newaxis, np.newaxis] + offsets[np.newaxis, ..., 1]
+        cols = cx[:, np.newaxis, np.newaxis] + offsets[np.newaxis, ..., 0]
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+
+        flat_ind = (rows * width + cols)[inside]
+        alpha_sum = np.bincount(flat_ind, weights = alpha[inside], minlength = num_pix)
+
+        for c in range(3):
+            # colored grating, with contrast around mid grey
+            elem_color = .5 + contrs[vis][:, np.newaxis, np.newaxis] * (grating * colors[vis, c][:, np.newaxis, np.newaxis] - .5)
+            color_sum[c] = np.bincount(flat_ind, weights = (alpha * elem_color)[inside], minlength = num_pix)
+
+    # alpha composite over background (normalizing where elements overlap)
+    norm = np.maximum(alpha_sum, 1)
+    background = np.asarray(background, dtype = float)
+    background = background[:, np.newaxis] if background.ndim == 1 else background.reshape(-1, 3).T
+
+    frame = background * (1 - np.minimum(alpha_sum, 1)) + color_sum/norm
+
+    return np.clip(frame.T.reshape(height, width, 3), 0, 1).astype(np.float32)
+
+
+def render_element_state(element_state, sizes, oris = None, xys = None, screen = np.array([1080,1080]), downsample = 1, **kwargs):
+
+    """ rasterize element state, as returned by utils.get_element_state
+
+    Parameters
+    ----------
+    element_state : dict
+        element settings for the frame
+    sizes : arr
+        element sizes (N,) or float, in pixels
+    oris : arr
+        element orientations to use when not updated in element state
+    xys : arr
+        element positions to use when not updated in element state
+    """
+
+    oris = element_state['oris'] if element_state['oris'] is not None else oris
+    xys = element_state['xys'] if element_state['xys'] is not None else xys
+
+    return render_elements(xys, oris, element_state['sfs'], element_state['contrs'], element_state['rgb_color'],
+                           element_state['opacities'], sizes, screen = screen, downsample = downsample, **kwargs)
+
+
+def render_element_array(ElementArrayStim, screen = np.array([1080,1080]), downsample = 1, tex_color = None, **kwargs):
+
+    """ rasterize current settings of a psychopy ElementArrayStim
+
+    Parameters
+    ----------
+    ElementArrayStim : Psychopy object
+        element array (in pix units)
+    tex_color : arr/None
+        peak rgb color of the texture, in [0,1] (ex: element_state['rgb_color']).
+        If None, uses element colors (converted from psychopy rgb)
+    """
+
+    colors = (np.asarray(ElementArrayStim.colors) + 1)/2 if tex_color is None else tex_color
+
+    return render_elements(ElementArrayStim.xys, ElementArrayStim.oris, ElementArrayStim.sfs[..., 0],
+                           ElementArrayStim.contrs, colors, ElementArrayStim.opacities,
+                           ElementArrayStim.sizes[..., 0], screen = screen, downsample = downsample, **kwargs)
+
+
+def render_frames(frame_states, sizes, screen = np.array([1080,1080]), downsample = 4, **kwargs):
+
+    """ rasterize sequence of frames, where each frame is a list of element states
+    (one per element array, drawn in order)
+
+    Parameters
+    ----------
+    frame_states : iterable
+        iterable of lists of (element_state, oris, xys) tuples
+    sizes : arr
+        element sizes (N,) or float, in pixels
+
+    Yields
+    ------
+    frame : arr
+        rendered frame (H, W, 3), rgb in [0,1]
+    """
+
+    for states in frame_states:
+
+        width, height = (np.asarray(screen)/downsample).astype(int)
+        frame = np.full((height, width, 3), .5, dtype = np.float32)
+
+        for element_state, oris, xys in states:
+            # later arrays are drawn on top of earlier ones
+            frame = render_element_state(element_state, sizes, oris = oris, xys = xys, screen = screen,
+                                         downsample = downsample, background = frame, **kwargs)
+
+        yield frame
@@ -0,0 +1,119 @@
+
+import gc
+import tracemalloc
+import numpy as np
+
+
+class RealtimeMode(object):
+
+    def __init__(self, enabled = True, collect_generation = 0):
+
+        """ Initializes RealtimeMode object, context manager for the trial loop.
+        Freezes objects made before the run (so garbage collector ignores them) and disables
+        automatic garbage collection, so it can't pause a frame. Collection is done only when called
+        (ex: in between trials)
+
+        Parameters
+        ----------
+        enabled : bool
+            if False, garbage collection is left as is
+        collect_generation : int
+            oldest generation collected in between trials (0 is fastest)
+        """
+
+        self.enabled = enabled
+        self.collect_generation = collect_generation
+        self.collect_count = 0
+
+
+    def __enter__(self):
+
+        if self.enabled:
+            gc.collect()
+            gc.freeze()
+            gc.disable()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if self.enabled:
+            gc.enable()
+            gc.unfreeze()
+
+        return False
+
+
+    def collect(self):
+
+        """ collect garbage (only young generation), to call in between trials """
+
+        if self.enabled:
+            gc.collect(self.collect_generation)
+            self.collect_count += 1
+
+
+class FrameAllocationCounter(object):
+
+    def __init__(self):
+
+        """ Initializes FrameAllocationCounter object,
+        that measures memory allocated by python code in each frame (with tracemalloc).
+        Peak is the most memory held at once within the frame (includes temporary arrays),
+        net is what is still allocated at the end of the frame
+        (slows down drawing, only for instrumentation)
+        """
+
+        self.frame_peaks = []
+        self.frame_nets = []
+        self.frame_start_memory = None
+
+
+    def start(self):
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+    def stop(self):
+
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+    def frame_start(self):
+
+        tracemalloc.reset_peak()
+        self.frame_start_memory = tracemalloc.get_traced_memory()[0]
+
+
+    def frame_end(self):
+
+        current, peak = tracemalloc.get_traced_memory()
+
+        self.frame_peaks.append(peak - self.frame_start_memory)
+        self.frame_nets.append(current - self.frame_start_memory)
+
+
+    def summary(self, skip_frames = 10):
+
+        """ summary of allocations per frame, skipping first frames (not steady state)
+
+        Returns
+        -------
+        summary_dict : dict
+            number of frames, median and max of peak and net allocation (bytes) per frame
+        """
+
+        peaks = np.array(self.frame_peaks[skip_frames:])
+        nets = np.array(self.frame_nets[skip_frames:])
+
+        if len(peaks) == 0:
+            return {'frames': 0}
+
+        return {'frames': len(peaks),
+                'median_peak_bytes': float(np.median(peaks)),
+                'max_peak_bytes': float(peaks.max()),
+                'median_net_bytes': float(np.median(nets)),
+                'max_net_bytes': float(nets.max())}
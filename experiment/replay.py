@@ -0,0 +1,250 @@
+
+import os.path as op
+import numpy as np
+import pandas as pd
+import yaml
+
+from utils import *
+from io_utils import get_average_color
+from design import plan_prf_design, plan_feature_design
+from rng import RNGRegistry
+from timeline import Timeline
+from raster import render_element_state
+from journal import NON_DISPLAY_EVENTS
+
+
+def deg2pix(degrees, settings):
+
+    """ convert degrees to pixels, given monitor settings
+    (same as psychopy monitorunittools.deg2pix, without flat screen correction)
+
+    Parameters
+    ----------
+    degrees : float/arr
+        value in degrees of visual angle
+    settings : dict
+        experiment settings dict
+    """
+
+    cm = np.array(degrees) * settings['monitor']['distance'] * 0.017455
+
+    return cm * settings['window_extra']['size'][0] / float(settings['monitor']['width'])
+
+
+class RunReplay(object):
+
+    def __init__(self, events_file, seeds_file, settings_file, task = 'pRF', att_color = 'color_green',
+                 win_size = None, output_dir = None, run_index = None):
+
+        """ Initializes RunReplay object, that rebuilds session state of a run
+        from the events file and the seeds saved in the output folder,
+        and streams what was on screen frame by frame (without display)
+
+        Parameters
+        ----------
+        events_file : str
+            absolute path to run events file (_events.tsv)
+        seeds_file : str
+            absolute path to run seeds file (_seeds.yml)
+        settings_file : str
+            absolute path to settings file used in run (ex: _expsettings.yml)
+        task : str
+            task of run ('pRF' or 'FA')
+        att_color : str
+            attended color condition (only for feature task)
+        win_size : list/arr/None
+            window size [horizontal, vertical] in pixels (if None, uses settings)
+        output_dir : str/None
+            output folder of subject, to update colors with flicker task results (as done in run)
+        run_index : int/None
+            run number (if None, taken from events file name)
+        """
+
+        self.task = task
+        self.att_color = att_color
+
+        with open(settings_file, 'r', encoding = 'utf8') as f_in:
+            self.settings = yaml.safe_load(f_in)
+
+        # update color of settings, as done before run
+        if output_dir is not None:
+            self.settings = get_average_color(output_dir, self.settings,
+                                              updated_color_names = ['pink', 'orange', 'yellow', 'blue'])
+
+        self.condition_settings = self.settings['stimuli']['conditions']
+
+        ## rebuild display and grid
+        win_size = self.settings['window_extra']['size'] if win_size is None else win_size
+        self.screen = get_display_screen(self.settings, win_size)
+        self.grid_pos, self.gabor_diameter_pix = get_grid_positions(self.screen,
+                                                                    num_elem = self.settings['stimuli']['num_elem'],
+                                                                    gab_ratio = self.settings['stimuli']['gab_ratio'])
+
+        ## rebuild random generators and trial design
+        self.rng = RNGRegistry.from_file(seeds_file)
+
+        if task == 'pRF':
+            self.design = plan_prf_design(self.settings, self.screen, rng = self.rng.get('design'))
+            self.num_bars = 1
+        elif task == 'FA':
+            self.design = plan_feature_design(self.settings, self.screen, att_color = att_color, rng = self.rng.get('design'),
+                                              run_index = get_run_number(op.basename(events_file)) if run_index is None else run_index)
+            self.num_bars = self.settings['stimuli']['feature']['num_bars']
+        else:
+            raise NotImplementedError('Replay not implemented for task %s'%task)
+
+        self.timeline = Timeline.from_design(self.design, trial_duration = self.settings['mri']['TR'])
+
+        # element orientations set when stimuli were created
+        element_ori = make_element_oris(self.grid_pos.shape[0], self.condition_settings['background'],
+                                        rng = self.rng.get('stim'))
+
+        # current orientation and positions of each bar element array
+        self.oris = [element_ori.copy() for i in range(self.num_bars)]
+        self.xys = [self.grid_pos.copy() for i in range(self.num_bars)]
+
+        self.position_jitter = deg2pix(self.settings['stimuli']['pos_jitter'], self.settings)
+
+        ## load phase onsets of run
+        events_df = pd.read_csv(events_file, sep = '\t')
+        self.phase_df = events_df[~events_df['event_type'].isin(NON_DISPLAY_EVENTS)].sort_values('onset').reset_index(drop = True)
+
+        self.position_dictionary = {}
+
+
+    def get_position_dictionary(self, trial_nr):
+
+        """ get bar and background positions for trial (cached) """
+
+        if trial_nr not in self.position_dictionary:
+            self.position_dictionary[trial_nr] = get_object_positions(self.grid_pos,
+                                                                    self.design['bar_midpoint_all'][trial_nr],
+                                                                    self.design['bar_pass_direction_all'][trial_nr],
+                                                                    self.design['bar_width_pix'],
+                                                                    screen = self.screen,
+                                                                    num_bar = self.num_bars)
+
+        return self.position_dictionary[trial_nr]
+
+
+    def update_bar(self, bar_ind, this_phase, elem_positions, orientation, **kwargs):
+
+        """ update element array of bar, as done when drawing,
+        and return (element_state, oris, xys) of bar """
+
+        element_state, _ = get_element_state(self.condition_settings, this_phase, elem_positions, self.grid_pos,
+                                             position_jitter = self.position_jitter,
+                                             orientation = orientation,
+                                             ori_rng = self.rng.get('orientation'),
+                                             jitter_rng = self.rng.get('jitter'),
+                                             **kwargs)
+
+        if element_state['oris'] is not None:
+            self.oris[bar_ind] = element_state['oris']
+        if element_state['xys'] is not None:
+            self.xys[bar_ind] = element_state['xys']
+
+        return (element_state, self.oris[bar_ind], self.xys[bar_ind])
+
+
+    def get_frame_states(self, trial_nr, phase, orientation):
+
+        """ get element states of all bars drawn in frame (in drawing order) """
+
+        states = []
+
+        if self.task == 'pRF':
+
+            this_phase = self.design['phase_conditions'][trial_nr][phase]
+
+            if (self.design['bar_pass_direction_all'][trial_nr] != 'empty') and (this_phase != 'background'):
+                states.append(self.update_bar(0, this_phase, self.get_position_dictionary(trial_nr)['bar0']['xys'], orientation,
+                                              override_contrast = True,
+                                              contrast_val = self.settings['stimuli']['prf']['element_contrast']))
+
+        elif self.task == 'FA':
+
+            if ('task' in self.design['trial_type_all'][trial_nr]) and (self.design['phase_conditions'][trial_nr][phase] == 'stim'):
+
+                bar_ind = np.where(np.where(self.design['bar_bool'])[0] == trial_nr)[0][0]
+                bar_colors = [self.design['all_bar_pos'][key]['color'] for key in ['attended_bar', 'unattended_bar']]
+                this_phase = ['color_red' if 'red' in p else 'color_green' for p in bar_colors]
+
+                position_dictionary = self.get_position_dictionary(trial_nr)
+
+                for i, p in enumerate(this_phase):
+                    current_color = self.settings['stimuli']['feature']['task_colors'][p][self.design['ctask_ind_all'][p][bar_ind]]
+                    new_color = self.condition_settings[p]['task_color'][current_color]['element_color']
+
+                    states.append(self.update_bar(i, p, position_dictionary['bar%i'%i]['xys'], orientation,
+                                                  new_color = new_color))
+
+                # order of drawing
+                states = [states[int(d)] for d in self.design['drawing_ind'][trial_nr]]
+
+        return states
+
+
+    def stream(self):
+
+        """ stream session state, frame by frame
+
+        Yields
+        ------
+        frame_dict : dict
+            dictionary with frame time 't', 'trial_nr', 'phase' and
+            'states' - list of (element_state, oris, xys) for bars drawn in frame
+        """
+
+        ori_counter = 0
+
+        for _, row in self.phase_df.iterrows():
+
+            nr_frames = int(row['nr_frames']) if not np.isnan(row['nr_frames']) else 0
+            if nr_frames == 0:
+                continue
+
+            # frames equally spaced within phase
+            frame_times = row['onset'] + np.arange(nr_frames) * row['duration']/nr_frames
+
+            for t in frame_times:
+
+                ## orientation switch times (as in trials, one switch even if several switch moments passed)
+                ori_epoch = self.timeline.ori_epoch(t)
+                ori_bool = ori_epoch > ori_counter
+                ori_counter = max(ori_counter, ori_epoch)
+
+                yield {'t': t,
+                       'trial_nr': int(row['trial_nr']),
+                       'phase': int(row['phase']),
+                       'states': self.get_frame_states(int(row['trial_nr']), int(row['phase']), ori_bool)}
+
+
+    def frames(self, downsample = 4):
+
+        """ stream rasterized frames of run
+
+        Parameters
+        ----------
+        downsample : int
+            number of screen pixels per output pixel
+
+        Yields
+        ------
+        t : float
+            frame time (relative to session clock)
+        frame : arr
+            rendered frame (H, W, 3), rgb in [0,1]
+        """
+
+        width, height = (np.asarray(self.screen)/downsample).astype(int)
+
+        for frame_dict in self.stream():
+
+            frame = np.full((height, width, 3), .5, dtype = np.float32)
+
+            for element_state, oris, xys in frame_dict['states']:
+                frame = render_element_state(element_state, self.gabor_diameter_pix, oris = oris, xys = xys,
+                                             screen = self.screen, downsample = downsample, background = frame)
+
+            yield frame_dict['t'], frame
@@ -0,0 +1,98 @@
+
+import numpy as np
+import yaml
+
+
+class RNGRegistry(object):
+
+    # subsystems that draw random numbers, each gets its own seeded generator
+    # design - trial design (bar positions, condition order, task colors, ...)
+    # stim - element settings when stimuli are created
+    # orientation - element orientations (at every orientation switch)
+    # jitter - element position jitter (at every frame)
+    SUBSYSTEMS = ('design', 'stim', 'orientation', 'jitter')
+
+    def __init__(self, seed = None, seeds = None):
+
+        """ Initializes RNGRegistry object,
+        with one random generator per subsystem (so each stream is reproducible on its own)
+
+        Parameters
+        ----------
+        seed : int/None
+            master seed, from which subsystem seeds are derived (if None, random seed is drawn)
+        seeds : dict/None
+            seeds per subsystem (ex: loaded from file), takes priority over master seed
+        """
+
+        if seeds is None:
+            self.seed = int(np.random.SeedSequence(seed).entropy) if seed is None else int(seed)
+            sub_seeds = np.random.SeedSequence(self.seed).generate_state(len(self.SUBSYSTEMS))
+            seeds = {name: int(s) for name, s in zip(self.SUBSYSTEMS, sub_seeds)}
+        else:
+            self.seed = seed
+
+        self.seeds = dict(seeds)
+        self.generators = {name: np.random.default_rng(s) for name, s in self.seeds.items()}
+
+
+    def get(self, name):
+
+        """ get random generator of subsystem """
+
+        return self.generators[name]
+
+
+    def reset(self, name = None):
+
+        """ reset generator(s) to initial state, given seeds
+
+        Parameters
+        ----------
+        name : str/None
+            name of subsystem to reset (if None, resets all)
+        """
+
+        names = self.seeds.keys() if name is None else [name]
+        for key in names:
+            self.generators[key] = np.random.default_rng(self.seeds[key])
+
+
+    def get_state(self):
+
+        """ get current state of all generators (ex: to save in checkpoint) """
+
+        return {name: gen.bit_generator.state for name, gen in self.generators.items()}
+
+
+    def set_state(self, state):
+
+        """ set state of generators (as given by get_state) """
+
+        for name, gen_state in state.items():
+            self.generators[name].bit_generator.state = gen_state
+
+
+    def save(self, output_path):
+
+        """ save seeds in yml file
+
+        Parameters
+        ----------
+        output_path : str
+            absolute path to output file
+        """
+
+        with open(output_path, 'w') as f_out:
+            yaml.dump({'seed': self.seed, 'seeds': self.seeds}, f_out, indent = 4, default_flow_style = False)
+
+
+    @classmethod
+    def from_file(cls, seeds_file):
+
+        """ load RNGRegistry from yml file with seeds (as saved by save) """
+
+        with open(seeds_file, 'r', encoding = 'utf8') as f_in:
+            seeds_dict = yaml.safe_load(f_in)
+
+        return cls(seed = seeds_dict['seed'], seeds = seeds_dict['seeds'])
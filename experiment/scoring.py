@@ -0,0 +1,343 @@
+
+# import relevant packages
+import os
+import os.path as op
+import re
+import glob
+import time
+import argparse
+import yaml
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import get_display_screen, get_run_number
+from design import plan_prf_design
+from rng import RNGRegistry
+from journal import NON_DISPLAY_EVENTS
+from timeline import Timeline
+
+
+# task colors answered with left index, per task (others with right index)
+LEFT_COLORS = {'pRF': ['color_red', 'orange', 'pink'],
+               'FA': ['blue', 'pink']}
+
+
+def feature_trial_table(trial_info_df):
+
+    """ get trial table of feature run, from trial info data frame
+    (_trial_info.csv, saved before run starts)
+
+    Parameters
+    ----------
+    trial_info_df : pandas DataFrame
+        trial info of run (one row per TR)
+
+    Returns
+    -------
+    trial_df : pandas DataFrame
+        one row per bar trial, with trial number, condition (attended color),
+        task color of attended bar, eccentricity index and correct key side
+    """
+
+    bar_df = trial_info_df[trial_info_df['trial_type'] == 'task']
+
+    return pd.DataFrame({'trial_num': bar_df['trial_num'].values.astype(int),
+                         'condition': bar_df['attend_color'].values,
+                         'task_color': bar_df['attend_task_color'].values,
+                         'ecc_ind': bar_df['attend_ecc_ind'].values.astype(float),
+                         'correct_side': np.where(np.isin(bar_df['attend_task_color'].values, LEFT_COLORS['FA']),
+                                                  'left', 'right')})
+
+
+def prf_trial_table(phase_conditions, bar_bool):
+
+    """ get trial table of pRF run, from planned design
+
+    Parameters
+    ----------
+    phase_conditions : arr
+        array with condition names for all phases of all trials (#TRs, #phases)
+    bar_bool : list/arr
+        boolean list indicating which trials are bar trials
+
+    Returns
+    -------
+    trial_df : pandas DataFrame
+        one row per bar trial, with trial number, condition (color category of bar)
+        and correct key side (eccentricity is not defined for pRF bars, so nan)
+    """
+
+    bar_ind = np.where(bar_bool)[0]
+    bar_conditions = np.asarray(phase_conditions)[bar_ind]
+
+    # color of bar is the condition name that is not background
+    task_color = np.where(bar_conditions[:, 0] == 'background', bar_conditions[:, -1], bar_conditions[:, 0])
+
+    return pd.DataFrame({'trial_num': bar_ind,
+                         'condition': task_color,
+                         'task_color': task_color,
+                         'ecc_ind': np.full(len(bar_ind), np.nan),
+                         'correct_side': np.where(np.isin(task_color, LEFT_COLORS['pRF']), 'left', 'right')})
+
+
+def load_events(events_file):
+
+    """ load events file of run (responses as strings, so keys like '1' match settings) """
+
+    events_df = pd.read_csv(events_file, sep = '\t', dtype = {'response': str})
+
+    if 'trial_nr' not in events_df.columns: # saved with index name missing
+        events_df = events_df.rename(columns = {events_df.columns[0]: 'trial_nr'})
+
+    return events_df
+
+
+def score_events(events_df, trial_df, keys = {}, window = 1.6):
+
+    """ score responses of one run, vectorized.
+    Bar onsets are the first logged phase of each bar trial, and responses are aligned to the most recent
+    bar onset with the run timeline (searchsorted). The first response within the response window of a bar is scored,
+    any other response (extra responses in window, or responses after window closed) counts as false alarm
+    of that bar. Responses before the first bar are not scored.
+    Bar trials that were never shown (ex: aborted run) are left out
+
+    Parameters
+    ----------
+    events_df : pandas DataFrame
+        events of run (as in _events.tsv)
+    trial_df : pandas DataFrame
+        trial table of run (from feature_trial_table or prf_trial_table)
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+    window : float
+        duration of response window after bar onset (in seconds)
+
+    Returns
+    -------
+    bar_df : pandas DataFrame
+        one row per bar trial shown, with onset, response, reaction time,
+        correct/miss and number of false alarms
+    """
+
+    ## onset of bar trials
+    timeline = Timeline.from_events(events_df, bar_trials = trial_df['trial_num'].values, bar_window = window,
+                                    phase_events = ~events_df['event_type'].isin(NON_DISPLAY_EVENTS))
+
+    bar_df = trial_df.set_index('trial_num').loc[timeline.bar_trials].reset_index()
+    bar_df['onset'] = timeline.bar_onsets
+    n_bars = len(bar_df)
+
+    ## responses, in time order
+    resp_df = events_df[events_df['event_type'] == 'response'].sort_values('onset', kind = 'stable')
+    resp_t = resp_df['onset'].values.astype(float)
+    resp_keys = resp_df['response'].values.astype(str)
+
+    # most recent bar of each response (-1 if before first bar)
+    bar_idx = timeline.bar_index(resp_t)
+    scored = bar_idx >= 0
+    bar_idx, resp_t, resp_keys = bar_idx[scored], resp_t[scored], resp_keys[scored]
+
+    rel_t = resp_t - timeline.bar_onsets[bar_idx]
+
+    # responses are sorted, so first response of each bar is the first in its window (if any)
+    first_of_bar = np.r_[True, bar_idx[1:] != bar_idx[:-1]] if len(bar_idx) > 0 else np.zeros(0, dtype = bool)
+    hit = first_of_bar & (timeline.bar_at(resp_t) >= 0)
+
+    ## fill per bar
+    responded = np.zeros(n_bars, dtype = bool)
+    responded[bar_idx[hit]] = True
+
+    response = np.full(n_bars, None, dtype = object)
+    response[bar_idx[hit]] = resp_keys[hit]
+
+    rt = np.full(n_bars, np.nan)
+    rt[bar_idx[hit]] = rel_t[hit]
+
+    # side of key pressed
+    left_keys = np.array([str(k) for k in keys['left_index']])
+    right_keys = np.array([str(k) for k in keys['right_index']])
+
+    side = np.full(n_bars, None, dtype = object)
+    side[bar_idx[hit]] = np.where(np.isin(resp_keys[hit], left_keys), 'left',
+                                  np.where(np.isin(resp_keys[hit], right_keys), 'right', 'other'))
+
+    bar_df['responded'] = responded
+    bar_df['response'] = response
+    bar_df['rt'] = rt
+    bar_df['correct'] = responded & (side == bar_df['correct_side'].values)
+    bar_df['miss'] = ~responded
+    bar_df['false_alarms'] = np.bincount(bar_idx[~hit], minlength = n_bars)
+
+    return bar_df
+
+
+def summarize_scores(bar_df, by = ['condition', 'ecc_ind']):
+
+    """ summarize scored bars per condition and eccentricity
+
+    Parameters
+    ----------
+    bar_df : pandas DataFrame
+        scored bars (from score_events), can have several runs
+    by : list
+        columns to group by
+
+    Returns
+    -------
+    summary_df : pandas DataFrame
+        number of bars, accuracy, hit rate, mean and median reaction time (of correct responses),
+        misses and false alarms for each group
+    """
+
+    df = bar_df.assign(correct_rt = bar_df['rt'].where(bar_df['correct']))
+
+    summary_df = df.groupby(by, dropna = False).agg(n_bars = ('correct', 'size'),
+                                                    n_correct = ('correct', 'sum'),
+                                                    accuracy = ('correct', 'mean'),
+                                                    hit_rate = ('responded', 'mean'),
+                                                    mean_rt = ('correct_rt', 'mean'),
+                                                    median_rt = ('correct_rt', 'median'),
+                                                    misses = ('miss', 'sum'),
+                                                    false_alarms = ('false_alarms', 'sum'))
+
+    return summary_df.reset_index()
+
+
+def get_run_trial_table(events_file, settings, task = 'FA'):
+
+    """ get trial table of run, from files saved in its output folder
+    (feature runs: _trial_info.csv; pRF runs: design is planned again from _seeds.yml)
+
+    Parameters
+    ----------
+    events_file : str
+        absolute path to run events file (_events.tsv)
+    settings : dict
+        settings used in run
+    task : str
+        task of run ('pRF' or 'FA')
+    """
+
+    output_str = op.basename(events_file).replace('_events.tsv', '')
+    output_dir = op.dirname(events_file)
+
+    if task == 'FA':
+        return feature_trial_table(pd.read_csv(op.join(output_dir, output_str+'_trial_info.csv')))
+
+    elif task == 'pRF':
+        rng = RNGRegistry.from_file(op.join(output_dir, output_str+'_seeds.yml'))
+        design = plan_prf_design(settings, get_display_screen(settings, settings['window_extra']['size']),
+                                 rng = rng.get('design'))
+
+        return prf_trial_table(design['phase_conditions'], design['bar_bool'])
+
+    else:
+        raise NotImplementedError('Scoring not implemented for task %s'%task)
+
+
+def score_run(events_file, settings_file = None, window = None):
+
+    """ score one run, from its output files
+
+    Parameters
+    ----------
+    events_file : str
+        absolute path to run events file (_events.tsv)
+    settings_file : str/None
+        settings used in run (if None, uses _expsettings.yml saved with run)
+    window : float/None
+        duration of response window (in seconds), if None same as TR
+
+    Returns
+    -------
+    bar_df : pandas DataFrame
+        scored bars of run, with subject, run and task columns
+    """
+
+    output_str = op.basename(events_file).replace('_events.tsv', '')
+    task = re.search(r'task-(.+?)(_|$)', output_str).group(1)
+
+    if settings_file is None:
+        settings_file = op.join(op.dirname(events_file), output_str+'_expsettings.yml')
+
+    with open(settings_file, 'r', encoding = 'utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+
+    bar_df = score_events(load_events(events_file), get_run_trial_table(events_file, settings, task = task),
+                          keys = settings['keys'],
+                          window = settings['mri']['TR'] if window is None else window)
+
+    bar_df.insert(0, 'sj', re.search(r'sub-(.+?)(_|$)', output_str).group(1))
+    bar_df.insert(1, 'task', task)
+    bar_df.insert(2, 'run', get_run_number(output_str))
+
+    return bar_df
+
+
+def score_runs(events_files, settings_file = None, window = None, n_jobs = None):
+
+    """ score many runs in parallel (process pool)
+
+    Parameters
+    ----------
+    events_files : list
+        absolute paths to run events files (_events.tsv)
+    settings_file : str/None
+        settings used in runs (if None, uses _expsettings.yml saved with each run)
+    window : float/None
+        duration of response window (in seconds), if None same as TR
+    n_jobs : int/None
+        number of worker processes (if None, uses all cpus)
+
+    Returns
+    -------
+    bar_df : pandas DataFrame
+        scored bars of all runs
+    """
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        futures = [executor.submit(score_run, events_file, settings_file = settings_file, window = window)
+                   for events_file in events_files]
+        all_bars = [f.result() for f in futures]
+
+    return pd.concat(all_bars, ignore_index = True)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Score behavioral responses of all runs from event logs')
+    parser.add_argument('--sourcedata', type = str, default = None,
+                        help = 'folder with subject output folders (default output/sourcedata)')
+    parser.add_argument('--tasks', nargs = '+', default = ['pRF', 'FA'], choices = ['pRF', 'FA'])
+    parser.add_argument('--settings_file', type = str, default = None,
+                        help = 'settings file (if not as saved with each run)')
+    parser.add_argument('--window', type = float, default = None, help = 'response window in seconds (default TR)')
+    parser.add_argument('--n_jobs', type = int, default = None, help = 'number of processes (default all cpus)')
+    args = parser.parse_args()
+
+    ## path to outcomes
+    # DEFAULTS TO ROOT FOLDER (as main.py)
+    sourcedata = op.join(op.split(os.getcwd())[0], 'output', 'sourcedata') if args.sourcedata is None else args.sourcedata
+
+    events_files = sorted([f for task in args.tasks
+                           for f in glob.glob(op.join(sourcedata, 'sub-*', 'sub-*_task-%s_run-*_events.tsv'%task))])
+
+    print('Scoring %i runs'%len(events_files))
+
+    start_time = time.time()
+
+    bar_df = score_runs(events_files, settings_file = args.settings_file, window = args.window, n_jobs = args.n_jobs)
+    summary_df = summarize_scores(bar_df, by = ['sj', 'task', 'run', 'condition', 'ecc_ind'])
+
+    print(summary_df.to_string(index = False))
+    print('%i runs scored in %.2f s'%(len(events_files), time.time() - start_time))
+
+    bar_df.to_csv(op.join(sourcedata, 'scores_bars.csv'), index = False)
+    summary_df.to_csv(op.join(sourcedata, 'scores_summary.csv'), index = False)
+    print('scores saved in %s'%sourcedata)
+
+
+if __name__ == '__main__':
+    main()
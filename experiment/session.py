@@ -1,20 +1,38 @@
 
 import os
 import os.path as op
+import time
 import numpy as np
+import pandas as pd
+import yaml
 
 from exptools2.core import Session, PylinkEyetrackerSession
 
 from trial import PRFTrial, FeatureTrial, FlickerTrial
 from stim import PRFStim, FeatureStim, FlickerStim
+from aperture import export_aperture
+from design import get_design
+from rng import RNGRegistry
+from realtime import RealtimeMode, FrameAllocationCounter
+from logger import RunLogger, get_logger
+from journal import EventJournal, format_events
+from checkpoint import RunCheckpoint, CHECKPOINT_COUNTERS, keep_interrupted_events
+from timeline import Timeline
+from staircase import StaircaseBank, QuestBank
+from fixation import FixationMonitor, tracker_gaze_getter
+from messenger import TrackerMessenger
 
 from psychopy import visual, tools
-from psychopy.data import QuestHandler, StairHandler
 
 import itertools
 import pickle
 
 from utils import *
+from draw_utils import draw_instructions, make_instructions_text, update_elements
+from io_utils import save_bar_position, save_all_TR_info, get_average_color
+
+
+logger = get_logger(__name__)
 
 
 class ExpSession(PylinkEyetrackerSession):
@@ -37,18 +55,48 @@ class ExpSession(PylinkEyetrackerSession):
             # need to initialize parent class (Session), indicating output infos
             super().__init__(output_str = output_str, output_dir = output_dir, settings_file = settings_file, eyetracker_on = eyetracker_on)
 
+            # diagnostics are written to run log file by a background thread
+            self.run_logger = RunLogger(**self.settings['logging'])
+            self.run_logger.start(op.join(self.output_dir, self.output_str+'_diagnostics.log'))
+
+            # eyetracker messages are sent from a background thread, so they can't stall a frame
+            self.start_messenger()
+
             # set size of display
+            self.screen = get_display_screen(self.settings, self.win.size)
+
             if self.settings['window_extra']['display'] == 'square':
-                self.screen = np.array([self.win.size[1], self.win.size[1]])
                 rect_contrast = 1
             
             elif self.settings['window_extra']['display'] == 'rectangle':
-                self.screen = np.array([self.win.size[0], self.win.size[1]])
                 rect_contrast = 0 # then rectangles will be hidden
 
             if self.settings['window_extra']['mac_bool']: # to compensate for macbook retina display
-                self.screen = self.screen/2
-                print('Running experiment on macbook, defining display accordingly')
+                logger.info('Running experiment on macbook, defining display accordingly')
+
+            # seeded random generators, one per subsystem 
+            # (seeds saved in output folder, to be able to replay run)
+            self.setup_rng()
+
+            # events are streamed to disk during run, so they are kept if session crashes
+            # (journal starts with trials, after an interrupted run is resumed)
+            self.journal = None
+
+            # state saved at every trial boundary, to resume run if interrupted
+            self.start_checkpoint()
+
+            # gaze checked online from background thread, started with run
+            self.fixation_monitor = None
+            # garbage collection mode of trial loop
+            self.realtime = None
+
+            # stimuli are only created once, and reused if several runs are done in same session
+            self.stimuli_created = False
+            # if True, window is kept open when run ends (to run next run)
+            self.keep_open = False
+
+            # to count memory allocated in each frame (instrumentation)
+            self.alloc_counter = FrameAllocationCounter() if self.settings['realtime']['count_allocations'] else None
 
             # some MRI params
             self.bar_step = self.settings['mri']['TR'] # in seconds
@@ -57,27 +105,13 @@ class ExpSession(PylinkEyetrackerSession):
             ## make grid of possible positions for gabors 
             # (grid spans whole display, bar will alter specific part of grid)
 
-            ## first set the number of elements that fit each dimension
-            elem_num = np.array(self.settings['stimuli']['num_elem'])
-
-            gabor_diameter_pix = np.array(self.screen)/(elem_num * self.settings['stimuli']['gab_ratio'])
-            self.gabor_diameter_pix = gabor_diameter_pix[0]
+            self.grid_pos, self.gabor_diameter_pix = get_grid_positions(self.screen, 
+                                                                        num_elem = self.settings['stimuli']['num_elem'], 
+                                                                        gab_ratio = self.settings['stimuli']['gab_ratio'])
 
-            print('gabor diameter in pix %s'%str(self.gabor_diameter_pix))
-            print('gabor diameter in deg %s'%str(tools.monitorunittools.pix2deg(self.gabor_diameter_pix, self.monitor)))
-            
-            # then set equally spaced x and y coordinates for grid
-            x_grid_pos = np.linspace(-self.screen[0]/2,
-                                     self.screen[0]/2,
-                                     int(elem_num[0]))
-
-            y_grid_pos = np.linspace(-self.screen[1]/2,
-                                     self.screen[1]/2,
-                                     int(elem_num[1]))
-            
-
-            self.grid_pos = np.array(list(itertools.product(x_grid_pos, y_grid_pos))) # list of lists [[x0,y0],[x0,y1],...]
-            print(self.grid_pos.shape)
+            logger.info('gabor diameter in pix %s', self.gabor_diameter_pix)
+            logger.info('gabor diameter in deg %s', tools.monitorunittools.pix2deg(self.gabor_diameter_pix, self.monitor))
+            logger.info('grid positions shape %s', self.grid_pos.shape)
 
             ## create some elements that will be common to both tasks ##
             
@@ -133,186 +167,585 @@ class ExpSession(PylinkEyetrackerSession):
                                     )
 
 
-class PRFSession(ExpSession):
-   
-    def __init__(self, output_str, output_dir, settings_file, eyetracker_on):  # initialize child class
+    def setup_rng(self):
+
+        """ set random generators of run, and save seeds in output folder """
+
+        seeds_file = op.join(self.output_dir, self.output_str+'_seeds.yml')
+
+        if self.settings['rng']['reuse'] and self.settings['rng']['seed'] is None and op.exists(seeds_file):
+            # relaunch of same run, keep seeds so design is identical
+            logger.info('reusing seeds from %s', seeds_file)
+            self.rng = RNGRegistry.from_file(seeds_file)
+        else:
+            self.rng = RNGRegistry(seed = self.settings['rng']['seed'])
+            self.rng.save(seeds_file)
+
+
+    def reset_run(self, output_str):
+
+        """ reset per-run state, to do another run in the same session
+        (window, stimuli and eyetracker connection are kept)
 
-        """ Initializes PRFSession object. 
-      
         Parameters
         ----------
         output_str : str
-            Basename for all output-files (like logs), e.g., "sub-01_task-PRFstandard_run-1"
-        output_dir : str
-            Path to desired output-directory (default: None, which results in $pwd/logs)
-        settings_file : str
-            Path to yaml-file with settings (default: None, which results in the package's
-            default settings file (in data/default_settings.yml)
+            Basename for all output-files of next run, e.g., "sub-001_ses-1_task-pRF_run-2"
         """
 
-        # need to initialize parent class (ExpSession), indicating output infos
-        super().__init__(output_str = output_str, output_dir = output_dir, settings_file = settings_file, 
-                        eyetracker_on = eyetracker_on)
+        self.output_str = output_str
 
-        
+        # log of next run
+        self.run_logger.start(op.join(self.output_dir, self.output_str+'_diagnostics.log'))
 
-    def create_stimuli(self):
+        # exptools bookkeeping
+        self.global_log = pd.DataFrame(columns = ['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames'])
+        self.nr_frames = 0
+        self.first_trial = True
+        self.current_trial = None
+        self.exp_start = None
+        self.exp_stop = None
+        self.win.frameIntervals = []
+        self.logfile = self._create_logfile()
 
-        """ Create Stimuli - pRF bar """
-        
-        #generate PRF stimulus
-        self.prf_stim = PRFStim(session = self, 
-                                bar_width_ratio = self.settings['stimuli']['prf']['bar_width_ratio'], 
-                                grid_pos = self.grid_pos
-                                )
+        # settings used in run
+        with open(op.join(self.output_dir, self.output_str+'_expsettings.yml'), 'w') as f_out:
+            yaml.dump(self.settings, f_out, indent = 4, default_flow_style = False)
 
+        # new random generators, and element orientations
+        self.setup_rng()
+        self.journal = None
+        self.start_checkpoint()
 
-    def create_trials(self):
+        if self.stimuli_created:
+            self.get_stim().reset_run()
 
-        """ Creates trials (before running the session) """
 
-        #
-        # counter for responses
-        self.total_responses = 0
-        self.expected_responses = 0
-        self.correct_responses = 0
-        self.bar_counter = 0
+    def get_stim(self):
+
+        """ get stimulus object of task """
+
+        return [getattr(self, name) for name in ['prf_stim', 'feature_stim', 'flicker_stim'] if hasattr(self, name)][0]
 
-        # define bar width 
-        bar_width_ratio = self.settings['stimuli']['prf']['bar_width_ratio']
-        self.bar_width_pix = self.screen*bar_width_ratio
 
-        # number of TRs per "type of stimuli"
-        bar_pass_hor_TR = self.settings['stimuli']['prf']['bar_pass_hor_TR'] 
-        bar_pass_ver_TR = self.settings['stimuli']['prf']['bar_pass_ver_TR']
+    def warmup(self, instruction_string, height = 40):
 
-        # list with order of bar orientations throught experiment
-        bar_pass_direction = self.settings['stimuli']['prf']['bar_pass_direction'] 
+        """ prime textures and draw paths before the first trigger, while the waiting screen is up.
+        Bar element arrays are updated and drawn (at zero opacity) for all conditions and bar configurations of run,
+        so first frames of run don't pay for texture uploads and lazy allocations
 
-        # all possible positions in pixels [x,y] for for midpoint of
-        # vertical bar passes, 
-        ver_y = self.screen[1]*np.linspace(-0.5,0.5, bar_pass_ver_TR)
+        Parameters
+        ----------
+        instruction_string : str
+            waiting screen text, drawn on every warm up frame
+        height : int
+            text height
+
+        Returns
+        -------
+        frame_times : arr
+            time (in seconds) of each warm up frame (update, draw and flip)
+        """
 
-        ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
+        stim = self.get_stim()
+        text = make_instructions_text(self.win, instruction_string, height = height)
 
-        # horizontal bar passes 
-        hor_x = self.screen[0]*np.linspace(-0.5,0.5, bar_pass_hor_TR)
+        # bar arrays of task
+        bar_names = [name for name in ['bar0', 'bar1'] if hasattr(self, name+'_array')]
 
-        hor_bar_pos_pix = np.array([np.array([x,0]) for _,x in enumerate(hor_x)])
+        # all condition colors (and task colors) 
+        conditions = []
+        for name, cond in self.settings['stimuli']['conditions'].items():
+            if name != 'background':
+                conditions.append((name, False))
+                if 'task_color' in cond:
+                    conditions += [(name, task_cond['element_color']) for task_cond in cond['task_color'].values()]
 
-        #create as many trials as TRs
-        trial_number = 0
-        bar_pass_direction_all = [] # list of bar orientation at all TRs
+        # unique bar configurations of run
+        configs = {}
+        for trl in self.all_trials:
+            if all(name in trl.position_dictionary for name in bar_names):
+                key = b''.join(trl.position_dictionary[name]['xys'].tobytes() for name in bar_names)
+                configs.setdefault(key, trl.position_dictionary)
+        configs = list(configs.values())[:self.settings['warmup']['max_bar_configs']]
 
-        bar_pos_array = [] # list with bar midpoint (x,y) for all TRs (if nan, then empty screen)
+        if len(configs) == 0:
+            return np.array([])
 
-        for _,bartype in enumerate(bar_pass_direction):
-            if 'empty' in bartype: # empty screen
-                trial_number += self.settings['stimuli']['prf'][bartype+'_TR']
-                bar_pass_direction_all = bar_pass_direction_all + np.repeat('empty',self.settings['stimuli']['prf'][bartype+'_TR']).tolist()
-                bar_pos_array.append([np.array([np.nan,np.nan]) for i in range(self.settings['stimuli']['prf'][bartype+'_TR'])])
+        # frames to draw - all conditions, all configurations, and then same frame again (steady state)
+        frames = [(cond, configs[0]) for cond in conditions] + [(conditions[0], config) for config in configs[1:]]
+        frames += [frames[-1]] * self.settings['warmup']['steady_frames']
 
-            elif bartype in np.array(['U-D','D-U']): # vertical bar pass
-                trial_number += bar_pass_ver_TR
-                self.expected_responses += bar_pass_ver_TR
-                bar_pass_direction_all =  bar_pass_direction_all + np.repeat(bartype,bar_pass_ver_TR).tolist()
-                
-                # order depending on starting point for bar pass, and append to list
-                position_list = np.sort(ver_bar_pos_pix,axis=0) if bartype=='D-U' else np.sort(ver_bar_pos_pix,axis=0)[::-1]
-                bar_pos_array.append(position_list)
+        # separate generator, so random draws of run are not changed
+        warmup_rng = np.random.default_rng(0)
 
-            elif bartype in np.array(['L-R','R-L']): # horizontal bar pass
-                trial_number += bar_pass_hor_TR
-                self.expected_responses += bar_pass_hor_TR
-                bar_pass_direction_all =  bar_pass_direction_all + np.repeat(bartype,bar_pass_hor_TR).tolist()
-                
-                # order depending on starting point for bar pass, and append to list
-                position_list = np.sort(hor_bar_pos_pix,axis=0) if bartype=='L-R' else np.sort(hor_bar_pos_pix,axis=0)[::-1]
-                bar_pos_array.append(position_list)
+        frame_times = []
+        for (this_phase, new_color), position_dictionary in frames:
 
-        self.trial_number = trial_number # total number of trials 
-        print("Total number of (expected) TRs: %d"%self.trial_number)
-        self.bar_pass_direction_all = bar_pass_direction_all # list of strings with bar orientation/empty
+            start_time = time.perf_counter()
 
-        # list of midpoint position (x,y) of bar for all TRs (if empty, then nan)
-        self.bar_midpoint_all = np.array([val for sublist in bar_pos_array for val in sublist])
+            for name in bar_names:
+                bar_array = update_elements(ElementArrayStim = getattr(self, name+'_array'),
+                                            condition_settings = stim.condition_settings, 
+                                            this_phase = this_phase, 
+                                            elem_positions = position_dictionary[name]['xys'], 
+                                            grid_pos = self.grid_pos,
+                                            monitor = self.monitor, 
+                                            screen = self.screen,
+                                            orientation = False,
+                                            new_color = new_color,
+                                            ori_rng = warmup_rng,
+                                            jitter_rng = warmup_rng,
+                                            tex_cache = stim.tex_cache,
+                                            buffers = stim.element_buffers[name])
+                bar_array.setOpacities(0)
+                bar_array.draw()
 
-        # make boolean array to see which trials are stim trials
-        self.bar_bool = [False if x == 'empty' else True for _,x in enumerate(self.bar_pass_direction_all)]
+            text.draw()
+            self.rect_left.draw()
+            self.rect_right.draw()
+            self.win.flip()
 
-        # if in scanner, we want it to be synced to trigger, so lets increase trial time (in seconds, like TR)
-        max_trial_time = 5 if self.settings['stimuli']['prf']['sync_scanner']==True else self.settings['mri']['TR']
+            frame_times.append(time.perf_counter() - start_time)
 
-        # flicker frequency
-        flick_rate = self.settings['stimuli']['prf']['flick_rate']
+        frame_times = np.array(frame_times)
 
-        # number of samples in trial
-        n_samples = max_trial_time * flick_rate
+        # steady state only from repeated frames at the end (none if steady_frames is 0)
+        steady_times = frame_times[len(frame_times) - self.settings['warmup']['steady_frames']:]
 
-        ## get condition names and randomize them for each trial 
-        
-        key_list = []
-        for key in self.settings['stimuli']['prf']['color_categories']:  
-            # if showing red and green bars
-            if self.settings['stimuli']['prf']['task_on_main_categories']: 
-                key_list.append(key)
-            
-            else: # other color variants
-                for name in self.settings['stimuli']['prf']['task_colors'][key]:
-                    key_list.append(name)
+        logger.info('warm up: %i frames, first frame %.1f ms, max %.1f ms, steady state %.1f ms', len(frame_times), 
+                                                                                     frame_times[0]*1000, 
+                                                                                     frame_times.max()*1000,
+                                                                                     np.median(steady_times)*1000 if len(steady_times) > 0 else np.nan)
+
+        return frame_times
+
+
+    def wait_for_scanner(self, instruction_string, height = 40):
+
+        """ show waiting screen (warming up draw paths while it is up) and wait for scanner trigger """
+
+        if self.settings['warmup']['use']:
+            self.warmup_times = self.warmup(instruction_string, height = height)
+
+        # don't clear events, trigger might have come during warm up
+        draw_instructions(self.win, instruction_string, keys = [self.settings['mri'].get('sync', 't')], 
+                          visual_obj = [self.rect_left,self.rect_right], height = height, 
+                          clear_events = not self.settings['warmup']['use'])
+
+
+    def prepare_run(self):
+
+        """ set up everything the trial loop needs, before waiting for the scanner trigger
+        (so none of it delays the first trial): restore checkpoint of interrupted run, start journal, 
+        fixation monitor and allocation counter, and enter real-time mode (garbage collected and frozen) """
+
+        if self.alloc_counter is not None:
+            self.alloc_counter.start()
+
+        # continue from checkpoint of interrupted run
+        if self.resume_state is not None:
+            self.restore_state(self.resume_state)
+
+        self.start_journal()
+        self.start_fixation_monitor()
+
+        self.realtime = RealtimeMode(enabled = self.settings['realtime']['use'])
+        self.realtime.__enter__()
+
+
+    def run_trials(self):
+
+        """ cycle through trials of run - in real-time mode entered by prepare_run (garbage collection only in between trials),
+        and counting allocations per frame, if such is set in settings """
+
+        # session clock was reset by trigger, gaze flagged while waiting is not part of run
+        if self.fixation_monitor is not None:
+            self.fixation_monitor.discard_breaks()
+
+        try:
+            for trl in self.all_trials[self.start_trial:]: 
+                trl.run() # run forrest run
+
+                # fixation breaks flagged during trial are logged at trial boundary
+                self.log_fixation_breaks()
+
+                # trials end at TR boundaries, hand over new events to journal
+                if self.journal is not None:
+                    self.journal.write(self.global_log, self.exp_start)
+
+                if self.checkpoint is not None:
+                    self.checkpoint.save_state(self.get_state(next_trial = trl.trial_nr + 1))
+
+                self.realtime.collect()
+        finally:
+            self.realtime.__exit__(None, None, None)
+
+        self.stop_fixation_monitor()
+
+        if self.alloc_counter is not None:
+            self.alloc_counter.stop()
+            logger.info('allocations per frame: %s', self.alloc_counter.summary())
+
+
+    def save_events(self):
+
+        """ save events of run to tsv (as exptools does when closing the session),
+        without closing window """
+
+        self.exp_stop = self.clock.getTime()
+
+        global_log = format_events(self.global_log, self.exp_start, self.exp_stop, nr_frames = self.nr_frames)
+        global_log.to_csv(op.join(self.output_dir, self.output_str+'_events.tsv'), sep = '\t', index = True)
+
+
+    def end_run(self):
+
+        """ end run - close session, or keep it open if more runs will follow """
+
+        if self.keep_open:
+            if self.eyetracker_on:
+                # messages of run need to be in the recording
+                if isinstance(self.tracker, TrackerMessenger):
+                    self.tracker.flush()
+                self.stop_recording_eyetracker()
+
+            self.close_journal()
+            self.save_events()
+            self.remove_journal()
+
+            if self.checkpoint is not None:
+                self.checkpoint.remove()
+            logger.info('Run %s done, keeping session open for next run', self.output_str)
+        else:
+            self.close() # close session
+
+
+    def close(self):
+
+        """ close session, and write remaining events to journal and records to run log """
+
+        self.stop_fixation_monitor()
+        self.stop_messenger()
+        self.close_journal()
+
+        # exptools would give fixation breaks a phase duration, so they are added to events file after it is saved
+        fixation_breaks = self.pop_fixation_breaks()
+        super().close()
+        self.save_fixation_breaks(fixation_breaks)
+
+        self.remove_journal()
+
+        # checkpoint not needed once last trial is reached
+        if self.checkpoint is not None and self.current_trial is not None and self.current_trial is self.all_trials[-1]:
+            self.checkpoint.remove()
+
+        # run interrupted (ex: quit with 'q'), events are kept apart so resumed run does not overwrite them
+        if self.checkpoint is not None and self.checkpoint.exists():
+            keep_interrupted_events(self.output_dir, self.output_str, self.get_n_resumes())
+
+        self.run_logger.stop()
+
+
+    def start_messenger(self):
+
+        """ replace eyetracker with wrapper that queues messages and sends them from background thread
+        (if such is set in settings, and eyetracker is connected) """
+
+        if self.settings['eyetracker']['messenger']['use'] and getattr(self, 'tracker', None) is not None:
+            self.tracker = TrackerMessenger(self.tracker, self.clock)
+            self.tracker.start()
+
+
+    def stop_messenger(self):
+
+        """ send messages still in queue (messages sent after this are not queued) """
+
+        if isinstance(getattr(self, 'tracker', None), TrackerMessenger) and self.tracker.thread is not None:
+            self.tracker.stop()
+            logger.info('eyetracker messages: %s', self.tracker.summary())
+
+
+    def start_fixation_monitor(self):
+
+        """ start polling gaze of eyetracker in background thread, to flag fixation breaks online
+        (if such is set in settings, and eyetracker is connected) """
+
+        monitor_settings = self.settings['eyetracker']['monitor']
+
+        if not monitor_settings['use'] or getattr(self, 'tracker', None) is None:
+            return
+
+        self.fixation_monitor = FixationMonitor(tracker_gaze_getter(self.tracker, self.win.size), self.clock,
+                                                radius = tools.monitorunittools.deg2pix(self.settings['eyetracker']['fixation_radius'],
+                                                                                        self.monitor),
+                                                min_break = self.settings['eyetracker']['min_break_duration'],
+                                                poll_interval = monitor_settings['poll_interval'],
+                                                buffer_size = monitor_settings['buffer_size'])
+        self.fixation_monitor.start()
+
+
+    def stop_fixation_monitor(self):
+
+        """ stop polling gaze, and log fixation break still going on """
+
+        if self.fixation_monitor is not None:
+            self.fixation_monitor.stop()
+            self.log_fixation_breaks()
+
+            logger.info('fixation monitor: %i gaze samples, %i fixation breaks',
+                        self.fixation_monitor.n_samples, self.fixation_monitor.n_breaks)
+            self.fixation_monitor = None
+
+
+    def log_fixation_breaks(self):
+
+        """ log fixation breaks flagged by fixation monitor in session data frame
+        (as 'fixation_break' events, at the trial where the break started) """
+
+        if self.fixation_monitor is None:
+            return
+
+        timeline = getattr(self, 'timeline', None)
+
+        for start, end, max_dist in self.fixation_monitor.get_breaks():
+
+            trial_nr = timeline.trial_at(start) if timeline is not None else self.current_trial.trial_nr
+
+            log_event(self.global_log, trial_nr = trial_nr, onset = start, event_type = 'fixation_break', 
+                      phase = 0, response = None, 
+                      parameters = {'break_duration': end - start,
+                                    'break_distance': tools.monitorunittools.pix2deg(max_dist, self.monitor)})
+
+
+    def pop_fixation_breaks(self):
+
+        """ remove fixation breaks from session data frame (returned as data frame) """
+
+        if 'event_type' not in self.global_log.columns:
+            return pd.DataFrame()
+
+        break_idx = self.global_log['event_type'] == 'fixation_break'
+
+        fixation_breaks = self.global_log[break_idx].copy()
+        self.global_log = self.global_log[~break_idx].reset_index(drop = True)
+
+        return fixation_breaks
+
+
+    def save_fixation_breaks(self, fixation_breaks):
+
+        """ add fixation breaks to events file saved by exptools """
+
+        events_file = op.join(self.output_dir, self.output_str+'_events.tsv')
+
+        if len(fixation_breaks) == 0 or not op.exists(events_file):
+            return
 
-        # define how many times bar features switch during TR, according to flick rate defined 
-        if self.settings['stimuli']['prf']['flick_stim_rate'] == 'TR': # if changing features at every TR
+        events_df = pd.read_csv(events_file, sep = '\t')
 
-            phase_conditions = np.repeat(key_list, sum(self.bar_bool)/len(key_list)) # only do this for bar showing trials
-            np.random.shuffle(phase_conditions) # randomized conditions, for attention to bar task
+        fixation_breaks = fixation_breaks.assign(onset_abs = fixation_breaks['onset'] + self.exp_start)
+        events_df = pd.concat([events_df, fixation_breaks])
 
-            if self.settings['stimuli']['prf']['flick_on_off'] == True: # interleave with background if we want and on-off bar
+        events_df.sort_values('onset', kind = 'stable').round({'onset': 5, 'onset_abs': 5}).to_csv(events_file, sep = '\t', index = False)
 
-                self.phase_conditions = np.array([list(np.tile([val,'background'],int(np.round(n_samples)))) for _,val in enumerate(phase_conditions)])
 
-            else:
-                self.phase_conditions = np.array([list(np.tile(val,int(np.round(n_samples)))) for _,val in enumerate(phase_conditions)])
+    def start_journal(self):
 
-            # define list with number of phases and their duration (duration of each must be the same)
-            self.phase_durations = np.repeat(max_trial_time/self.phase_conditions.shape[-1], self.phase_conditions.shape[-1])   
+        """ start streaming events of run to journal (_events_journal.tsv), if such is set in settings """
 
-        else: # if changing features randomly at flick rate
+        self.journal = None
 
-            # repeat keys, so for each bar pass it shows each condition X times
-            key_list = np.array(key_list*round(n_samples/len(key_list))) 
+        if self.settings['journal']['use']:
+            self.journal = EventJournal(op.join(self.output_dir, self.output_str+'_events_journal.tsv'))
+            self.journal.start()
 
-            if self.settings['stimuli']['prf']['flick_on_off'] == True: # interleave with background if we want and on-off bar
 
-                on_list = list(key_list)
-                off_list = list(np.tile('background',len(on_list)))
+    def close_journal(self):
 
-                key_list = on_list + off_list
-                key_list[::2] = on_list
-                key_list[1::2] = off_list
-            else:
-                key_list = list(key_list) + list(key_list) 
+        """ write remaining events to journal, and wait until they are on disk """
 
-            phase_conditions = key_list
+        if self.journal is not None:
+            self.journal.close(self.global_log, self.exp_start)
 
-            # stack them in trial
-            for r in range(sum(self.bar_bool)-1):            
-                phase_conditions = np.vstack((phase_conditions,key_list))
 
-            self.phase_conditions = phase_conditions
+    def remove_journal(self):
 
-            # define list with number of phases and their duration (duration of each must be the same)
-            self.phase_durations = np.repeat(max_trial_time/self.phase_conditions.shape[-1], self.phase_conditions.shape[-1])
+        """ remove journal once events file is saved (unless set to keep it) """
 
-        ## now make phase condition array the same size as task, 
-        # i.e. fill non bar trials with background
-        all_phase_conditions = (np.stack([np.tile('background', self.phase_conditions.shape[-1]) for i in range(self.trial_number)]))
-        all_phase_conditions[self.bar_bool] = self.phase_conditions.copy()
+        if self.journal is not None and not self.settings['journal']['keep']:
+            if op.exists(op.join(self.output_dir, self.output_str+'_events.tsv')) and op.exists(self.journal.journal_file):
+                os.remove(self.journal.journal_file)
 
-        self.phase_conditions = all_phase_conditions.copy() 
 
-        # total experiment time (in seconds)
-        self.total_time = self.trial_number * max_trial_time  
+    def start_checkpoint(self):
+
+        """ set checkpoint of run (_checkpoint.pkl), if such is set in settings """
+
+        self.checkpoint = RunCheckpoint(self.output_dir, self.output_str) if self.settings['checkpoint']['use'] else None
+
+        # only set when resuming interrupted run
+        self.resume_design = None
+        self.resume_state = None
+        self.start_trial = 0
+
+
+    def get_state(self, next_trial):
+
+        """ get session state at trial boundary, to save in checkpoint
+
+        Parameters
+        ----------
+        next_trial : int
+            index of trial to run next
+        """
+
+        return {'next_trial': next_trial,
+                'att_color': getattr(self, 'att_color', None),
+                'n_resumes': self.get_n_resumes(),
+                'counters': {name: getattr(self, name) for name in CHECKPOINT_COUNTERS if hasattr(self, name)},
+                'rng': self.rng.get_state(),
+                'condition_settings': self.get_stim().condition_settings}
+
+
+    def get_n_resumes(self):
+
+        """ number of times current run was resumed """
+
+        return 0 if self.resume_state is None else self.resume_state['n_resumes'] + 1
+
+
+    def restore_state(self, state):
+
+        """ set session state saved in checkpoint (after trials are created) """
+
+        for name, val in state['counters'].items():
+            setattr(self, name, val)
+
+        self.rng.set_state(state['rng'])
+
+        # colors (ex: flicker luminance calibration) updated in place, stimuli hold the same dict
+        self.get_stim().condition_settings.update(state['condition_settings'])
+
+        self.start_trial = state['next_trial']
+
+        # counters restored above are for times of whole run, while clock starts again at resumed trial
+        if getattr(self, 'timeline', None) is not None:
+            self.timeline.resume_at(self.start_trial)
+
+
+    def resume(self):
+
+        """ load checkpoint of interrupted run, to continue from trial after last one completed.
+        Events logged before the interruption are saved in _events_pre-resume-<N>.tsv,
+        the events file of the run has the trials done after resuming """
+
+        if self.checkpoint is None:
+            raise NameError('Checkpoints are not enabled in settings, cannot resume run')
+
+        self.resume_design, self.resume_state = self.checkpoint.load()
+
+        if self.resume_state['att_color'] is not None:
+            self.att_color = self.resume_state['att_color']
+
+        # save events of interrupted run (if not done when session closed), new journal starts with trials
+        journal_file = op.join(self.output_dir, self.output_str+'_events_journal.tsv')
+
+        if keep_interrupted_events(self.output_dir, self.output_str, self.resume_state['n_resumes'], 
+                                   journal_file = journal_file) is not None and op.exists(journal_file):
+            os.remove(journal_file)
+
+        logger.info('Resuming run %s from trial %i', self.output_str, self.resume_state['next_trial'])
+
+
+    def get_design(self, task, **kwargs):
+
+        """ get trial design of run (from design cache in output folder, if enabled,
+        or from checkpoint if resuming run) """
+
+        if self.resume_design is not None:
+            return self.resume_design
+
+        cache_dir = op.join(self.output_dir, self.settings['design']['cache_folder']) if self.settings['design']['cache'] else None
+
+        design = get_design(task, self.settings, self.screen, 
+                            seed = self.rng.seeds['design'], 
+                            rng = self.rng.get('design'), 
+                            cache_dir = cache_dir, **kwargs)
+
+        # saved before run starts, so it is not written at trial boundaries
+        if self.checkpoint is not None:
+            self.checkpoint.save_design(design)
+
+        return design
+
+
+    def save_aperture(self):
+
+        """ save binary aperture of bar positions for all TRs of run (for pRF fitting),
+        as memory-mapped .npy next to events file """
+
+        if self.settings['aperture']['export']:
+
+            export_aperture(self.bar_midpoint_all, self.bar_pass_direction_all, self.bar_width_pix, 
+                            op.join(self.output_dir, self.output_str+'_aperture.npy'), 
+                            screen = self.screen,
+                            downsample = self.settings['aperture']['downsample'],
+                            rle = self.settings['aperture']['rle'])
+
+
+class PRFSession(ExpSession):
+   
+    def __init__(self, output_str, output_dir, settings_file, eyetracker_on):  # initialize child class
+
+        """ Initializes PRFSession object. 
+      
+        Parameters
+        ----------
+        output_str : str
+            Basename for all output-files (like logs), e.g., "sub-01_task-PRFstandard_run-1"
+        output_dir : str
+            Path to desired output-directory (default: None, which results in $pwd/logs)
+        settings_file : str
+            Path to yaml-file with settings (default: None, which results in the package's
+            default settings file (in data/default_settings.yml)
+        """
+
+        # need to initialize parent class (ExpSession), indicating output infos
+        super().__init__(output_str = output_str, output_dir = output_dir, settings_file = settings_file, 
+                        eyetracker_on = eyetracker_on)
+
+        
+
+    def create_stimuli(self):
+
+        """ Create Stimuli - pRF bar """
+        
+        #generate PRF stimulus
+        self.prf_stim = PRFStim(session = self, 
+                                bar_width_ratio = self.settings['stimuli']['prf']['bar_width_ratio'], 
+                                grid_pos = self.grid_pos
+                                )
+
+
+    def create_trials(self):
+
+        """ Creates trials (before running the session) """
+
+        #
+        # counter for responses
+        self.total_responses = 0
+        self.correct_responses = 0
+        self.bar_counter = 0
+
+        # plan trial design (bar positions, condition order, timings)
+        design = self.get_design('pRF')
+
+        for key, val in design.items():
+            setattr(self, key, val)
+
+        # onsets of trials, phases, bar windows and orientation switches (trials last one TR)
+        self.timeline = Timeline.from_design(design, trial_duration = self.settings['mri']['TR'])
 
         # append all trials
         self.all_trials = []
@@ -326,25 +759,17 @@ class PRFSession(ExpSession):
                                             bar_midpoint_at_TR = self.bar_midpoint_all[i]
                                             ))
 
-        # define time points for element orientation to change
-        # switch orientation time points
-        if self.settings['stimuli']['ori_shift_rate'] == 'TR':
-            ori_shift_rate = 1/self.bar_step 
-        else:
-            ori_shift_rate = self.settings['stimuli']['ori_shift_rate']
-        self.ori_switch_times = np.arange(0,self.total_time,1/ori_shift_rate)
         # counter for orientation switches
         self.ori_counter = 0
         # index for orientation
         self.ori_ind = 0 
 
-        # for counting bars and checking responses in real time
-        self.bar_timing = [i*self.settings['mri']['TR'] for i,x in enumerate(self.bar_pass_direction_all) if x!='empty']
+        # save bar aperture for run
+        self.save_aperture()
 
 
         # print window size just to check, not actually needed
-        print(self.screen)
-        print(tools.monitorunittools.pix2deg(self.screen[0], self.monitor))
+        logger.info('window size %s pix, %.2f deg wide', self.screen, tools.monitorunittools.pix2deg(self.screen[0], self.monitor))
 
     
     def run(self):
@@ -356,7 +781,9 @@ class PRFSession(ExpSession):
         
 
         # create trials before running!
-        self.create_stimuli()
+        if not self.stimuli_created:
+            self.create_stimuli()
+            self.stimuli_created = True
         self.create_trials() 
 
         # if eyetracking then calibrate
@@ -408,7 +835,10 @@ class PRFSession(ExpSession):
                                     'Right index finger - GREEN color category\n\n\n'
                                     '[waiting for scanner]')
         
-        draw_instructions(self.win, this_instruction_string, keys = [self.settings['mri'].get('sync', 't')], visual_obj = [self.rect_left,self.rect_right], height = 40)
+        # set up trial loop before trigger
+        self.prepare_run()
+
+        self.wait_for_scanner(this_instruction_string, height = 40)
 
 
         # start recording gaze
@@ -418,17 +848,16 @@ class PRFSession(ExpSession):
         self.start_experiment()
         
         # cycle through trials
-        for trl in self.all_trials: 
-            trl.run() # run forrest run
+        self.run_trials()
 
 
-        print('Expected number of responses: %d'%(self.expected_responses))
-        print('Total subject responses: %d'%self.total_responses)
-        print('Correct responses: %d'%self.correct_responses)
-        print('Accuracy %.2f %%'%(self.correct_responses/self.expected_responses*100))
+        logger.info('Expected number of responses: %d', self.expected_responses)
+        logger.info('Total subject responses: %d', self.total_responses)
+        logger.info('Correct responses: %d', self.correct_responses)
+        logger.info('Accuracy (online preview, see scoring.py) %.2f %%', self.correct_responses/self.expected_responses*100)
           
 
-        self.close() # close session
+        self.end_run()
         
 
 
@@ -458,6 +887,18 @@ class FeatureSession(ExpSession):
 
         ## set task colors
         self.task_colors = self.settings['stimuli']['feature']['task_colors']
+
+
+    def reset_run(self, output_str, att_color = None):
+
+        """ reset per-run state, to do another run in the same session 
+        (attended color can change between runs) """
+
+        if att_color is not None:
+            self.att_color = att_color
+
+        super().reset_run(output_str)
+
     
     def create_stimuli(self):
 
@@ -480,153 +921,51 @@ class FeatureSession(ExpSession):
         self.bar_counter = 0
         self.thisResp = []
 
-        ## set attended bar color 
-        self.att_condition = [val for val in self.settings['stimuli']['feature']['conditions'] if self.att_color in val][0]
-        self.unatt_condition = [val for val in self.settings['stimuli']['feature']['conditions'] if self.att_color not in val][0]
-
-        ## get all possible bar positions
-
-        # define bar width 
-        bar_width_ratio = self.settings['stimuli']['feature']['bar_width_ratio']
-        self.bar_width_pix = self.screen * bar_width_ratio
-
-        # define number of bars per direction
-        num_bars = np.array(self.settings['stimuli']['feature']['num_bar_position']) 
-
-        # all possible positions in pixels [x,y] for midpoint of
-        # vertical bar passes, 
-        ver_y = np.sort(np.concatenate((-np.arange(self.bar_width_pix[1]/2,self.screen[1]/2,self.bar_width_pix[1])[0:int(num_bars[1]/2)],
-                                        np.arange(self.bar_width_pix[1]/2,self.screen[1]/2,self.bar_width_pix[1])[0:int(num_bars[1]/2)])))
-
-        ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
-
-        # horizontal bar passes 
-        hor_x = np.sort(np.concatenate((-np.arange(self.bar_width_pix[0]/2,self.screen[0]/2,self.bar_width_pix[0])[0:int(num_bars[0]/2)],
-                                        np.arange(self.bar_width_pix[0]/2,self.screen[0]/2,self.bar_width_pix[0])[0:int(num_bars[0]/2)])))
+        # plan trial design (bar positions, eccentricities, task colors, timings)
+        design = self.get_design('FA', att_color = self.att_color, run_index = get_run_number(self.output_str))
 
-        hor_bar_pos_pix = np.array([np.array([x,0]) for _,x in enumerate(hor_x)])
+        for key, val in design.items():
+            setattr(self, key, val)
 
-
-        # set bar midpoint position and direction for each condition
-        self.all_bar_pos = set_bar_positions(pos_dict = {'horizontal': hor_bar_pos_pix, 'vertical': ver_bar_pos_pix},
-                                                attend_condition = self.att_condition, 
-                                                unattend_condition = self.unatt_condition,
-                                                attend_orientation = ['vertical','horizontal'],
-                                                unattend_orientation = ['vertical','horizontal'])
+        # onsets of trials, phases, bar windows and orientation switches (trials last one TR)
+        self.timeline = Timeline.from_design(design, trial_duration = self.settings['mri']['TR'])
 
         # save bar positions for run in output folder
         save_bar_position(self.all_bar_pos, 
                           op.join(self.output_dir, self.output_str+'_bar_positions.pkl'))
 
-        # list with order of "type of stimuli" throughout experiment (called bar direction to make analogous with other class)
-        bar_pass_direction = self.settings['stimuli']['feature']['bar_pass_direction'] 
-
-        # number of TRs per "type of stimuli"
-        empty_TR = self.settings['stimuli']['feature']['empty_TR']
-        task_trial_TR = self.settings['stimuli']['feature']['task_trial_TR'] 
-
-        # set number of trials,
-        # list of type of trial (empty, task) for all TRs,
-        # list of strings/lists with bar direction/orientation or 'empty',
-        # list of midpoint position (x,y) of bars for all TRs (if empty, then nan)
-        self.trial_number, self.trial_type_all, self.bar_pass_direction_all, self.bar_midpoint_all = define_feature_trials(bar_pass_direction, 
-                                                                                                                            self.all_bar_pos, 
-                                                                                                                            empty_TR = empty_TR, 
-                                                                                                                            task_trial_TR = task_trial_TR)
-                
-        print("Total number of (expected) TRs: %d"%self.trial_number)
-
-        ## get eccentricity indice for all trials
-        # of attended and UNattended bar
-        self.ecc_ind_all = {}
-        self.ecc_ind_all[self.att_condition] = get_bar_eccentricity(self.all_bar_pos, 
-                                                        hor_bar_pos_pix = hor_bar_pos_pix, 
-                                                        ver_bar_pos_pix = ver_bar_pos_pix, 
-                                                        bar_key = 'attended_bar')
-        self.ecc_ind_all[self.unatt_condition] = get_bar_eccentricity(self.all_bar_pos, 
-                                                        hor_bar_pos_pix = hor_bar_pos_pix, 
-                                                        ver_bar_pos_pix = ver_bar_pos_pix, 
-                                                        bar_key = 'unattended_bar')
-
-        ## randomly assign which color the bar will have, 
-        # for target bar (attended color)
-        self.ctask_ind_all = {}
-        self.ctask_ind_all[self.att_condition] = np.random.randint(2, size = len(self.all_bar_pos['attended_bar']['bar_pass_direction_at_TR']))
-        # for distractor bar (unattended color)
-        self.ctask_ind_all[self.unatt_condition] = np.random.randint(2, size = len(self.all_bar_pos['unattended_bar']['bar_pass_direction_at_TR']))
-
-        # set plotting order index, to randomize which bars appear on top, for all trials in all miniblocks
-        self.drawing_ind = []
-
-        for _, val in enumerate(self.trial_type_all):
-            
-            if 'task' in val:
-                ind_list = np.arange(self.settings['stimuli']['feature']['num_bars'])
-                np.random.shuffle(ind_list)
-                
-                self.drawing_ind.append(ind_list)
-
-            else: # if not in miniblock, these are nan
-                self.drawing_ind.append([np.nan])
-
         # save relevant trial info in df (for later analysis)
         save_all_TR_info(bar_dict = self.all_bar_pos, trial_type = self.trial_type_all, 
                         task_colors = self.task_colors, task_color_ind = self.ctask_ind_all,
                         crossing_ind = self.drawing_ind,
                         ecc_ind = self.ecc_ind_all,
                         output_path = op.join(self.output_dir, self.output_str+'_trial_info.csv'))
-                         
-        # if in scanner, we want it to be synced to trigger, so lets increase trial time (in seconds, like TR)
-        max_trial_time = 5 if self.settings['stimuli']['feature']['sync_scanner']==True else self.settings['mri']['TR']
 
         # append all trials
         self.all_trials = []
 
         for i in range(self.trial_number):
 
-            # set phase conditions (for logging) and durations
-            if 'task' in self.trial_type_all[i]:
-                phase_cond = tuple(['stim','background'])
-                phase_dur = tuple([self.settings['stimuli']['feature']['bars_phase_dur'],
-                                    max_trial_time-self.settings['stimuli']['feature']['bars_phase_dur']])
-                            
-            else:
-                phase_cond = tuple([self.trial_type_all[i]])
-                phase_dur = tuple([max_trial_time])
-
             self.all_trials.append(FeatureTrial(session = self,
                                                 trial_nr = i, 
-                                                phase_durations = phase_dur,
-                                                phase_names = phase_cond, 
+                                                phase_durations = self.phase_durations[i],
+                                                phase_names = self.phase_conditions[i], 
                                                 bar_pass_direction_at_TR = self.bar_pass_direction_all[i],
                                                 bar_midpoint_at_TR = self.bar_midpoint_all[i],
                                                 trial_type_at_TR = self.trial_type_all[i],
                                                 num_bars_on_screen = self.settings['stimuli']['feature']['num_bars'],
                                                 ))
 
-
-        # total experiment time (in seconds)
-        self.total_time = self.trial_number * max_trial_time 
-
-        # define time points for element orientation to change
-        # switch orientation time points
-        if self.settings['stimuli']['ori_shift_rate'] == 'TR':
-            ori_shift_rate = 1/self.bar_step 
-        else:
-            ori_shift_rate = self.settings['stimuli']['ori_shift_rate']
-        self.ori_switch_times = np.arange(0,self.total_time,1/ori_shift_rate)
         # counter for orientation switches
         self.ori_counter = 0
         # index for orientation
         self.ori_ind = 0
 
-        # make boolean array to see which trials are stim trials
-        self.bar_bool = [True if x == 'task' else False for _,x in enumerate(self.trial_type_all)]
-        # time in seconds for when bar trial on screen
-        self.bar_timing = [x * self.settings['mri']['TR'] for x in np.where(self.bar_bool)[0]]
+        # save bar aperture for run
+        self.save_aperture()
 
         # print window size just to check, not actually needed
-        print(self.screen)
+        logger.info('window size %s pix', self.screen)
 
 
     def run(self):
@@ -637,7 +976,9 @@ class FeatureSession(ExpSession):
                     updated_color_names = ['pink', 'orange', 'yellow', 'blue'])
 
         # create trials before running!
-        self.create_stimuli()
+        if not self.stimuli_created:
+            self.create_stimuli()
+            self.stimuli_created = True
         self.create_trials()
 
         # if eyetracking then calibrate
@@ -696,7 +1037,10 @@ class FeatureSession(ExpSession):
                                     'Right index finger - yellow\n\n\n'
                                     '[waiting for scanner]')
         
-        draw_instructions(self.win, this_instruction_string, keys = [self.settings['mri'].get('sync', 't')], visual_obj = [self.rect_left,self.rect_right], height = 40)
+        # set up trial loop before trigger
+        self.prepare_run()
+
+        self.wait_for_scanner(this_instruction_string, height = 40)
 
         # start recording gaze
         if self.eyetracker_on:
@@ -705,17 +1049,16 @@ class FeatureSession(ExpSession):
         self.start_experiment()
         
         # cycle through trials
-        for trl in self.all_trials: 
-            trl.run() # run forrest run
+        self.run_trials()
 
 
-        print('Expected number of responses: %d'%(sum(self.bar_bool)))
-        print('Total subject responses: %d'%self.total_responses)
-        print('Correct responses: %d'%self.correct_responses)
-        print('Overall accuracy %.2f %%'%(self.correct_responses/sum(self.bar_bool)*100))
+        logger.info('Expected number of responses: %d', sum(self.bar_bool))
+        logger.info('Total subject responses: %d', self.total_responses)
+        logger.info('Correct responses: %d', self.correct_responses)
+        logger.info('Overall accuracy (online preview, see scoring.py) %.2f %%', self.correct_responses/sum(self.bar_bool)*100)
           
 
-        self.close() # close session
+        self.end_run()
 
 
 
@@ -765,158 +1108,40 @@ class FlickerSession(ExpSession):
 
         self.updated_settings = self.settings['stimuli']['conditions']
 
-        ## get all possible bar positions
+        # plan trial design (square eccentricities, color order, timings)
+        design = self.get_design('flicker')
 
-        # define bar width 
-        bar_width_ratio = self.settings['stimuli']['flicker']['bar_width_ratio']
-        self.bar_width_pix = self.screen * bar_width_ratio
-
-        # define number of bars per direction
-        num_bars = np.array(self.screen)/self.bar_width_pix; num_bars = np.array(num_bars,dtype=int)
-
-        # all possible positions in pixels [x,y] for for midpoint of
-        # vertical bar passes
-        ver_y = np.linspace((-self.screen[1]/2 + self.bar_width_pix[1]/2),
-                            (self.screen[1]/2 - self.bar_width_pix[1]/2),
-                            num_bars[1])
-
-        ver_bar_pos_pix = np.array([np.array([0,y]) for _,y in enumerate(ver_y)])
-
-        # bar eccentricities we want to go through
-        self.bar_ecc_ind = self.settings['stimuli']['flicker']['bar_ecc_index']
-        # number of repetitions per ecc
-        self.num_rep_ecc = self.settings['stimuli']['flicker']['num_rep_ecc']
-
-        ## positions to put bars of square, per trial
-        # we swap so that 0 - furthest ecc; 3 - closest ecc (different from yml)
-        # to save coding hassle for now
-        bar_ecc_index_arr = np.tile(np.abs(np.array(self.bar_ecc_ind) - 3), self.num_rep_ecc)
-
-        ## make it a dict, for bookeeping
-        # set color comparisons first
-        self.ref_color = self.settings['stimuli']['flicker']['ref_color']
-
-        if self.ref_color in list(self.settings['stimuli']['conditions'].keys()): # if comparing red and green
-            updat_colors_keys = [c for c in list(self.settings['stimuli']['conditions'].keys()) if c not in ['background', self.ref_color] ]
-            
-        else:
-            updat_colors_keys = []
-            for key in list(self.settings['stimuli']['feature']['task_colors'].keys()):
-                for name in self.settings['stimuli']['feature']['task_colors'][key]:
-                    if name != self.ref_color:
-                        updat_colors_keys.append(name) # update all task colors that are not reference color
-
-        # color names to be updated
-        self.updat_colors_keys = np.array(updat_colors_keys)
-                        
-        # now make bar ecc index dictionary
-        bar_ecc_index_dict = {}
-        # and get eccentricity (in pixels) of bar position for trial (if empty, then nan) 
-        ecc_midpoint_dict = {}
-
-        for col in self.updat_colors_keys:
-            
-            bar_ecc_index_dict[col] = bar_ecc_index_arr.copy()
-            # shuffle it to make it random
-            np.random.shuffle(bar_ecc_index_dict[col]) 
-
-            ecc_midpoint_dict[col] = ver_bar_pos_pix[bar_ecc_index_dict[col]][...,1]
-
-        # save here so accessible throughout
-        self.bar_ecc_index_dict = bar_ecc_index_dict
-        self.ecc_midpoint_dict = ecc_midpoint_dict
-
-        ## save eccentricities in array, to use in file naming
-        all_ecc_array = (np.hstack([self.bar_ecc_index_dict[x] for x in self.bar_ecc_index_dict.keys()]))
-        self.all_ecc_array = all_ecc_array*-1 +3
-
-        # save total number of trials (one eccentricity per trial) 
-        self.trial_number = len(bar_ecc_index_arr)*len(updat_colors_keys)
-        print("Total number of trials: %d"%self.trial_number)
-
-        # max trial time
-        max_trial_time = self.settings['stimuli']['flicker']['max_trial_time']*60
-
-        # define how many times square colors switch, according to flick rate defined 
-        flick_rate = self.settings['stimuli']['flicker']['flick_rate']
-
-        # number of samples in trial
-        n_samples = max_trial_time * flick_rate
-
-        # get condition names for each trial
-        for i, cname in enumerate(updat_colors_keys):
-            
-            key_list = []
-
-            if self.ref_color in list(self.settings['stimuli']['conditions'].keys()): # if comparing red and green
-                
-                for key in self.settings['stimuli']['conditions']:
-                    if key != 'background': 
-                        key_list.append(key)
-                        
-            else: # other color variants
-                key_list = [self.ref_color, cname]
-                
-            # repeat keys, so for each trial it shows each condition X times
-            key_list = np.array(key_list*round(n_samples/len(key_list)))
-            key_list = list(key_list) + list(key_list)
-            phase_conditions = key_list
-            
-            for r in range(len(bar_ecc_index_arr)-1):            
-                phase_conditions = np.vstack((phase_conditions,key_list))
-            
-            if i == 0:  
-                all_phase_conditions = phase_conditions.copy()
-            else:
-                all_phase_conditions = np.vstack((all_phase_conditions,phase_conditions))
-            
-        # define list with number of phases and their duration (duration of each must be the same)
-        phase_durations = np.repeat(max_trial_time/all_phase_conditions.shape[-1], all_phase_conditions.shape[-1])
-
-        ## again make so that we can access phase throughout
-        self.phase_conditions = all_phase_conditions
-        self.phase_durations = phase_durations
+        for key, val in design.items():
+            setattr(self, key, val)
 
         # append all trials
         self.all_trials = []
-        c_counter = 0
         for i in range(self.trial_number):
-            if i in [int(len(bar_ecc_index_arr)*d) for d in np.arange(len(updat_colors_keys)) if d]:
-                c_counter += 1 # cheap trick to not worry about colors and trial numbers
 
             self.all_trials.append(FlickerTrial(session = self,
                                                 trial_nr = i, 
                                                 phase_durations = self.phase_durations,
                                                 phase_names = self.phase_conditions[i],
-                                                bar_ecc_index_at_trial = self.bar_ecc_index_dict[updat_colors_keys[c_counter]][int(i-len(bar_ecc_index_arr)*c_counter)],
-                                                ecc_midpoint_at_trial = self.ecc_midpoint_dict[updat_colors_keys[c_counter]][int(i-len(bar_ecc_index_arr)*c_counter)]
+                                                bar_ecc_index_at_trial = self.bar_ecc_index_all[i],
+                                                ecc_midpoint_at_trial = self.ecc_midpoint_all[i]
                                                 ))
 
-
-        # total experiment time (in seconds)
-        self.total_time = self.trial_number * max_trial_time
-
-        # define time points for element orientation to change
-        # switch orientation time points
-        if self.settings['stimuli']['ori_shift_rate'] == 'TR':
-            ori_shift_rate = 1/self.settings['mri']['TR'] # in seconds
-        else:
-            ori_shift_rate = self.settings['stimuli']['ori_shift_rate']
-        self.ori_switch_times = np.arange(0,self.total_time,1/ori_shift_rate)
         # counter for orientation switches
         self.ori_counter = 0
         # index for orientation
         self.ori_ind = 0
 
         # print window size just to check, not actually needed
-        print(self.screen)
+        logger.info('window size %s pix', self.screen)
 
 
     def run(self):
         """ Loops over trials and runs them """
 
         # create trials before running!
-        self.create_stimuli()
+        if not self.stimuli_created:
+            self.create_stimuli()
+            self.stimuli_created = True
         self.create_trials() 
 
         # if eyetracking then calibrate
@@ -970,6 +1195,8 @@ class FlickerSession(ExpSession):
                                     'Ready when you are!\n\n\n'
                                     '[Press left index finger\nto start]\n\n')
         
+        # set up trial loop before start
+        self.prepare_run()
 
         draw_instructions(self.win, this_instruction_string, keys = self.settings['keys']['left_index'], visual_obj = [self.rect_left,self.rect_right])
 
@@ -980,15 +1207,14 @@ class FlickerSession(ExpSession):
         self.start_experiment()
         
         # cycle through trials
-        for trl in self.all_trials: 
-            trl.run() # run forrest run
+        self.run_trials()
 
         ## make plots (need to improve this)
         #all_ecc_colors = get_average_color(self.output_dir, self.settings, updated_color_names = ['orange','yellow','blue'],
         #                          average_ecc = False)
         #make_lum_plots(all_ecc_colors, out_dir = self.output_dir)
           
-        self.close() # close session
+        self.end_run()
 
 
 
@@ -0,0 +1,529 @@
+
+import os
+import os.path as op
+import time
+import argparse
+import itertools
+import yaml
+import numpy as np
+import pandas as pd
+
+from concurrent.futures import ProcessPoolExecutor
+
+from utils import *
+from timeline import Timeline
+from staircase import StaircaseBank, simulate_staircases
+
+
+class SimulatedObserver(object):
+
+    def __init__(self, accuracy = .9, rt_mean = .6, rt_sd = .15, rt_min = .15,
+                 rt_distribution = 'lognormal', lapse_rate = .05, seed = None):
+
+        """ Initializes a SimulatedObserver object,
+        that responds to the planned stimulus stream of a run
+
+        Parameters
+        ----------
+        accuracy : float
+            probability of pressing the correct key (given that observer responds)
+        rt_mean : float
+            mean reaction time (in seconds)
+        rt_sd : float
+            standard deviation of reaction time (in seconds)
+        rt_min : float
+            minimum reaction time (in seconds), faster responses are clipped
+        rt_distribution : str
+            reaction time distribution ('lognormal', 'gauss' or 'exgauss')
+        lapse_rate : float
+            probability of not responding to a bar trial
+        seed : int/None
+            seed for observer random number generator
+        """
+
+        self.accuracy = accuracy
+        self.rt_mean = rt_mean
+        self.rt_sd = rt_sd
+        self.rt_min = rt_min
+        self.rt_distribution = rt_distribution
+        self.lapse_rate = lapse_rate
+
+        self.rng = np.random.default_rng(seed)
+
+
+    def draw_rts(self, n):
+
+        """ draw n reaction times from observer distribution """
+
+        if self.rt_distribution == 'lognormal':
+            # parameters of underlying normal, given mean and sd of reaction times
+            sigma2 = np.log(1 + (self.rt_sd/self.rt_mean)**2)
+            rts = self.rng.lognormal(np.log(self.rt_mean) - sigma2/2, np.sqrt(sigma2), n)
+
+        elif self.rt_distribution == 'gauss':
+            rts = self.rng.normal(self.rt_mean, self.rt_sd, n)
+
+        elif self.rt_distribution == 'exgauss':
+            # half of the variance in the exponential tail
+            tau = self.rt_sd/np.sqrt(2)
+            rts = self.rng.normal(self.rt_mean - tau, tau, n) + self.rng.exponential(tau, n)
+
+        else:
+            raise ValueError('Unknown reaction time distribution %s'%self.rt_distribution)
+
+        return np.clip(rts, self.rt_min, None)
+
+
+    def respond(self, bar_timing, correct_keys, wrong_keys):
+
+        """ simulate responses to all bar trials of a run
+
+        Parameters
+        ----------
+        bar_timing : list/arr
+            time in seconds for when bar trials were on screen
+        correct_keys : list/arr
+            key that is correct for each bar trial
+        wrong_keys : list/arr
+            key that is wrong for each bar trial
+
+        Returns
+        -------
+        resp_keys : arr
+            keys pressed (sorted by time)
+        resp_times : arr
+            time of key presses (relative to session clock)
+        """
+
+        bar_timing = np.asarray(bar_timing, dtype = float)
+        n_bars = len(bar_timing)
+
+        # which bars get a response, and which of those are correct
+        responded = self.rng.random(n_bars) >= self.lapse_rate
+        correct = self.rng.random(n_bars) < self.accuracy
+
+        resp_keys = np.where(correct, np.asarray(correct_keys), np.asarray(wrong_keys))[responded]
+        resp_times = (bar_timing + self.draw_rts(n_bars))[responded]
+
+        order = np.argsort(resp_times, kind = 'stable')
+
+        return resp_keys[order], resp_times[order]
+
+
+def prf_stimulus_stream(phase_conditions, bar_bool, TR = 1.6, keys = {}):
+
+    """ get planned stimulus stream of pRF run
+    (bar onsets and correct key for the color category of each bar)
+
+    Parameters
+    ----------
+    phase_conditions : arr
+        array with condition names for all phases of all trials (#TRs, #phases)
+    bar_bool : list/arr
+        boolean list indicating which trials are bar trials
+    TR : float
+        repetition time (in seconds)
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+    """
+
+    bar_ind = np.where(bar_bool)[0]
+
+    # color category of bar, for each bar trial
+    green_bar = np.array([any(c in ['color_green', 'yellow', 'blue'] for c in phase_conditions[i]) for i in bar_ind])
+
+    return {'task': 'pRF',
+            'bar_timing': bar_ind * TR,
+            'trial_ind': bar_ind,
+            'phase_conditions': phase_conditions,
+            'correct_keys': np.where(green_bar, keys['right_index'][0], keys['left_index'][0]),
+            'wrong_keys': np.where(green_bar, keys['left_index'][0], keys['right_index'][0])}
+
+
+def feature_stimulus_stream(task_colors, bar_bool, TR = 1.6, keys = {}):
+
+    """ get planned stimulus stream of feature run
+    (bar onsets and correct key for the hue of each attended bar)
+
+    Parameters
+    ----------
+    task_colors : list/arr
+        task color name of attended bar, for each bar trial
+    bar_bool : list/arr
+        boolean list indicating which trials are bar trials
+    TR : float
+        repetition time (in seconds)
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+    """
+
+    bar_ind = np.where(bar_bool)[0]
+    left_bar = np.isin(np.asarray(task_colors), ['blue', 'pink'])
+
+    return {'task': 'FA',
+            'bar_timing': bar_ind * TR,
+            'trial_ind': bar_ind,
+            'task_colors': np.asarray(task_colors),
+            'correct_keys': np.where(left_bar, keys['left_index'][0], keys['right_index'][0]),
+            'wrong_keys': np.where(left_bar, keys['right_index'][0], keys['left_index'][0])}
+
+
+def stimulus_stream_from_session(session):
+
+    """ get planned stimulus stream from session object
+    (PRFSession or FeatureSession, after create_trials)
+    """
+
+    TR = session.settings['mri']['TR']
+
+    if hasattr(session, 'att_condition'): # feature session
+        att_ind = session.ctask_ind_all[session.att_condition]
+        task_colors = np.array(session.task_colors[session.att_condition])[att_ind]
+
+        return feature_stimulus_stream(task_colors, session.bar_bool, TR = TR, keys = session.settings['keys'])
+    else:
+        return prf_stimulus_stream(session.phase_conditions, session.bar_bool, TR = TR, keys = session.settings['keys'])
+
+
+def simulate_run(stream, observer, keys = {}, TR = 1.6, log = True):
+
+    """ simulate one run, scoring simulated responses with the same
+    logic used online by the trials
+
+    Parameters
+    ----------
+    stream : dict
+        planned stimulus stream (from prf_stimulus_stream or feature_stimulus_stream)
+    observer : SimulatedObserver
+        simulated participant
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+    TR : float
+        repetition time (in seconds)
+    log : bool
+        if we want to build event log data frame (as trials do)
+
+    Returns
+    -------
+    out_dict : dict
+        dictionary with response counters, event log and timings
+    """
+
+    resp_keys, resp_times = observer.respond(stream['bar_timing'], stream['correct_keys'], stream['wrong_keys'])
+
+    # bar windows, as in session timeline (only bar trials needed)
+    timeline = Timeline(stream['bar_timing'], trial_nrs = stream['trial_ind'], bar_trials = stream['trial_ind'], bar_window = TR)
+    bar_counter = 0
+    correct_responses = 0
+
+    global_log = pd.DataFrame(columns = ['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames'])
+    log_time = 0
+
+    for ev, t in zip(resp_keys, resp_times):
+
+        # trials last one TR, so trial number follows from response time
+        trial_nr = int(t // TR)
+
+        # bar window response is in (if not answered yet)
+        bar_ind = timeline.response_bar(t, bar_counter)
+
+        correct = 0
+        if bar_ind >= 0:
+            if stream['task'] == 'pRF':
+                correct = check_prf_response(ev, stream['phase_conditions'][stream['trial_ind'][bar_ind]], keys = keys)
+            else:
+                correct = get_feature_response(ev, stream['task_colors'][bar_ind], keys = keys)
+
+            bar_counter = bar_ind + 1
+
+        correct_responses += correct
+
+        if log:
+            start_log = time.perf_counter()
+            log_event(global_log, trial_nr, t, 'response', 0, ev)
+            log_time += time.perf_counter() - start_log
+
+    return {'expected_responses': len(stream['bar_timing']),
+            'total_responses': len(resp_keys),
+            'correct_responses': correct_responses,
+            'accuracy': correct_responses/len(stream['bar_timing']),
+            'log_time': log_time,
+            'global_log': global_log}
+
+
+def _simulate_run_job(args):
+
+    """ helper function to run one simulated run in worker process """
+
+    stream, observer_kwargs, seed, keys, TR, log = args
+
+    out_dict = simulate_run(stream, SimulatedObserver(seed = seed, **observer_kwargs),
+                            keys = keys, TR = TR, log = log)
+    out_dict['seed'] = seed
+
+    return out_dict
+
+
+def simulate_runs(stream, n_runs = 1000, observer_kwargs = {}, keys = {}, TR = 1.6,
+                  seed = None, n_jobs = None, log = False):
+
+    """ simulate many runs in parallel (process pool)
+
+    Parameters
+    ----------
+    stream : dict
+        planned stimulus stream (from prf_stimulus_stream or feature_stimulus_stream)
+    n_runs : int
+        number of simulated runs
+    observer_kwargs : dict
+        keyword arguments for SimulatedObserver (accuracy, rt_mean, lapse_rate, ...)
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+    TR : float
+        repetition time (in seconds)
+    seed : int/None
+        seed from which all run seeds are derived
+    n_jobs : int/None
+        number of worker processes (if None, uses all cpus)
+    log : bool
+        if we want to build event log data frame for each run (slower)
+
+    Returns
+    -------
+    df_summary : pandas DataFrame
+        response counters and logging time for each run
+    all_logs : list
+        event log data frames of all runs (empty if log = False)
+    """
+
+    run_seeds = np.random.SeedSequence(seed).generate_state(n_runs)
+    jobs = [(stream, observer_kwargs, int(s), keys, TR, log) for s in run_seeds]
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        outputs = list(executor.map(_simulate_run_job, jobs, chunksize = max(1, n_runs//64)))
+
+    all_logs = [out.pop('global_log') for out in outputs] if log else []
+    if not log:
+        for out in outputs:
+            out.pop('global_log')
+
+    df_summary = pd.DataFrame(outputs)
+    df_summary.index.name = 'run'
+
+    return df_summary, all_logs
+
+
+def simulate_staircase_setting(setting, n_sims = 1000, n_trials = 60, threshold_rgb = [10, 3], slope = 3.5,
+                               tolerance_rgb = 2, seed = None):
+
+    """ simulate feature task staircase for one parameter setting, with many observers
+    (observer thresholds in RGB units, staircase intensity scaled by max color level)
+
+    Parameters
+    ----------
+    setting : dict
+        staircase parameters - 'step_size', 'n_up', 'n_down', 'initial_value' and 'max_color_level'
+    n_sims : int
+        number of simulated observers
+    n_trials : int
+        number of trials per staircase
+    threshold_rgb : list
+        mean and standard deviation of observer thresholds (in RGB units, lognormal across observers)
+    slope : float
+        slope of observer psychometric functions
+    tolerance_rgb : float
+        staircase converged when presented intensity is within tolerance of threshold (in RGB units)
+    seed : int/None
+        seed for observers and responses
+
+    Returns
+    -------
+    out_dict : dict
+        setting with bias, sd and rmse of threshold estimate (mean of reversal intensities, in RGB units),
+        median number of trials to converge and fraction of staircases that converged
+    """
+
+    rng = np.random.default_rng(seed)
+
+    # lognormal thresholds, given mean and sd
+    sigma2 = np.log(1 + (threshold_rgb[1]/threshold_rgb[0])**2)
+    thresholds = rng.lognormal(np.log(threshold_rgb[0]) - sigma2/2, np.sqrt(sigma2), n_sims)
+
+    max_level = setting['max_color_level']
+
+    bank = StaircaseBank(np.full(n_sims, setting['initial_value']), stepSize = setting['step_size'],
+                         nUp = setting['n_up'], nDown = setting['n_down'])
+    intensities = simulate_staircases(bank, n_trials, threshold = thresholds/max_level, slope = slope, rng = rng)
+
+    # estimate is mean of reversal intensities (last intensity if no reversals)
+    estimate = np.where(bank.n_reversals() > 0, bank.mean('reversals'), bank.get_intensity()) * max_level
+    error = estimate - thresholds
+
+    # first trial within tolerance of threshold
+    within = np.abs(intensities * max_level - thresholds[np.newaxis]) <= tolerance_rgb
+    converged = within.any(axis = 0)
+    trials_to_converge = np.where(converged, within.argmax(axis = 0), n_trials)
+
+    return dict(setting, bias_rgb = error.mean(), sd_rgb = error.std(), rmse_rgb = np.sqrt((error**2).mean()),
+                median_trials = np.median(trials_to_converge), p_converged = converged.mean(),
+                p_above_max = (thresholds > max_level).mean())
+
+
+def simulate_flicker_setting(setting, n_sims = 1000, max_presses = 200, equiluminance = [.3, .9],
+                             noise_sd = .05, jnd = .03, press_time = .4, seed = None):
+
+    """ simulate flicker luminance calibration for one increment value, with many observers.
+    Luminance starts at 1 (as in FlickerTrial), observers press to decrease/increase it
+    towards where they perceive least flicker, and end trial when flicker looks minimal
+
+    Parameters
+    ----------
+    setting : dict
+        flicker parameters - 'increment'
+    n_sims : int
+        number of simulated observers
+    max_presses : int
+        maximum number of presses per trial
+    equiluminance : list
+        range of observer equiluminance points (uniform across observers)
+    noise_sd : float
+        standard deviation of observer luminance judgement
+    jnd : float
+        observers end trial when perceived luminance difference is below this value
+    press_time : float
+        time per press (in seconds)
+    seed : int/None
+        seed for observers and responses
+
+    Returns
+    -------
+    out_dict : dict
+        setting with bias, sd and rmse of final luminance, median number of presses and time per trial,
+        and fraction of trials ended by observer
+    """
+
+    rng = np.random.default_rng(seed)
+
+    true_lum = rng.uniform(equiluminance[0], equiluminance[1], n_sims)
+    lum = np.ones(n_sims)
+    presses = np.zeros(n_sims, dtype = int)
+    done = np.zeros(n_sims, dtype = bool)
+
+    for _ in range(max_presses):
+
+        perceived = lum - true_lum + rng.normal(0, noise_sd, n_sims)
+        done |= np.abs(perceived) < jnd
+
+        if done.all():
+            break
+
+        # still adjusting, one press in direction of perceived equiluminance (clipped as in trial)
+        active = ~done
+        lum[active] = np.clip(lum[active] - setting['increment'] * np.sign(perceived[active]), 0, 1)
+        presses[active] += 1
+
+    error = lum - true_lum
+
+    return dict(setting, bias = error.mean(), sd = error.std(), rmse = np.sqrt((error**2).mean()),
+                median_presses = np.median(presses), median_time = np.median(presses) * press_time,
+                p_finished = done.mean())
+
+
+def _tuning_job(args):
+
+    """ helper function to simulate one setting in worker process """
+
+    kind, setting, sim_kwargs, seed = args
+
+    if kind == 'staircase':
+        return simulate_staircase_setting(setting, seed = seed, **sim_kwargs)
+    else:
+        return simulate_flicker_setting(setting, seed = seed, **sim_kwargs)
+
+
+def tune_parameters(kind, param_grid, sim_kwargs = {}, seed = None, n_jobs = None):
+
+    """ simulate all combinations of parameter values in parallel (process pool)
+
+    Parameters
+    ----------
+    kind : str
+        procedure to simulate ('staircase' or 'flicker')
+    param_grid : dict
+        list of values for each parameter (see simulate_staircase_setting and simulate_flicker_setting)
+    sim_kwargs : dict
+        keyword arguments for simulation (n_sims, observer parameters, ...)
+    seed : int/None
+        seed from which seeds of all settings are derived
+    n_jobs : int/None
+        number of worker processes (if None, uses all cpus)
+
+    Returns
+    -------
+    df_results : pandas DataFrame
+        one row per setting, with convergence speed, bias and variance
+    """
+
+    names = list(param_grid.keys())
+    settings = [dict(zip(names, vals)) for vals in itertools.product(*[param_grid[name] for name in names])]
+
+    setting_seeds = np.random.SeedSequence(seed).generate_state(len(settings))
+    jobs = [(kind, setting, sim_kwargs, int(s)) for setting, s in zip(settings, setting_seeds)]
+
+    with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+        outputs = list(executor.map(_tuning_job, jobs))
+
+    return pd.DataFrame(outputs)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Tune staircase and flicker calibration parameters with simulated observers')
+    parser.add_argument('kind', choices = ['staircase', 'flicker'])
+    parser.add_argument('--settings_file', type = str, default = 'experiment_settings.yml',
+                        help = 'settings file (values not given are taken from it)')
+    parser.add_argument('--step_size', type = float, nargs = '+', default = None)
+    parser.add_argument('--n_up', type = int, nargs = '+', default = None)
+    parser.add_argument('--n_down', type = int, nargs = '+', default = None)
+    parser.add_argument('--initial_value', type = float, nargs = '+', default = None)
+    parser.add_argument('--max_color_level', type = int, nargs = '+', default = None)
+    parser.add_argument('--increment', type = float, nargs = '+', default = None)
+    parser.add_argument('--n_sims', type = int, default = 1000, help = 'simulated observers per setting')
+    parser.add_argument('--n_trials', type = int, default = 60, help = 'trials per staircase')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--n_jobs', type = int, default = None, help = 'number of processes (default all cpus)')
+    parser.add_argument('--output', type = str, default = None, help = 'results table (default output/sourcedata/tuning_<kind>.csv)')
+    args = parser.parse_args()
+
+    with open(args.settings_file, 'r', encoding = 'utf8') as f_in:
+        settings = yaml.safe_load(f_in)
+
+    if args.kind == 'staircase':
+        feature_settings = settings['stimuli']['feature']
+        param_grid = {'step_size': args.step_size or [feature_settings['staircase']['step_size']],
+                      'n_up': args.n_up or [feature_settings['staircase']['n_up']],
+                      'n_down': args.n_down or [feature_settings['staircase']['n_down']],
+                      'initial_value': args.initial_value or [float(np.mean(list(feature_settings['initial_values'].values())))],
+                      'max_color_level': args.max_color_level or [feature_settings['max_color_level']]}
+        sim_kwargs = {'n_sims': args.n_sims, 'n_trials': args.n_trials}
+    else:
+        param_grid = {'increment': args.increment or [settings['stimuli']['flicker']['increment']]}
+        sim_kwargs = {'n_sims': args.n_sims}
+
+    start_time = time.time()
+
+    df_results = tune_parameters(args.kind, param_grid, sim_kwargs = sim_kwargs, seed = args.seed, n_jobs = args.n_jobs)
+
+    print(df_results.round(3).to_string(index = False))
+    print('%i settings in %.2f s'%(df_results.shape[0], time.time() - start_time))
+
+    # DEFAULTS TO ROOT FOLDER (as main.py)
+    output = op.join(op.split(os.getcwd())[0], 'output', 'sourcedata', 'tuning_%s.csv'%args.kind) if args.output is None else args.output
+    os.makedirs(op.dirname(op.abspath(output)), exist_ok = True)
+
+    df_results.round(4).to_csv(output, index = False)
+    print('results saved in %s'%output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,478 @@
+
+import numpy as np
+
+
+def weibull(intensity, threshold = .3, slope = 3.5, guess = .5, lapse = .01):
+
+    """ probability of correct response for given intensity (Weibull psychometric function)
+
+    Parameters
+    ----------
+    intensity : float/arr
+        stimulus intensity
+    threshold : float/arr
+        intensity at which observer is ~80% correct (for 2AFC)
+    slope : float/arr
+        steepness of psychometric function
+    guess : float
+        probability of correct response when guessing (.5 for 2AFC)
+    lapse : float
+        probability of lapsing (wrong response regardless of intensity)
+    """
+
+    intensity = np.maximum(intensity, 0)
+
+    return guess + (1 - guess - lapse) * (1 - np.exp(-(intensity/threshold)**slope))
+
+
+class StaircaseBank(object):
+
+    def __init__(self, start_vals, stepSize = .1, nUp = 1, nDown = 3, minVal = 0, maxVal = 1):
+
+        """ Initializes StaircaseBank object, that holds many up/down staircases
+        (ex: colors x eccentricities x interleaved) in arrays, following the same rules as utils.StaircaseCostum.
+        All staircases given a response are updated in one call, and mean/sd of intensities
+        and of reversal intensities are kept as running statistics
+
+        Parameters
+        ----------
+        start_vals : arr
+            start intensity of each staircase (shape of array is shape of bank)
+        stepSize : float/arr
+            step size (can differ per staircase, broadcast to shape of bank)
+        nUp : int/arr
+            incorrect responses before intensity goes up
+        nDown : int/arr
+            correct responses before intensity goes down
+        minVal : float
+            minimum intensity
+        maxVal : float
+            maximum intensity
+        """
+
+        start_vals = np.asarray(start_vals, dtype = float)
+
+        self.shape = start_vals.shape
+        self.size = start_vals.size
+
+        # parameters, one per staircase
+        self.step_size = np.broadcast_to(stepSize, self.shape).astype(float).ravel()
+        self.n_up = np.broadcast_to(nUp, self.shape).astype(int).ravel()
+        self.n_down = np.broadcast_to(nDown, self.shape).astype(int).ravel()
+        self.min_val = minVal
+        self.max_val = maxVal
+
+        # state, flat arrays
+        self.intensity = start_vals.ravel().copy()
+        self.correct_counter = np.zeros(self.size, dtype = int)
+        self.incorrect_counter = np.zeros(self.size, dtype = int)
+        self.n_responses = np.zeros(self.size, dtype = int)
+
+        # running statistics (count, mean, sum of squared differences) of intensities (including start value)
+        self.stats = {'intensities': [np.ones(self.size), self.intensity.copy(), np.zeros(self.size)],
+                      'reversals': [np.zeros(self.size), np.zeros(self.size), np.zeros(self.size)]}
+
+        # names of bank dimensions (set with from_settings)
+        self.conditions = None
+
+
+    @classmethod
+    def from_settings(cls, settings, n_interleaved = None):
+
+        """ make bank of feature task staircases from settings,
+        one per color condition, eccentricity and interleaved staircase (shape colors x ecc x interleaved)
+
+        Parameters
+        ----------
+        settings : dict
+            experiment settings dict
+        n_interleaved : int/None
+            number of interleaved staircases per color and eccentricity (if None, as in settings)
+        """
+
+        feature_settings = settings['stimuli']['feature']
+        stair_settings = feature_settings['staircase']
+
+        n_interleaved = stair_settings['n_interleaved'] if n_interleaved is None else n_interleaved
+
+        conditions = list(feature_settings['initial_values'].keys())
+        start_vals = np.array([feature_settings['initial_values'][cond] for cond in conditions], dtype = float)
+
+        bank = cls(np.repeat(start_vals[..., np.newaxis], n_interleaved, axis = -1),
+                   stepSize = stair_settings['step_size'], nUp = stair_settings['n_up'], nDown = stair_settings['n_down'],
+                   minVal = 0, maxVal = 1)
+        bank.conditions = conditions
+
+        return bank
+
+
+    def index(self, *ind):
+
+        """ flat index of staircase(s), given index along each dimension of bank
+        (ex: bank.index(condition_ind, ecc_ind, interleave_ind)) """
+
+        return np.ravel_multi_index(ind, self.shape)
+
+
+    def get_intensity(self, ind = None):
+
+        """ current intensity of staircases (flat index or indices, if None all, in shape of bank) """
+
+        return self.intensity.reshape(self.shape) if ind is None else self.intensity[ind]
+
+
+    def add_responses(self, results, ind = None):
+
+        """ update staircases with one response each
+
+        Parameters
+        ----------
+        results : int/arr
+            1 if correct, 0 if incorrect (nan for no response, staircase not updated)
+        ind : int/arr/None
+            flat indices of staircases responded to (if None, all staircases, results in shape of bank).
+            Each staircase can only be given once per call
+        """
+
+        ind = np.arange(self.size) if ind is None else np.atleast_1d(ind).ravel()
+        results = np.broadcast_to(np.asarray(results, dtype = float).ravel() if np.ndim(results) else results, ind.shape)
+
+        responded = ~np.isnan(results)
+        ind, correct = ind[responded], results[responded] == 1
+
+        ## counters
+        self.correct_counter[ind[correct]] += 1
+        self.incorrect_counter[ind[~correct]] += 1
+
+        decrease = correct & (self.correct_counter[ind] >= self.n_down[ind])
+        increase = ~correct & (self.incorrect_counter[ind] >= self.n_up[ind])
+
+        # correct counter reset after any step, incorrect counter only after going up
+        self.correct_counter[ind[decrease | increase]] = 0
+        self.incorrect_counter[ind[increase]] = 0
+
+        ## intensity before step is reversal intensity
+        step = decrease | increase
+        self.update_stats('reversals', ind[step], self.intensity[ind[step]])
+
+        intensity = self.intensity[ind]
+        intensity = np.where(increase, np.minimum(intensity + self.step_size[ind], self.max_val), intensity)
+        intensity = np.where(decrease, np.maximum(intensity - self.step_size[ind], self.min_val), intensity)
+
+        self.intensity[ind] = intensity
+        self.update_stats('intensities', ind, intensity)
+
+        self.n_responses[ind] += 1
+
+
+    def update_stats(self, name, ind, values):
+
+        """ add values to running statistics (Welford update) """
+
+        count, mean, m2 = self.stats[name]
+
+        count[ind] += 1
+        delta = values - mean[ind]
+        mean[ind] += delta/count[ind]
+        m2[ind] += delta * (values - mean[ind])
+
+
+    def mean(self, name = 'intensities'):
+
+        """ mean of intensities (or of reversal intensities), in shape of bank """
+
+        count, mean, m2 = self.stats[name]
+
+        return np.where(count > 0, mean, np.nan).reshape(self.shape)
+
+
+    def sd(self, name = 'intensities'):
+
+        """ standard deviation of intensities (or of reversal intensities), in shape of bank """
+
+        count, mean, m2 = self.stats[name]
+
+        return np.sqrt(m2/np.maximum(count, 1)).reshape(self.shape)
+
+
+    def n_reversals(self):
+
+        return self.stats['reversals'][0].astype(int).reshape(self.shape)
+
+
+    def get_state(self):
+
+        """ state of bank (to save in checkpoint) """
+
+        return {'intensity': self.intensity.copy(), 'correct_counter': self.correct_counter.copy(),
+                'incorrect_counter': self.incorrect_counter.copy(), 'n_responses': self.n_responses.copy(),
+                'stats': {name: [arr.copy() for arr in stats] for name, stats in self.stats.items()}}
+
+
+    def set_state(self, state):
+
+        for name in ['intensity', 'correct_counter', 'incorrect_counter', 'n_responses']:
+            setattr(self, name, state[name].copy())
+
+        self.stats = {name: [arr.copy() for arr in stats] for name, stats in state['stats'].items()}
+
+
+def simulate_staircases(bank, n_trials, threshold = .3, slope = 3.5, guess = .5, lapse = .01, rng = None):
+
+    """ run all staircases of bank against simulated observers, one response per staircase per trial
+    (observer parameters can differ per staircase, broadcast to shape of bank)
+
+    Parameters
+    ----------
+    bank : StaircaseBank/QuestBank
+        staircases to simulate (updated in place)
+    n_trials : int
+        number of trials per staircase
+    threshold, slope, guess, lapse : float/arr
+        psychometric function parameters of observers (see weibull)
+    rng : numpy Generator/None
+        random generator for responses (if None, uses a new unseeded one)
+
+    Returns
+    -------
+    intensities : arr
+        intensity presented at each trial (n_trials, bank size)
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    threshold = np.broadcast_to(threshold, bank.shape).ravel()
+    slope = np.broadcast_to(slope, bank.shape).ravel()
+
+    intensities = np.zeros((n_trials, bank.size))
+
+    for trl in range(n_trials):
+
+        intensities[trl] = bank.get_intensity(np.arange(bank.size))
+        p_correct = weibull(intensities[trl], threshold = threshold, slope = slope, guess = guess, lapse = lapse)
+
+        bank.add_responses((rng.random(bank.size) < p_correct).astype(float))
+
+    return intensities
+
+
+class QuestBank(object):
+
+    def __init__(self, start_vals, start_sd = .2, grid = None, slope = 3.5, guess = .5, lapse = .01,
+                 method = 'mean', minVal = 0, maxVal = 1):
+
+        """ Initializes QuestBank object, grid-based QUEST for many interleaved staircases.
+        The posterior over threshold of each staircase is kept in log space on a fixed intensity grid
+        (2D array, staircases x grid), and updated for all staircases at once.
+        Threshold is the Weibull threshold parameter (see weibull)
+
+        Parameters
+        ----------
+        start_vals : arr
+            prior guess of threshold of each staircase (shape of array is shape of bank)
+        start_sd : float/arr
+            standard deviation of gaussian prior
+        grid : arr/None
+            threshold grid (if None, 201 points between minVal and maxVal)
+        slope, guess, lapse : float
+            psychometric function parameters assumed (see weibull)
+        method : str
+            intensity presented next - posterior 'mean', 'mode' or 'median'
+        minVal : float
+            minimum intensity presented
+        maxVal : float
+            maximum intensity presented
+        """
+
+        start_vals = np.asarray(start_vals, dtype = float)
+
+        self.shape = start_vals.shape
+        self.size = start_vals.size
+
+        self.grid = np.linspace(minVal, maxVal, 201) if grid is None else np.asarray(grid, dtype = float)
+        self.slope = slope
+        self.guess = guess
+        self.lapse = lapse
+        self.method = method
+        self.min_val = minVal
+        self.max_val = maxVal
+
+        # gaussian prior, in log space
+        start_sd = np.broadcast_to(start_sd, self.shape).ravel()
+        self.log_posterior = -.5 * ((self.grid[np.newaxis] - start_vals.ravel()[:, np.newaxis])/start_sd[:, np.newaxis])**2
+        self.normalize()
+
+        self.n_responses = np.zeros(self.size, dtype = int)
+
+        # names of bank dimensions (set with from_settings)
+        self.conditions = None
+
+
+    @classmethod
+    def from_settings(cls, settings, n_interleaved = None):
+
+        """ make bank of feature task QUEST staircases from settings,
+        one per color condition, eccentricity and interleaved staircase (shape colors x ecc x interleaved)
+
+        Parameters
+        ----------
+        settings : dict
+            experiment settings dict
+        n_interleaved : int/None
+            number of interleaved staircases per color and eccentricity (if None, as in settings)
+        """
+
+        feature_settings = settings['stimuli']['feature']
+        quest_settings = feature_settings['quest']
+
+        n_interleaved = feature_settings['staircase']['n_interleaved'] if n_interleaved is None else n_interleaved
+
+        conditions = list(feature_settings['initial_values'].keys())
+        start_vals = np.array([feature_settings['initial_values'][cond] for cond in conditions], dtype = float)
+
+        bank = cls(np.repeat(start_vals[..., np.newaxis], n_interleaved, axis = -1),
+                   start_sd = quest_settings['start_sd'],
+                   grid = np.linspace(0, 1, quest_settings['n_grid']),
+                   slope = quest_settings['slope'], guess = quest_settings['guess'], lapse = quest_settings['lapse'],
+                   method = quest_settings['method'])
+        bank.conditions = conditions
+
+        return bank
+
+
+    def index(self, *ind):
+
+        """ flat index of staircase(s), given index along each dimension of bank """
+
+        return np.ravel_multi_index(ind, self.shape)
+
+
+    def normalize(self, ind = slice(None)):
+
+        """ keep log posterior max at 0 (avoids underflow) """
+
+        self.log_posterior[ind] -= self.log_posterior[ind].max(axis = -1, keepdims = True)
+
+
+    def posterior(self, ind = slice(None)):
+
+        """ normalized posterior of staircases (flat indices, if not given all), staircases x grid """
+
+        post = np.exp(self.log_posterior[ind])
+
+        return post/post.sum(axis = -1, keepdims = True)
+
+
+    def get_intensity(self, ind = None):
+
+        """ intensity to present next (flat index or indices, if None all, in shape of bank) """
+
+        post = self.posterior(slice(None) if ind is None else ind)
+
+        if self.method == 'mean':
+            intensity = post @ self.grid
+        elif self.method == 'mode':
+            intensity = self.grid[post.argmax(axis = -1)]
+        elif self.method == 'median':
+            intensity = self.grid[(np.cumsum(post, axis = -1) < .5).sum(axis = -1)]
+        else:
+            raise ValueError('Unknown QUEST method %s'%self.method)
+
+        intensity = np.clip(intensity, self.min_val, self.max_val)
+
+        return intensity.reshape(self.shape) if ind is None else intensity
+
+
+    def add_responses(self, results, intensities = None, ind = None):
+
+        """ update posterior of staircases with one response each
+
+        Parameters
+        ----------
+        results : int/arr
+            1 if correct, 0 if incorrect (nan for no response, staircase not updated)
+        intensities : float/arr/None
+            intensities presented (if None, current intensity of staircases)
+        ind : int/arr/None
+            flat indices of staircases responded to (if None, all staircases, results in shape of bank).
+            Each staircase can only be given once per call
+        """
+
+        ind = np.arange(self.size) if ind is None else np.atleast_1d(ind).ravel()
+        results = np.broadcast_to(np.asarray(results, dtype = float).ravel() if np.ndim(results) else results, ind.shape)
+        intensities = self.get_intensity(ind) if intensities is None else \
+                      np.broadcast_to(np.asarray(intensities, dtype = float).ravel() if np.ndim(intensities) else intensities, ind.shape)
+
+        responded = ~np.isnan(results)
+        ind, results, intensities = ind[responded], results[responded], intensities[responded]
+
+        # likelihood of response for each threshold in grid (staircases x grid)
+        p_correct = weibull(intensities[:, np.newaxis], threshold = np.maximum(self.grid[np.newaxis], 1e-6),
+                            slope = self.slope, guess = self.guess, lapse = self.lapse)
+
+        self.log_posterior[ind] += np.log(np.where(results[:, np.newaxis] == 1, p_correct, 1 - p_correct))
+        self.normalize(ind)
+
+        self.n_responses[ind] += 1
+
+
+    def mean(self):
+
+        """ posterior mean of threshold, in shape of bank """
+
+        return (self.posterior() @ self.grid).reshape(self.shape)
+
+
+    def sd(self):
+
+        """ posterior standard deviation of threshold, in shape of bank """
+
+        post = self.posterior()
+        mean = post @ self.grid
+
+        return np.sqrt(post @ self.grid**2 - mean**2).reshape(self.shape)
+
+
+    def snapshot(self):
+
+        """ copy of posterior and settings of bank, to carry it over to next run (see restore) """
+
+        return {'grid': self.grid.copy(), 'shape': self.shape, 'log_posterior': self.log_posterior.copy(),
+                'n_responses': self.n_responses.copy(), 'slope': self.slope, 'guess': self.guess, 'lapse': self.lapse,
+                'conditions': self.conditions}
+
+
+    def restore(self, snapshot):
+
+        """ set posterior from snapshot (ex: of previous run)
+
+        Parameters
+        ----------
+        snapshot : dict
+            snapshot of bank with same grid and shape
+        """
+
+        if tuple(snapshot['shape']) != self.shape or not np.array_equal(snapshot['grid'], self.grid):
+            raise ValueError('QUEST snapshot has shape %s and %i grid points, bank has shape %s and %i'%(tuple(snapshot['shape']),
+                                                                                                      len(snapshot['grid']),
+                                                                                                      self.shape, len(self.grid)))
+
+        self.log_posterior = snapshot['log_posterior'].copy()
+        self.n_responses = snapshot['n_responses'].copy()
+
+
+    def save(self, output_path):
+
+        """ save snapshot of bank (npz file) """
+
+        snapshot = self.snapshot()
+        np.savez(output_path, grid = snapshot['grid'], shape = np.array(snapshot['shape']),
+                 log_posterior = snapshot['log_posterior'], n_responses = snapshot['n_responses'])
+
+
+    def load(self, input_path):
+
+        """ restore bank from saved snapshot (npz file) """
+
+        with np.load(input_path) as snapshot:
+            self.restore({name: snapshot[name] for name in ['grid', 'shape', 'log_posterior', 'n_responses']})
@@ -0,0 +1,151 @@
+
+# import relevant packages
+import os.path as op
+import sys
+import time
+import argparse
+import tempfile
+import runpy
+import subprocess
+import numpy as np
+
+
+# modules to time import of (in a fresh interpreter each)
+MODULES = ['utils', 'design', 'io_utils', 'draw_utils', 'plot_utils', 'stim', 'trial', 'session']
+
+
+def time_import(module, n_reps = 5):
+
+    """ time import of module in fresh python processes
+
+    Parameters
+    ----------
+    module : str
+        module name
+    n_reps : int
+        number of repetitions
+
+    Returns
+    -------
+    import_times : arr
+        import time (in seconds) of each repetition (nan if import failed)
+    """
+
+    code = 'import time; t0 = time.perf_counter(); import {mod}; print(time.perf_counter() - t0)'.format(mod = module)
+
+    import_times = []
+    for r in range(n_reps):
+        out = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True)
+        import_times.append(float(out.stdout.strip().split('\n')[-1]) if out.returncode == 0 else np.nan)
+
+    return np.array(import_times)
+
+
+def run_to_first_screen(out_file, argv):
+
+    """ run main.py until its first instruction screen is shown, write time of that screen to out_file and quit.
+    draw_instructions is replaced before main.py imports the session, so experiment code has no benchmark hook
+
+    Parameters
+    ----------
+    out_file : str
+        absolute path to file where time of first instruction screen is written
+    argv : list
+        command line arguments of main.py (ex: ['999', '0'])
+    """
+
+    import draw_utils
+
+    def draw_first_screen(win, instructions, keys = ['b'], visual_obj = [], clear_events = True, **text_kwargs):
+
+        # same screen as draw_instructions, without waiting for keys
+        draw_utils.make_instructions_text(win, instructions, **text_kwargs).draw()
+        for obj in visual_obj:
+            obj.draw()
+        win.flip()
+
+        with open(out_file, 'w') as f_out:
+            f_out.write('%f'%time.time())
+
+        win.close()
+        sys.exit(0)
+
+    draw_utils.draw_instructions = draw_first_screen
+
+    sys.argv = ['main.py'] + list(argv)
+    runpy.run_path('main.py', run_name = '__main__')
+
+
+def time_first_screen(exp_type = 'standard', sj_num = '999', run_num = '0', n_reps = 3):
+
+    """ time from process start until first instruction screen of main.py is shown
+    (needs display, main.py is run through run_to_first_screen)
+
+    Parameters
+    ----------
+    exp_type : str
+        type of experiment ('standard', 'feature' or 'flicker')
+    sj_num : str
+        subject number used for benchmark output
+    run_num : str
+        run number used for benchmark output
+    n_reps : int
+        number of repetitions
+
+    Returns
+    -------
+    startup_times : arr
+        startup time (in seconds) of each repetition (nan if it failed)
+    """
+
+    # answers to input prompts of main.py
+    answers = exp_type+'\n' + ('red\n' if exp_type == 'feature' else '')
+
+    startup_times = []
+    for r in range(n_reps):
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+
+            out_file = op.join(tmp_dir, 'first_screen.txt')
+            code = 'import startup_benchmark; startup_benchmark.run_to_first_screen({out!r}, {argv!r})'.format(out = out_file, 
+                                                                                                            argv = [sj_num, run_num])
+
+            start_time = time.time()
+            subprocess.run([sys.executable, '-c', code], input = answers, text = True, capture_output = True)
+
+            if op.exists(out_file):
+                with open(out_file) as f_in:
+                    startup_times.append(float(f_in.read()) - start_time)
+            else:
+                startup_times.append(np.nan)
+
+    return np.array(startup_times)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description = 'Benchmark experiment startup time')
+    parser.add_argument('--n_reps', type = int, default = 5)
+    parser.add_argument('--full', action = 'store_true', help = 'also time main.py until first instruction screen (needs display)')
+    parser.add_argument('--exp_type', type = str, default = 'standard', choices = ['standard', 'feature', 'flicker'])
+    args = parser.parse_args()
+
+    print('import time (median over %i fresh processes)'%args.n_reps)
+    for module in MODULES:
+        import_times = time_import(module, n_reps = args.n_reps)
+
+        if np.all(np.isnan(import_times)):
+            print('  %-12s failed'%module)
+        else:
+            print('  %-12s %.3f s'%(module, np.nanmedian(import_times)))
+
+    if args.full:
+        startup_times = time_first_screen(exp_type = args.exp_type, n_reps = args.n_reps)
+        print('process start to first instruction screen (%s): median %.3f s, min %.3f s, max %.3f s'%(args.exp_type,
+                                                                                                    np.nanmedian(startup_times),
+                                                                                                    np.nanmin(startup_times),
+                                                                                                    np.nanmax(startup_times)))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ import math
 from psychopy import visual, tools
 
 from utils import *
+from draw_utils import update_elements
 
 
 class Stim(object):
@@ -33,6 +34,12 @@ class Stim(object):
 
         self.condition_settings = self.session.settings['stimuli']['conditions']
 
+        # element textures already made, for each color (kept across runs)
+        self.tex_cache = {}
+
+        # preallocated element arrays updated every frame, one set per bar element array
+        self.element_buffers = {name: make_element_buffers(self.grid_pos) for name in ['bar0', 'bar1']}
+
 
         # define element arrays here, with settings of background
         # will be updated later when drawing
@@ -50,16 +57,9 @@ class Stim(object):
         # elements spatial frequency
         self.element_sfs = np.ones((self.nElements)) * self.condition_settings['background']['element_sf'] # in cycles/gabor width
 
-        # element orientation (half ori1, half ori2)
-        ori_arr = np.concatenate((np.ones((math.floor(self.nElements * .5))) * self.condition_settings['background']['element_ori'][0], 
-                                  np.ones((math.ceil(self.nElements * .5))) * self.condition_settings['background']['element_ori'][1]))
-
-        # add some jitter to the orientations
-        self.element_ori = jitter(ori_arr,
-                         max_val = self.condition_settings['background']['ori_jitter_max'],
-                         min_val = self.condition_settings['background']['ori_jitter_min']) 
-
-        np.random.shuffle(self.element_ori) # shuffle the orientations
+        # element orientation (half ori1, half ori2, with some jitter, shuffled)
+        self.element_ori = make_element_oris(self.nElements, self.condition_settings['background'], 
+                                             rng = self.session.rng.get('stim'))
 
         # element contrasts
         self.element_contrast =  np.ones((self.nElements)) * self.condition_settings['background']['element_contrast']
@@ -95,6 +95,20 @@ class Stim(object):
                                                                 colorSpace = self.session.settings['stimuli']['colorSpace']) 
 
 
+    def reset_run(self):
+
+        """ reset elements for a new run in the same session 
+        (new orientations, from the random generator of the run) """
+
+        self.element_ori = make_element_oris(self.nElements, self.condition_settings['background'], 
+                                             rng = self.session.rng.get('stim'))
+
+        for array_name in ['background_array', 'bar0_array', 'bar1_array']:
+            if hasattr(self.session, array_name):
+                getattr(self.session, array_name).setOris(self.element_ori)
+                getattr(self.session, array_name).setXYs(self.element_positions)
+
+
 class PRFStim(Stim):
 
     def __init__(self, session, bar_width_ratio, grid_pos):
@@ -134,6 +148,10 @@ class PRFStim(Stim):
                                                         elem_positions = position_dictionary['bar0']['xys'], 
                                                         grid_pos = self.grid_pos,
                                                         monitor = self.session.monitor, 
+                                                        ori_rng = self.session.rng.get('orientation'),
+                                                        jitter_rng = self.session.rng.get('jitter'),
+                                                        tex_cache = self.tex_cache,
+                                                        buffers = self.element_buffers['bar0'],
                                                         screen = self.session.screen,
                                                         override_contrast = override_contrast,
                                                         contrast_val = contrast_val)
@@ -193,6 +211,10 @@ class FeatureStim(Stim):
                                                         elem_positions = position_dictionary['bar0']['xys'], 
                                                         grid_pos = self.grid_pos,
                                                         monitor = self.session.monitor, 
+                                                        ori_rng = self.session.rng.get('orientation'),
+                                                        jitter_rng = self.session.rng.get('jitter'),
+                                                        tex_cache = self.tex_cache,
+                                                        buffers = self.element_buffers['bar0'],
                                                         screen = self.session.screen,
                                                         new_color = new_colors[0])
 
@@ -204,6 +226,10 @@ class FeatureStim(Stim):
                                                         elem_positions = position_dictionary['bar1']['xys'], 
                                                         grid_pos = self.grid_pos,
                                                         monitor = self.session.monitor, 
+                                                        ori_rng = self.session.rng.get('orientation'),
+                                                        jitter_rng = self.session.rng.get('jitter'),
+                                                        tex_cache = self.tex_cache,
+                                                        buffers = self.element_buffers['bar1'],
                                                         screen = self.session.screen,
                                                         new_color = new_colors[1])
 
@@ -249,6 +275,10 @@ class FlickerStim(Stim):
                                                                                 luminance = luminance,
                                                                                 update_settings = True,
                                                                                 monitor = self.session.monitor, 
+                                                                                ori_rng = self.session.rng.get('orientation'),
+                                                                                jitter_rng = self.session.rng.get('jitter'),
+                                                                                tex_cache = self.tex_cache,
+                                                                                buffers = self.element_buffers['bar0'],
                                                                                 screen = self.session.screen)
 
 
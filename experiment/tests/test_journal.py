@@ -0,0 +1,63 @@
+
+import os.path as op
+import sys
+import numpy as np
+import pandas as pd
+
+# experiment modules are imported flat (as when running from experiment folder)
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from journal import EventJournal, load_journal
+
+
+def log_rows(global_log, rows):
+
+    """ append rows to session data frame, as log_event does (new keys become new columns) """
+
+    for row in rows:
+        idx = global_log.shape[0]
+        for key, val in row.items():
+            global_log.loc[idx, key] = val
+
+
+def test_columns_logged_later_are_kept(tmp_path):
+
+    journal_file = str(tmp_path / 'sub-001_ses-1_task-FA_run-1_events_journal.tsv')
+    global_log = pd.DataFrame(columns = ['trial_nr', 'onset', 'event_type', 'phase', 'response', 'nr_frames'])
+
+    journal = EventJournal(journal_file)
+    journal.start()
+
+    log_rows(global_log, [{'trial_nr': 0, 'onset': 0., 'event_type': 'stim', 'phase': 0}])
+    journal.write(global_log, 10)
+
+    # fixation break logged in next trial, with its own columns
+    log_rows(global_log, [{'trial_nr': 1, 'onset': 1.6, 'event_type': 'stim', 'phase': 0},
+                          {'trial_nr': 1, 'onset': 1.7, 'event_type': 'fixation_break', 'phase': 0,
+                           'break_duration': .2, 'break_distance': 2.5}])
+    journal.write(global_log, 10)
+
+    log_rows(global_log, [{'trial_nr': 2, 'onset': 3.2, 'event_type': 'stim', 'phase': 0}])
+    journal.close(global_log, 10)
+
+    journal_df = load_journal(journal_file)
+
+    assert journal_df.shape[0] == 4
+    assert {'break_duration', 'break_distance', 'onset_abs'} <= set(journal_df.columns)
+    assert journal_df.loc[journal_df['event_type'] == 'fixation_break', 'break_distance'].item() == 2.5
+    assert np.allclose(journal_df['onset_abs'] - journal_df['onset'], 10)
+
+
+def test_journal_of_earlier_attempt_is_moved(tmp_path):
+
+    journal_file = str(tmp_path / 'sub-001_ses-1_task-FA_run-1_events_journal.tsv')
+
+    for attempt in range(2):
+        global_log = pd.DataFrame({'trial_nr': [attempt], 'onset': [0.], 'event_type': ['stim'], 'phase': [0]})
+
+        journal = EventJournal(journal_file)
+        journal.start()
+        journal.close(global_log, 0)
+
+    assert list(load_journal(journal_file)['trial_nr']) == [1]
+    assert list(load_journal(journal_file.replace('.tsv', '_stale-1.tsv'))['trial_nr']) == [0]
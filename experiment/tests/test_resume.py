@@ -0,0 +1,184 @@
+
+import os
+import os.path as op
+import sys
+import numpy as np
+import pandas as pd
+
+# experiment modules are imported flat (as when running from experiment folder)
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from timeline import Timeline
+from journal import EventJournal, format_events
+from checkpoint import RunCheckpoint, keep_interrupted_events
+
+
+TR = 1.6
+
+def make_design(n_trials = 40):
+
+    """ small pRF-like design, bars every other trial and orientation switches every 2.5 s """
+
+    return {'trial_number': n_trials,
+            'phase_durations': [.8, .8],
+            'bar_bool': np.arange(n_trials) % 2 == 1,
+            'ori_switch_times': np.arange(2.5, n_trials * TR, 2.5)}
+
+
+def run_counters(timeline, times, responses, ori_counter = 0, bar_counter = 0):
+
+    """ update counters as trials do - ori switch check every frame, and response matching """
+
+    switches = []
+    answered = []
+
+    for t in times:
+        ori_epoch = timeline.ori_epoch(t)
+        if ori_epoch > ori_counter:
+            switches.append(t)
+            ori_counter = ori_epoch
+
+    for t in responses:
+        bar_ind = timeline.response_bar(t, bar_counter)
+        if bar_ind >= 0:
+            answered.append(int(timeline.bar_trials[bar_ind]))
+            bar_counter = bar_ind + 1
+
+    return switches, answered, ori_counter, bar_counter
+
+
+def test_resume_mid_run():
+
+    design = make_design()
+    frame_dt = 1/120
+    resume_trial = 20
+    resume_onset = resume_trial * TR
+
+    ## run until crash, at start of resume trial (checkpoint saved at trial boundary)
+    timeline = Timeline.from_design(design, trial_duration = TR)
+    frames = np.arange(0, resume_onset, frame_dt)
+    responses = timeline.bar_onsets[timeline.bar_onsets < resume_onset] + .5
+
+    _, answered, ori_counter, bar_counter = run_counters(timeline, frames, responses)
+    assert answered == list(timeline.bar_trials[timeline.bar_onsets < resume_onset])
+
+    ## resume - clock starts at 0 at resumed trial, counters restored from checkpoint
+    timeline = Timeline.from_design(design, trial_duration = TR)
+    timeline.resume_at(resume_trial)
+
+    frames = np.arange(0, design['trial_number'] * TR - resume_onset, frame_dt)
+    later_bars = timeline.bar_onsets >= resume_onset
+    responses = timeline.bar_onsets[later_bars] - resume_onset + .5
+
+    switches, answered, _, _ = run_counters(timeline, frames, responses,
+                                            ori_counter = ori_counter, bar_counter = bar_counter)
+
+    # orientations keep switching at design times (in resumed clock)
+    expected = design['ori_switch_times'][design['ori_switch_times'] >= resume_onset] - resume_onset
+    assert len(switches) == len(expected)
+    assert np.all(np.abs(np.array(switches) - expected) <= frame_dt)
+
+    # every response after resuming answers its own bar
+    assert answered == list(timeline.bar_trials[later_bars])
+
+    # trial on screen is trial of design
+    assert timeline.trial_at(.1) == resume_trial
+    assert timeline.phase_at(TR/2 + .1) == (resume_trial, 1)
+
+
+def test_no_offset_without_resume():
+
+    timeline = Timeline.from_design(make_design(), trial_duration = TR)
+
+    assert timeline.trial_at(TR * 3 + .1) == 3
+    assert timeline.bar_at(TR * 3 + .1) == 1
+    assert timeline.ori_epoch(2.6) == 1
+
+
+def log_trials(trial_nrs):
+
+    """ events of trials (two phases each), as logged in session data frame """
+
+    return pd.DataFrame({'trial_nr': np.repeat(trial_nrs, 2),
+                         'onset': np.arange(len(trial_nrs) * 2) * TR/2,
+                         'event_type': 'stim',
+                         'phase': np.tile([0, 1], len(trial_nrs)),
+                         'response': np.nan,
+                         'nr_frames': 1.})
+
+
+def interrupt_run(output_dir, output_str, trial_nrs, n_resumes, quit_key = True):
+
+    """ run trials until interrupted - with 'q' (session closed, events file saved) or crash (only journal left) """
+
+    journal_file = op.join(output_dir, output_str+'_events_journal.tsv')
+    global_log = log_trials(trial_nrs)
+
+    journal = EventJournal(journal_file)
+    journal.start()
+    journal.write(global_log, 0)
+
+    checkpoint = RunCheckpoint(output_dir, output_str)
+    checkpoint.save_design({'trial_number': 40})
+    checkpoint.save_state({'next_trial': trial_nrs[-1] + 1, 'n_resumes': n_resumes})
+
+    if quit_key:
+        # as session.close - events saved, journal removed, checkpoint kept
+        journal.close(global_log, 0)
+        format_events(global_log, 0, global_log['onset'].max() + TR/2).to_csv(op.join(output_dir, output_str+'_events.tsv'), sep = '\t')
+        os.remove(journal_file)
+        keep_interrupted_events(output_dir, output_str, n_resumes)
+    else:
+        journal.close()
+
+    return journal_file
+
+
+def resume_run(output_dir, output_str, journal_file, trial_nrs = None):
+
+    """ as session.resume, then resumed trials saved in events file of run (if they all ran) """
+
+    _, state = RunCheckpoint(output_dir, output_str).load()
+    pre_resume_file = keep_interrupted_events(output_dir, output_str, state['n_resumes'], journal_file = journal_file)
+
+    if op.exists(journal_file):
+        os.remove(journal_file)
+
+    if trial_nrs is None:
+        return pre_resume_file
+
+    global_log = log_trials(trial_nrs)
+    format_events(global_log, 0, global_log['onset'].max() + TR/2).to_csv(op.join(output_dir, output_str+'_events.tsv'), sep = '\t')
+
+    return pre_resume_file
+
+
+def test_quit_then_resume_keeps_events(tmp_path):
+
+    output_dir, output_str = str(tmp_path), 'sub-001_ses-1_task-pRF_run-1'
+
+    journal_file = interrupt_run(output_dir, output_str, np.arange(10), n_resumes = 0)
+    pre_resume_file = resume_run(output_dir, output_str, journal_file, np.arange(10, 40))
+
+    assert op.basename(pre_resume_file) == output_str+'_events_pre-resume-1.tsv'
+    assert list(pd.read_csv(pre_resume_file, sep = '\t')['trial_nr'].unique()) == list(range(10))
+    assert list(pd.read_csv(op.join(output_dir, output_str+'_events.tsv'), sep = '\t')['trial_nr'].unique()) == list(range(10, 40))
+
+
+def test_crash_then_quit_resumes(tmp_path):
+
+    output_dir, output_str = str(tmp_path), 'sub-001_ses-1_task-pRF_run-1'
+
+    # crash, resume and quit again with 'q', then resume again
+    journal_file = interrupt_run(output_dir, output_str, np.arange(5), n_resumes = 0, quit_key = False)
+    resume_run(output_dir, output_str, journal_file)
+
+    journal_file = interrupt_run(output_dir, output_str, np.arange(5, 12), n_resumes = 1)
+    pre_resume_file = resume_run(output_dir, output_str, journal_file, np.arange(12, 40))
+
+    first = pd.read_csv(op.join(output_dir, output_str+'_events_pre-resume-1.tsv'), sep = '\t')
+    second = pd.read_csv(pre_resume_file, sep = '\t')
+
+    assert op.basename(pre_resume_file) == output_str+'_events_pre-resume-2.tsv'
+    assert list(first['trial_nr'].unique()) == list(range(5))
+    assert list(second['trial_nr'].unique()) == list(range(5, 12))
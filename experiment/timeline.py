@@ -0,0 +1,212 @@
+
+import numpy as np
+
+
+class Timeline(object):
+
+    def __init__(self, trial_onsets, trial_nrs = None, phase_onsets = None, phase_trials = None, phase_nrs = None,
+                 bar_trials = [], bar_window = 1.6, ori_switch_times = []):
+
+        """ Initializes Timeline object, index of when trials, phases, bar response windows
+        and orientation switches start, to look up what is on screen at any time with searchsorted
+        (so lookups don't depend on counters being updated every frame).
+        Used online by trials, and offline with the onsets logged in the events file
+
+        Parameters
+        ----------
+        trial_onsets : list/arr
+            onset of each trial (in seconds, relative to session clock)
+        trial_nrs : list/arr/None
+            trial number of each onset (if None, 0 to number of trials)
+        phase_onsets : list/arr/None
+            onset of each phase of all trials (if None, one phase per trial)
+        phase_trials : list/arr/None
+            trial number of each phase onset
+        phase_nrs : list/arr/None
+            phase index (within trial) of each phase onset
+        bar_trials : list/arr
+            trial numbers of bar trials
+        bar_window : float
+            duration of response window after bar onset (in seconds),
+            windows also close when next bar starts
+        ori_switch_times : list/arr
+            times when element orientations switch
+        """
+
+        self.trial_onsets = np.asarray(trial_onsets, dtype = float)
+        self.trial_nrs = np.arange(len(self.trial_onsets)) if trial_nrs is None else np.asarray(trial_nrs, dtype = int)
+
+        if phase_onsets is None:
+            phase_onsets, phase_trials, phase_nrs = self.trial_onsets, self.trial_nrs, np.zeros(len(self.trial_nrs), dtype = int)
+
+        order = np.argsort(phase_onsets, kind = 'stable')
+        self.phase_onsets = np.asarray(phase_onsets, dtype = float)[order]
+
+        # lookup arrays are padded at the start, so index -1 (before first onset) maps to -1
+        self.trial_lookup = np.r_[-1, self.trial_nrs]
+        self.phase_trial_lookup = np.r_[-1, np.asarray(phase_trials, dtype = int)[order]]
+        self.phase_lookup = np.r_[-1, np.asarray(phase_nrs, dtype = int)[order]]
+
+        ## bar windows
+        bar_mask = np.isin(self.trial_nrs, bar_trials)
+        self.bar_trials = self.trial_nrs[bar_mask]
+        self.bar_onsets = self.trial_onsets[bar_mask]
+        self.bar_window = bar_window
+
+        # onset lookup padded with -inf, so times before first bar are never in a window
+        self.bar_onset_lookup = np.r_[-np.inf, self.bar_onsets]
+
+        self.ori_switch_times = np.asarray(ori_switch_times, dtype = float)
+
+        # added to times looked up (session clock restarts at 0 when run is resumed mid-run)
+        self.time_offset = 0
+
+
+    @classmethod
+    def from_design(cls, design, trial_duration, bar_window = None):
+
+        """ make timeline from planned design of run
+        (phases that would last past the next trial onset, ex: when synced to scanner, are cut at it)
+
+        Parameters
+        ----------
+        design : dict
+            design of run (from design.get_design)
+        trial_duration : float
+            planned duration of each trial (TR for pRF and feature runs)
+        bar_window : float/None
+            duration of response window (if None, same as trial duration)
+        """
+
+        n_trials = design['trial_number']
+        trial_onsets = np.arange(n_trials) * trial_duration
+
+        # phase durations are the same for all trials (pRF), or per trial (feature)
+        phase_durations = design['phase_durations']
+        if np.ndim(phase_durations[0]) == 0:
+            phase_durations = [phase_durations] * n_trials
+
+        n_phases = np.array([len(dur) for dur in phase_durations])
+        durations = np.concatenate([np.asarray(dur, dtype = float) for dur in phase_durations])
+
+        phase_trials = np.repeat(np.arange(n_trials), n_phases)
+        phase_nrs = np.arange(len(durations)) - np.repeat(np.cumsum(n_phases) - n_phases, n_phases)
+
+        # onset within trial is sum of durations of previous phases of trial
+        run_onsets = np.cumsum(durations) - durations
+        rel_onsets = run_onsets - np.repeat(run_onsets[np.cumsum(n_phases) - n_phases], n_phases)
+        phase_onsets = np.minimum(trial_onsets[phase_trials] + rel_onsets, (phase_trials + 1) * trial_duration)
+
+        return cls(trial_onsets, phase_onsets = phase_onsets, phase_trials = phase_trials, phase_nrs = phase_nrs,
+                   bar_trials = np.where(design['bar_bool'])[0] if 'bar_bool' in design else [],
+                   bar_window = trial_duration if bar_window is None else bar_window,
+                   ori_switch_times = design.get('ori_switch_times', []))
+
+
+    @classmethod
+    def from_events(cls, events_df, bar_trials = [], bar_window = 1.6, ori_switch_times = [], phase_events = None):
+
+        """ make timeline from phase onsets logged in events file of run
+
+        Parameters
+        ----------
+        events_df : pandas DataFrame
+            events of run (as in _events.tsv, with trial_nr column)
+        bar_trials : list/arr
+            trial numbers of bar trials
+        bar_window : float
+            duration of response window after bar onset (in seconds)
+        ori_switch_times : list/arr
+            times when element orientations switch
+        phase_events : pandas Series/None
+            boolean mask of rows that are trial phases (if None, all rows with a phase duration)
+        """
+
+        phase_df = events_df[events_df['duration'].notna() if phase_events is None else phase_events]
+        trial_onsets = phase_df.groupby('trial_nr')['onset'].min()
+
+        return cls(trial_onsets.values, trial_nrs = trial_onsets.index.values,
+                   phase_onsets = phase_df['onset'].values, phase_trials = phase_df['trial_nr'].values,
+                   phase_nrs = phase_df['phase'].values,
+                   bar_trials = bar_trials, bar_window = bar_window, ori_switch_times = ori_switch_times)
+
+
+    def resume_at(self, trial_nr):
+
+        """ align timeline with session clock of run resumed at trial trial_nr
+        (clock is reset when that trial starts, so its onset is added to all times looked up) """
+
+        self.time_offset = float(self.trial_onsets[self.trial_nrs == trial_nr][0])
+
+
+    def trial_at(self, t):
+
+        """ trial number on screen at time t (-1 if before first trial), t can be array """
+
+        return self.trial_lookup[np.searchsorted(self.trial_onsets, np.add(t, self.time_offset), side = 'right')]
+
+
+    def phase_at(self, t):
+
+        """ trial number and phase index on screen at time t (-1 if before first trial), t can be array """
+
+        ind = np.searchsorted(self.phase_onsets, np.add(t, self.time_offset), side = 'right')
+
+        return self.phase_trial_lookup[ind], self.phase_lookup[ind]
+
+
+    def bar_index(self, t):
+
+        """ index of most recent bar (-1 if before first bar), t can be array """
+
+        return np.searchsorted(self.bar_onsets, np.add(t, self.time_offset), side = 'right') - 1
+
+
+    def bar_at(self, t):
+
+        """ index of bar whose response window t is in (-1 if not in any window), t can be array """
+
+        bar_ind = self.bar_index(t)
+        in_window = (t + self.time_offset - self.bar_onset_lookup[bar_ind + 1]) < self.bar_window
+
+        return np.where(in_window, bar_ind, -1) if np.ndim(t) else (int(bar_ind) if in_window else -1)
+
+
+    def response_bar(self, t, bar_counter):
+
+        """ bar that a response at time t answers (-1 if not in a window,
+        or window already answered - bars before bar_counter)
+
+        Parameters
+        ----------
+        t : float
+            time of response (relative to session clock)
+        bar_counter : int
+            index of first bar not answered yet
+        """
+
+        bar_ind = self.bar_at(t)
+
+        return bar_ind if bar_ind >= bar_counter else -1
+
+
+    def ori_epoch(self, t):
+
+        """ number of orientation switches that happened up to time t, t can be array """
+
+        return np.searchsorted(self.ori_switch_times, np.add(t, self.time_offset), side = 'right')
+
+
+    def locate(self, t):
+
+        """ what is on screen at time t
+
+        Returns
+        -------
+        out_dict : dict
+            trial number, phase index, bar window index and orientation epoch
+        """
+
+        trial_nr, phase = self.phase_at(t)
+
+        return {'trial_nr': trial_nr, 'phase': phase, 'bar': self.bar_at(t), 'ori_epoch': self.ori_epoch(t)}
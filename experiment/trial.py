@@ -9,10 +9,14 @@ from psychopy import event, tools, colors, visual
 from psychopy.visual import TextStim
 
 from utils import *
+from logger import get_logger
 
 import pickle
 
 
+logger = get_logger(__name__)
+
+
 class PRFTrial(Trial):
 
     def __init__(self, session, trial_nr, bar_pass_direction_at_TR, bar_midpoint_at_TR, phase_durations,
@@ -68,15 +72,19 @@ class PRFTrial(Trial):
 
         """ Draw stimuli - pRF bar - for each trial """
 
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_start()
+
         current_time = self.session.clock.getTime() # get time
 
 
         ## orientation switch times
-        if self.session.ori_counter<len(self.session.ori_switch_times): # if counter within number of switch moments
-            if current_time >= self.session.ori_switch_times[self.session.ori_counter]: # when switch time reached, switch ori and increment counter
-                
-                self.session.ori_bool = True
-                self.session.ori_counter += 1
+        ori_epoch = self.session.timeline.ori_epoch(current_time) # number of switch moments reached
+        if ori_epoch > self.session.ori_counter: # when switch time reached (even if frames were dropped), switch ori
+            
+            self.session.ori_bool = True
+            self.session.ori_counter = ori_epoch
 
         ## draw stim
         if (self.bar_pass_direction_at_TR != 'empty'): # if bar pass at TR, then draw bar
@@ -99,6 +107,10 @@ class PRFTrial(Trial):
         ## fixation lines
         self.session.line1.draw() 
         self.session.line2.draw() 
+
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_end()
             
 
 
@@ -107,7 +119,7 @@ class PRFTrial(Trial):
         for ev, t in event.getKeys(timeStamped=self.session.clock): # list of of (keyname, time) relative to Clock’s last reset
             if len(ev) > 0:
                 if ev in ['q']:
-                    print('trial canceled by user')  
+                    logger.warning('trial canceled by user')  
                     self.session.close()
                     self.session.quit()
 
@@ -120,29 +132,18 @@ class PRFTrial(Trial):
                     event_type = 'response'
                     self.session.total_responses += 1
 
-                    if t >= self.session.bar_timing[self.session.bar_counter]:
-
-                        if (ev in self.session.settings['keys']['right_index']) and \
-                            (('color_green' in self.phase_names) or ('yellow' in self.phase_names) or ('blue' in self.phase_names)):
-                            self.session.correct_responses += 1
+                    # bar window response is in (if not answered yet)
+                    bar_ind = self.session.timeline.response_bar(t, self.session.bar_counter)
 
-                        elif (ev in self.session.settings['keys']['left_index']) and \
-                            (('color_red' in self.phase_names) or ('orange' in self.phase_names) or ('pink' in self.phase_names)):
-                            self.session.correct_responses += 1
-                        
-                        if self.session.bar_counter<len(self.session.bar_timing)-1:
-                            self.session.bar_counter +=1
+                    if bar_ind >= 0:
+                        bar_trial = self.session.timeline.bar_trials[bar_ind]
+                        self.session.correct_responses += check_prf_response(ev, self.session.phase_conditions[bar_trial], 
+                                                                             keys = self.session.settings['keys'])
+                        self.session.bar_counter = bar_ind + 1
 
                 # log everything into session data frame
-                idx = self.session.global_log.shape[0]
-                self.session.global_log.loc[idx, 'trial_nr'] = self.ID
-                self.session.global_log.loc[idx, 'onset'] = t
-                self.session.global_log.loc[idx, 'event_type'] = event_type
-                self.session.global_log.loc[idx, 'phase'] = self.phase
-                self.session.global_log.loc[idx, 'response'] = ev                
-
-                for param, val in self.parameters.items():
-                    self.session.global_log.loc[idx, param] = val
+                log_event(self.session.global_log, self.ID, t, event_type, self.phase, ev, 
+                          parameters = self.parameters)
 
 
 
@@ -191,6 +192,9 @@ class FeatureTrial(Trial):
 
         super().__init__(session, trial_nr, phase_durations, phase_names, verbose=False, *args, **kwargs)
 
+        # task colors of bars in trial (set when first drawn)
+        self.task_color_array = None
+
         # get bar and background positions for this trial
         self.position_dictionary = get_object_positions(self.session.grid_pos, self.bar_midpoint_at_TR, self.bar_pass_direction_at_TR,
                                                     self.session.bar_width_pix, screen = self.session.screen, 
@@ -200,20 +204,19 @@ class FeatureTrial(Trial):
     def draw(self): 
 
         """ Draw stimuli - pRF bars - for each trial """
+
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_start()
         
         current_time = self.session.clock.getTime() # get time
 
         ## orientation switch times
-        if self.session.ori_counter<len(self.session.ori_switch_times): # if counter within number of switch moments
-            if current_time >= self.session.ori_switch_times[self.session.ori_counter]: # when switch time reached, switch ori and increment counter
-                
-                self.session.ori_bool = True
-                self.session.ori_counter += 1
-
-        ## bar counter, for responses sanity check
-        if self.session.bar_counter<len(self.session.bar_timing)-1:
-            if current_time >= (self.session.bar_timing[self.session.bar_counter] + self.session.settings['mri']['TR']): # if no valid reply in this window, increment
-                self.session.bar_counter += 1 
+        ori_epoch = self.session.timeline.ori_epoch(current_time) # number of switch moments reached
+        if ori_epoch > self.session.ori_counter: # when switch time reached (even if frames were dropped), switch ori
+            
+            self.session.ori_bool = True
+            self.session.ori_counter = ori_epoch
 
         ## draw stim
         if 'task' in self.trial_type_at_TR: # # if bar pass at TR, then draw bar
@@ -226,8 +229,9 @@ class FeatureTrial(Trial):
                             ]
                 this_phase = ['color_red' if 'red' in p else 'color_green' for _,p in enumerate(this_phase)]
 
-                # get task colors
-                task_color_array = self.get_FAtask_color(this_phase = this_phase)
+                # get task colors (same for whole trial, so only once)
+                if self.task_color_array is None:
+                    self.task_color_array = self.get_FAtask_color(this_phase = this_phase)
 
                 self.session.feature_stim.draw(bar_midpoint_at_TR = self.bar_midpoint_at_TR, 
                                                bar_pass_direction_at_TR = self.bar_pass_direction_at_TR,
@@ -235,7 +239,7 @@ class FeatureTrial(Trial):
                                                position_dictionary = self.position_dictionary,
                                                orientation = self.session.ori_bool,
                                                drawing_ind = self.session.drawing_ind[self.ID],
-                                               new_colors = task_color_array
+                                               new_colors = self.task_color_array
                                                ) 
 
 
@@ -253,6 +257,10 @@ class FeatureTrial(Trial):
         self.session.line1.draw() 
         self.session.line2.draw()
 
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_end()
+
 
     def get_FAtask_color(self, this_phase = []):
 
@@ -282,15 +290,8 @@ class FeatureTrial(Trial):
 
         """ helper function """
 
-        if (event_key in self.session.settings['keys']['left_index']) and (task_color in ['blue', 'pink']):
-            response = 1
-            print('correct')
-        elif (event_key in self.session.settings['keys']['right_index']) and (task_color in ['yellow', 'orange']):
-            response = 1
-            print('correct')
-        else:
-            response = 0
-            print('wrong')
+        response = get_feature_response(event_key, task_color, keys = self.session.settings['keys'])
+        logger.info('correct' if response else 'wrong')
 
         return response 
 
@@ -301,7 +302,7 @@ class FeatureTrial(Trial):
         for ev, t in event.getKeys(timeStamped=self.session.clock): # list of of (keyname, time) relative to Clock’s last reset
             if len(ev) > 0:
                 if ev in ['q']:
-                    print('trial canceled by user')  
+                    logger.warning('trial canceled by user')  
                     self.session.close()
                     self.session.quit()
 
@@ -313,27 +314,21 @@ class FeatureTrial(Trial):
                     event_type = 'response'
                     self.session.total_responses += 1
 
-                    if t >= self.session.bar_timing[self.session.bar_counter]:   
+                    # bar window response is in (if not answered yet)
+                    bar_ind = self.session.timeline.response_bar(t, self.session.bar_counter)
+
+                    if bar_ind >= 0:   
 
                         ## get user response!
                         user_response = self.get_pp_response(event_key = ev, 
-                                                            task_color = self.session.task_colors[self.session.att_condition][self.session.ctask_ind_all[self.session.att_condition][self.session.bar_counter]])
+                                                            task_color = self.session.task_colors[self.session.att_condition][self.session.ctask_ind_all[self.session.att_condition][bar_ind]])
 
                         self.session.correct_responses += user_response
-
-                        if self.session.bar_counter<len(self.session.bar_timing)-1:
-                            self.session.bar_counter += 1                        
+                        self.session.bar_counter = bar_ind + 1
 
                 # log everything into session data frame
-                idx = self.session.global_log.shape[0]
-                self.session.global_log.loc[idx, 'trial_nr'] = self.ID
-                self.session.global_log.loc[idx, 'onset'] = t
-                self.session.global_log.loc[idx, 'event_type'] = event_type
-                self.session.global_log.loc[idx, 'phase'] = self.phase
-                self.session.global_log.loc[idx, 'response'] = ev                
-
-                for param, val in self.parameters.items():
-                    self.session.global_log.loc[idx, param] = val
+                log_event(self.session.global_log, self.ID, t, event_type, self.phase, ev, 
+                          parameters = self.parameters)
 
 
 class FlickerTrial(Trial):
@@ -388,6 +383,10 @@ class FlickerTrial(Trial):
     def draw(self): 
 
         """ Draw stimuli - pRF bars - for each trial """
+
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_start()
         
         ## draw stim
 
@@ -408,6 +407,10 @@ class FlickerTrial(Trial):
         self.session.line1.draw() 
         self.session.line2.draw() 
 
+        # allocation instrumentation
+        if self.session.alloc_counter is not None:
+            self.session.alloc_counter.frame_end()
+
 
 
     def get_events(self):
@@ -415,12 +418,12 @@ class FlickerTrial(Trial):
         for ev, t in event.getKeys(timeStamped=self.session.clock): # list of of (keyname, time) relative to Clock’s last reset
             if len(ev) > 0:
                 if ev in ['q']:
-                    print('experiment canceled by user')  
+                    logger.warning('experiment canceled by user')  
                     self.session.close()
                     self.session.quit()
 
                 elif ev in self.session.settings['keys']['flicker_continue']: # end trial
-                    print('trial ended by user')  
+                    logger.info('trial ended by user')  
                     event_type = 'end_trial'
 
                     # save updated condition settings per trial
@@ -436,13 +439,10 @@ class FlickerTrial(Trial):
                         yaml.dump(self.session.updated_settings, f_out, indent=4, default_flow_style=False)
 
 
-                    if self.ID == self.session.trial_number - 1: #(len(self.session.settings['stimuli']['flicker']['bar_ecc_index'])-1): # if last trial                        
-                        self.session.close()
-                        self.session.quit()
-                    else:
-                        self.session.lum_responses = 1 # restart luminance counter for next trial
-                        self.stop_phase()
-                        self.stop_trial() 
+                    # last trial also just ends, session.run decides if session closes or stays open for next run
+                    self.session.lum_responses = 1 # restart luminance counter for next trial
+                    self.stop_phase()
+                    self.stop_trial() 
 
 
                 else: # any other key pressed will be response to color change
@@ -458,15 +458,8 @@ class FlickerTrial(Trial):
 
 
                 # log everything into session data frame
-                idx = self.session.global_log.shape[0]
-                self.session.global_log.loc[idx, 'trial_nr'] = self.ID
-                self.session.global_log.loc[idx, 'onset'] = t
-                self.session.global_log.loc[idx, 'event_type'] = event_type
-                self.session.global_log.loc[idx, 'phase'] = self.phase
-                self.session.global_log.loc[idx, 'response'] = ev                
-
-                for param, val in self.parameters.items():
-                    self.session.global_log.loc[idx, param] = val
+                log_event(self.session.global_log, self.ID, t, event_type, self.phase, ev, 
+                          parameters = self.parameters)
 
 
 
@@ -1,22 +1,42 @@
 
 import numpy as np
-import os, sys
-import os.path as op
+import importlib
 import math
-import random
-import pandas as pd
-import yaml
-
-from psychopy import visual, tools, colors, event
-import psychopy.tools.colorspacetools as ct
 import itertools
-
-import time
 import colorsys
-import seaborn as sns
+import re
+
+from logger import get_logger
+
+
+# functions that need heavy packages (psychopy, pandas, yaml, seaborn) live in separate modules,
+# which are only imported when the function is first used (keeps startup of core utils fast)
+LAZY_FUNCTIONS = {'update_elements': 'draw_utils',
+                  'draw_instructions': 'draw_utils',
+                  'save_bar_position': 'io_utils',
+                  'save_all_TR_info': 'io_utils',
+                  'get_average_color': 'io_utils',
+                  'make_lum_plots': 'plot_utils'}
+
+logger = get_logger(__name__)
+
+# bar directions/orientations, in order of direction codes
+BAR_DIRECTIONS = ['horizontal', 'vertical', 'L-R', 'R-L', 'U-D', 'D-U']
+
+
+def __getattr__(name):
+
+    """ load function from its module on first access (ex: utils.make_lum_plots) """
+
+    if name in LAZY_FUNCTIONS:
+        func = getattr(importlib.import_module(LAZY_FUNCTIONS[name]), name)
+        globals()[name] = func # next access does not go through here
+        return func
 
+    raise AttributeError("module 'utils' has no attribute '%s'"%name)
 
-def jitter(arr,max_val=1,min_val=0.5):
+
+def jitter(arr,max_val=1,min_val=0.5,rng=None,out=None,scratch=None):
 
     """ Add random jitter to an array
     
@@ -28,19 +48,47 @@ def jitter(arr,max_val=1,min_val=0.5):
         maximun amount to add/subtract
     min_val: int/float
         minimum amount to add/subtract
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
+    out: array/None
+        preallocated output array, same shape as arr (if None, new array is returned)
+    scratch: array/None
+        preallocated (N,) array for the jitter values (needed if out is given)
         
     """
 
+    rng = np.random.default_rng() if rng is None else rng
+
     # element positions (#elements,(x,y))
     size_arr = arr.shape[0]
     dim = arr.shape[-1] if len(arr.shape) == 2 else 1
+
+    if out is not None:
+        # same values as below, but without allocating new arrays
+        half = math.floor(size_arr * .5)
+
+        for k in range(dim):
+            rng.random(out = scratch[:half])
+            scratch[:half] *= (max_val - min_val)
+            scratch[:half] += -max_val
+            rng.random(out = scratch[half:])
+            scratch[half:] *= (max_val - min_val)
+            scratch[half:] += min_val
+            rng.shuffle(scratch)
+
+            if dim == 1:
+                np.add(arr, scratch, out = out)
+            else:
+                np.add(arr[...,k], scratch, out = out[...,k])
+
+        return(out)
     
     for k in range(dim):
 
         # add some randomly uniform jitter 
-        jit = np.concatenate((np.random.uniform(-max_val,-min_val,math.floor(size_arr * .5)),
-                              np.random.uniform(min_val,max_val,math.ceil(size_arr * .5))))
-        np.random.shuffle(jit)
+        jit = np.concatenate((rng.uniform(-max_val,-min_val,math.floor(size_arr * .5)),
+                              rng.uniform(min_val,max_val,math.ceil(size_arr * .5))))
+        rng.shuffle(jit)
         
         if k == 0 and dim == 1:
             output = arr + jit
@@ -95,6 +143,124 @@ def near_power_of_2(x,near='previous'):
     return val
 
 
+def get_display_screen(settings, win_size):
+
+    """ get size of display used for stimuli (in pixels),
+    given window size and display settings
+    
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    win_size : list/arr
+        window size [horizontal, vertical] in pixels
+    """
+
+    # set size of display
+    if settings['window_extra']['display'] == 'square':
+        screen = np.array([win_size[1], win_size[1]])
+    
+    elif settings['window_extra']['display'] == 'rectangle':
+        screen = np.array([win_size[0], win_size[1]])
+
+    if settings['window_extra']['mac_bool']: # to compensate for macbook retina display
+        screen = screen/2
+
+    return screen
+
+
+def get_grid_positions(screen, num_elem = [32,32], gab_ratio = 0.66):
+
+    """ make grid of possible positions for gabors 
+    (grid spans whole display, bar will alter specific part of grid)
+    
+    Parameters
+    ----------
+    screen : arr
+        array with display resolution
+    num_elem : list/arr
+        number of elements (gabors) per axis
+    gab_ratio : float
+        ratio to multiply by gabor diameter, to avoid empty spaces in grid
+
+    Returns
+    -------
+    grid_pos : arr
+        numpy array with all grid positions (N,2) -> (number of positions, [x,y])
+    gabor_diameter_pix : float
+        gabor diameter in pixels
+    """
+
+    ## first set the number of elements that fit each dimension
+    elem_num = np.array(num_elem)
+
+    gabor_diameter_pix = np.array(screen)/(elem_num * gab_ratio)
+    
+    # then set equally spaced x and y coordinates for grid
+    x_grid_pos = np.linspace(-screen[0]/2,
+                             screen[0]/2,
+                             int(elem_num[0]))
+
+    y_grid_pos = np.linspace(-screen[1]/2,
+                             screen[1]/2,
+                             int(elem_num[1]))
+
+    grid_pos = np.array(list(itertools.product(x_grid_pos, y_grid_pos))) # list of lists [[x0,y0],[x0,y1],...]
+
+    return grid_pos, gabor_diameter_pix[0]
+
+
+def get_ori_switch_times(settings, total_time):
+
+    """ define time points for element orientation to change
+
+    Parameters
+    ----------
+    settings : dict
+        experiment settings dict
+    total_time : float
+        total experiment time (in seconds)
+    """
+
+    if settings['stimuli']['ori_shift_rate'] == 'TR':
+        ori_shift_rate = 1/settings['mri']['TR'] # in seconds
+    else:
+        ori_shift_rate = settings['stimuli']['ori_shift_rate']
+
+    return np.arange(0,total_time,1/ori_shift_rate)
+
+
+def make_element_oris(nElements, element_settings, rng = None):
+
+    """ make initial element orientations (half ori1, half ori2), with some jitter, shuffled
+
+    Parameters
+    ----------
+    nElements : int
+        number of elements
+    element_settings : dict
+        condition settings for elements (with 'element_ori', 'ori_jitter_max' and 'ori_jitter_min')
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    # element orientation (half ori1, half ori2)
+    ori_arr = np.concatenate((np.ones((math.floor(nElements * .5))) * element_settings['element_ori'][0], 
+                              np.ones((math.ceil(nElements * .5))) * element_settings['element_ori'][1]))
+
+    # add some jitter to the orientations
+    element_ori = jitter(ori_arr,
+                         max_val = element_settings['ori_jitter_max'],
+                         min_val = element_settings['ori_jitter_min'],
+                         rng = rng) 
+
+    rng.shuffle(element_ori) # shuffle the orientations
+
+    return element_ori
+
+
 def get_object_positions(grid_pos,bar_midpoint_at_TR, bar_pass_direction_at_TR,
                       bar_width_pix, screen=np.array([1680,1050]), num_bar=1):
     
@@ -186,17 +352,80 @@ def get_object_positions(grid_pos,bar_midpoint_at_TR, bar_pass_direction_at_TR,
     return(output_dict)
 
 
-def update_elements(ElementArrayStim, condition_settings, this_phase, elem_positions, grid_pos,
-                   	monitor, screen = np.array([1680,1050]), position_jitter = None, orientation = True, 
-                    background_contrast = None, luminance = None, update_settings = False, new_color = False, 
-                    override_contrast = False, contrast_val = 1):
+def make_element_buffers(grid_pos):
+
+    """ preallocate element arrays that are updated every frame,
+    to be reused by get_element_state (so frames don't allocate new arrays)
+
+    Parameters
+    ----------
+    grid_pos: arr
+        numpy array with element positions (N,2) of whole grid -> (number of positions, [x,y])
+
+    Returns
+    -------
+    buffers: dict
+        dictionary with arrays for element 'colors', 'sfs', 'oris', 'contrs', 'opacities', 'xys', 
+        'jitter' (scratch) and lookups of element indices in grid 
+    """
+
+    nElements = grid_pos.shape[0]
+
+    return {'colors': np.ones((nElements,3)),
+            'sfs': np.ones((nElements)),
+            'oris': np.zeros((nElements)),
+            'contrs': np.zeros((nElements)),
+            'opacities': np.zeros((nElements)),
+            'xys': np.zeros((nElements,2)),
+            'jitter': np.zeros((nElements)),
+            'grid_index': {tuple(pos): i for i, pos in enumerate(grid_pos)}, # grid position -> index
+            'indices': {}} # id of element positions array -> (array, indices in grid)
+
+
+def get_element_indices(elem_positions, grid_pos, buffers = None):
+
+    """ get indices of element positions in grid
     
-    """ update element array settings
+    Parameters
+    ----------
+    elem_positions: arr
+         numpy array with element positions (N,2)
+    grid_pos: arr
+        numpy array with element positions (N,2) of whole grid
+    buffers: dict/None
+        element buffers (see make_element_buffers), to reuse indices already found for same positions array
+    """
+
+    if buffers is None:
+        # make grid and element position lists of lists
+        list_grid_pos = [list(val) for _,val in enumerate(grid_pos)]
+        list_elem_pos = [list(val) for _,val in enumerate(elem_positions)]
+
+        # get indices of where one is in other
+        return [list_grid_pos.index(list_elem_pos[i]) for i in range(len(list_elem_pos))]
+
+    cached = buffers['indices'].get(id(elem_positions))
+
+    # keep reference to array in cache, so its id is not reused
+    if cached is None or cached[0] is not elem_positions:
+        if len(buffers['indices']) > 512:
+            buffers['indices'].clear()
+
+        cached = (elem_positions, np.array([buffers['grid_index'][tuple(pos)] for pos in elem_positions], dtype = int))
+        buffers['indices'][id(elem_positions)] = cached
+
+    return cached[1]
+
+
+def get_element_state(condition_settings, this_phase, elem_positions, grid_pos, position_jitter = None, 
+                      orientation = True, luminance = None, new_color = False, override_contrast = False, contrast_val = 1,
+                      ori_rng = None, jitter_rng = None, buffers = None):
+
+    """ get element array settings for condition to be displayed
+    (pure numpy, so it can also be used without a window, ex: for rasterizing frames)
     
     Parameters
     ----------
-    ElementArrayStim: Psychopy object
-    	ElementArrayStim to be updated 
     condition_settings: dict
         dictionary with all condition settings
     this_phase: str
@@ -206,17 +435,29 @@ def update_elements(ElementArrayStim, condition_settings, this_phase, elem_posit
          to be used for opacity update
     grid_pos: arr
         numpy array with element positions (N,2) of whole grid -> (number of positions, [x,y])
-    monitor: object
-        monitor object (to get monitor references for deg2pix transformation)
-    screen: arr
-        array with display resolution
+    position_jitter: float or None
+        max jitter (in pixels) to add to (x,y) center of elements
+    orientation: bool
+        if we want to randomly update element orientations
     luminance: float or None
         luminance increment to alter color (used for flicker task)
-    update_settings: bool
-        choose if we want to update settings or not (mainly for color changes)
     new_color: array
         if we are changing color to be one not represented in settings (ca also be False if no new color used)
-        
+    ori_rng: numpy Generator/None
+        random generator for element orientations
+    jitter_rng: numpy Generator/None
+        random generator for element position jitter
+    buffers: dict/None
+        preallocated element arrays (see make_element_buffers), overwritten and returned in element state.
+        If None, new arrays are made
+
+    Returns
+    -------
+    element_state: dict
+        dictionary with element 'hsv_color', 'rgb_color' (peak color of texture, [0,1]), 'colors', 'sfs', 
+        'oris' and 'xys' (None if not updated), 'contrs' and 'opacities'
+    condition_settings: dict
+        condition settings, with updated color (if luminance changed)
     """
 
     # we might be using diferent colors than the main 2, so set that straight
@@ -245,7 +486,7 @@ def update_elements(ElementArrayStim, condition_settings, this_phase, elem_posit
 
         hsv_color[-1] = luminance
         hsv_color[-1] = np.clip(hsv_color[-1],0.00001,1) # clip it so it doesn't go above 100% or below 0.0001% (latter avoids 0 division)
-        print(hsv_color)
+        logger.debug('luminance updated hsv color is %s', hsv_color)
 
         # update settings dict with new color 
         updat_color_arr = [float(x*255.) for x in colorsys.hsv_to_rgb(hsv_color[0]/360.,hsv_color[1],hsv_color[2])]
@@ -254,44 +495,60 @@ def update_elements(ElementArrayStim, condition_settings, this_phase, elem_posit
         else:
             condition_settings[main_color]['task_color'][this_phase]['element_color'] = updat_color_arr 
 
+    element_state = {'hsv_color': hsv_color,
+                     'rgb_color': np.array(colorsys.hsv_to_rgb(hsv_color[0]/360.,hsv_color[1],hsv_color[2]))}
 
-    grat_res = near_power_of_2(ElementArrayStim.sizes[0][0],near='previous') # use power of 2 as grating res, to avoid error
-    
-    # initialise grating
-    grating = visual.filters.makeGrating(res=grat_res)
-    grating_norm = (grating - np.min(grating))/(np.max(grating) - np.min(grating)) # normalize between 0 and 1
-    
-    # initialise a base texture 
-    colored_grating = np.ones((grat_res, grat_res, 3)) 
+    if buffers is not None:
+        # same as below, writing into preallocated arrays
+        element_state['colors'] = buffers['colors']
+
+        buffers['sfs'].fill(condition_settings[main_color]['element_sf'])
+        element_state['sfs'] = buffers['sfs']
+
+        ori_rng = np.random.default_rng() if ori_rng is None else ori_rng
+        if orientation == True:
+            ori_rng.random(out = buffers['oris'])
+            buffers['oris'] *= 360
+            element_state['oris'] = buffers['oris']
+        else:
+            element_state['oris'] = None
 
-    # replace the base texture red/green channel with the element color value, and the value channel with the grating
+        list_indices = get_element_indices(elem_positions, grid_pos, buffers = buffers)
 
-    colored_grating[..., 0] = hsv_color[0]
-    colored_grating[..., 1] = hsv_color[1]
-    colored_grating[..., 2] = grating_norm * hsv_color[2]
+        buffers['contrs'].fill(0)
+        buffers['contrs'][list_indices] = contrast_val if override_contrast else condition_settings[main_color]['element_contrast']
+        element_state['contrs'] = buffers['contrs']
 
-    elementTex = ct.hsv2rgb(colored_grating) # convert back to rgb
+        buffers['opacities'].fill(0)
+        buffers['opacities'][list_indices] = 1
+        element_state['opacities'] = buffers['opacities']
+
+        if position_jitter != None:
+            element_state['xys'] = jitter(grid_pos,
+                                        max_val = position_jitter,
+                                        min_val = 0, 
+                                        rng = jitter_rng,
+                                        out = buffers['xys'],
+                                        scratch = buffers['jitter'])
+        else:
+            element_state['xys'] = None
+
+        return element_state, condition_settings
 
     # update element colors to color of the patch 
-    element_color = np.ones((int(np.round(nElements)),3)) 
+    element_state['colors'] = np.ones((int(np.round(nElements)),3)) 
     
     # update element spatial frequency
-    element_sfs = np.ones((nElements)) * condition_settings[main_color]['element_sf'] # in cycles/gabor width
+    element_state['sfs'] = np.ones((nElements)) * condition_settings[main_color]['element_sf'] # in cycles/gabor width
 
     # update element orientation randomly
-    if orientation == True:
-        element_ori = np.random.uniform(0,360,nElements)
-        ElementArrayStim.setOris(element_ori)
-
+    ori_rng = np.random.default_rng() if ori_rng is None else ori_rng
+    element_state['oris'] = ori_rng.uniform(0,360,nElements) if orientation == True else None
 
     # update element opacities
 
-    # make grid and element position lists of lists
-    list_grid_pos = [list(val) for _,val in enumerate(grid_pos)]
-    list_elem_pos = [list(val) for _,val in enumerate(elem_positions)]
-
-    # get indices of where one is in other
-    list_indices = [list_grid_pos.index(list_elem_pos[i]) for i in range(len(list_elem_pos))]
+    # get indices of element positions in grid
+    list_indices = get_element_indices(elem_positions, grid_pos)
 
     # set element contrasts
     element_contrast =  np.zeros(len(grid_pos))
@@ -299,63 +556,78 @@ def update_elements(ElementArrayStim, condition_settings, this_phase, elem_posit
         element_contrast[list_indices] = contrast_val
     else:
         element_contrast[list_indices] = condition_settings[main_color]['element_contrast']
-    #element_contrast[list_indices] = background_contrast if background_contrast != None else condition_settings[main_color]['element_contrast']
+    element_state['contrs'] = element_contrast
     
     # set opacities
     element_opacities = np.zeros(len(grid_pos))
     element_opacities[list_indices] = 1
+    element_state['opacities'] = element_opacities
 
     if position_jitter != None: # if we want to add jitter to (x,y) center of elements
-        element_pos = jitter(grid_pos,
-                            max_val = position_jitter,
-                            min_val = 0)
-
-        ElementArrayStim.setXYs(element_pos)
-
-    # set all of the above settings
-    ElementArrayStim.setTex(elementTex)
-    ElementArrayStim.setSfs(element_sfs)
-    ElementArrayStim.setOpacities(element_opacities)
-    ElementArrayStim.setColors(element_color, 'rgb')
-    ElementArrayStim.setContrs(element_contrast)
-    #print(element_contrast[list_indices[0]])
-
-    # return updated settings, if such is the case
-    if update_settings == True: 
-        return(ElementArrayStim,condition_settings)
+        element_state['xys'] = jitter(grid_pos,
+                                    max_val = position_jitter,
+                                    min_val = 0, 
+                                    rng = jitter_rng)
     else:
-        return(ElementArrayStim)
+        element_state['xys'] = None
 
+    return element_state, condition_settings
 
-def get_non_overlapping_indices(arr_shape=[2,8]):
+
+def get_non_overlapping_indices(arr_shape=[2,8], rng=None, constraint='all'):
     
     """ get array of indices, that don't overlap
     useful to make sure two bars with same orientation 
-    don't overlap spatially
+    don't overlap spatially.
+    Rows are made as shifted (random) Latin square rows - a random permutation of positions 
+    cyclically shifted by a different amount for each row, and columns shuffled - 
+    so it takes O(number of bars x number of positions), without reshuffling until rows don't collide
     
     Parameters
     ----------
     arr_shape : list/arr
         shape of indice arr -> [number of bars, number of positions]
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
+    constraint: str
+        'all' - row never has same index as any other row, in same column (needs bars <= positions)
+        'adjacent' - row only differs from previous row
         
+    Returns
+    -------
+    ind : arr
+        array of indices (number of bars, number of positions)
     """ 
-    # initialize empty array
-    ind = np.empty((arr_shape[0],), dtype=list)
-    
-    # get indices for all possible horizontal bar positions
-    for w in range(arr_shape[0]):
-        ind[w] = np.arange(arr_shape[1])
-        np.random.shuffle(ind[w])
+    rng = np.random.default_rng() if rng is None else rng
+
+    num_bars, num_pos = int(arr_shape[0]), int(arr_shape[1])
+
+    if constraint == 'all':
+        if num_bars > num_pos:
+            raise ValueError('Cannot make %i non overlapping rows of %i positions'%(num_bars, num_pos))
+
+        # different shift for every row
+        shifts = rng.choice(num_pos, size = num_bars, replace = False)
+
+    elif constraint == 'adjacent':
+        if num_pos < 2 and num_bars > 1:
+            raise ValueError('Cannot make non overlapping rows of %i position'%num_pos)
+
+        # shift differs from the one of previous row
+        shifts = np.cumsum(np.concatenate(([rng.integers(num_pos)], rng.integers(1, max(num_pos, 2), size = num_bars - 1)))) % num_pos
+
+    else:
+        raise NameError('Unknown constraint %s'%constraint)
 
-        if w>0:
-            while any(ind[w-1] == ind[w]): # shuffle until sure that bars in different positions
-                np.random.shuffle(ind[w])
+    perm = rng.permutation(num_pos)
 
+    ind = perm[(np.arange(num_pos)[np.newaxis] + shifts[:, np.newaxis]) % num_pos]
 
-    return ind
+    # shuffle columns, so rows are not just shifted copies
+    return ind[:, rng.permutation(num_pos)]
 
 
-def repeat_random_lists(arr,num_rep):
+def repeat_random_lists(arr,num_rep,rng=None):
     
     """ repeat array, shuffled and stacked horizontally
     
@@ -365,24 +637,162 @@ def repeat_random_lists(arr,num_rep):
         array to repeat
     num_rep: int
         number of repetions
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
         
     """ 
+    rng = np.random.default_rng() if rng is None else rng
+
     # initialize empty array
     new_arr = np.empty((num_rep,), dtype=list)
     
     # get indices for all possible horizontal bar positions
     for w in range(num_rep):
-        random.shuffle(arr)
+        rng.shuffle(arr)
         new_arr[w] = arr.copy()
 
     return new_arr
 
 
 
+def get_all_bar_pairs(num_positions, attend_orientation = ['vertical','horizontal'],
+                      unattend_orientation = ['vertical','horizontal']):
+
+    """ enumerate all pairs of attended and unattended bar positions 
+    (all orthogonal pairs, and all non overlapping pairs of same orientation)
+
+    Parameters
+    ----------
+    num_positions : dict
+        number of bar positions per orientation, ex: {'horizontal': 6, 'vertical': 6}
+    attend_orientation: list/array
+        possible bar orientations for attended condition
+    unattend_orientation: list/array
+        possible bar orientations for UNattended condition
+
+    Returns
+    -------
+    pairs : dict
+        'att_ori', 'att_ind', 'unatt_ori', 'unatt_ind' arrays (one value per pair)
+    """
+
+    pairs = {'att_ori': [], 'att_ind': [], 'unatt_ori': [], 'unatt_ind': []}
+
+    for att_ori in attend_orientation:
+
+        for unatt_ori in unattend_orientation:
+
+            if att_ori != unatt_ori: # if bar orientations orthogonal
+                indice_pairs = list(itertools.product(range(num_positions[att_ori]), range(num_positions[unatt_ori])))
+
+            else: # if bar orientations the same
+                indice_pairs = list(itertools.permutations(range(num_positions[att_ori]), 2))
+
+            indice_pairs = np.array(indice_pairs, dtype = int).reshape(-1, 2)
+
+            pairs['att_ori'].append(np.tile(att_ori, indice_pairs.shape[0]))
+            pairs['att_ind'].append(indice_pairs[:, 0])
+            pairs['unatt_ori'].append(np.tile(unatt_ori, indice_pairs.shape[0]))
+            pairs['unatt_ind'].append(indice_pairs[:, 1])
+
+    return {key: np.concatenate(val) for key, val in pairs.items()}
+
+
+def iter_balanced_bar_pairs(num_positions, orientations = ['vertical','horizontal'], rng = None):
+
+    """ stream balanced blocks of attended/unattended bar position pairs (endless).
+    Each block has one round per orientation combination, where every attended position is paired with 
+    a different unattended position (cyclic shift, never the same position for same orientation).
+    So in each block all orientation combinations, and all positions of each orientation, 
+    appear equally often. Rounds are drawn without replacement, so all pairs are used before any repeats
+
+    Parameters
+    ----------
+    num_positions : dict
+        number of bar positions per orientation, ex: {'horizontal': 6, 'vertical': 6}
+    orientations: list/array
+        possible bar orientations (of attended and unattended bars)
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
+
+    Yields
+    ------
+    pairs : dict
+        'att_ori', 'att_ind', 'unatt_ori', 'unatt_ind' arrays of block
+    """
+
+    rng = np.random.default_rng() if rng is None else rng
+
+    combinations = [(att_ori, unatt_ori) for att_ori in orientations for unatt_ori in orientations]
+
+    # shifts of unattended position, per orientation combination
+    shifts = {(att_ori, unatt_ori): np.arange(num_positions[unatt_ori]) if att_ori != unatt_ori else np.arange(1, num_positions[unatt_ori])
+              for att_ori, unatt_ori in combinations}
+    remaining = {comb: [] for comb in combinations}
+
+    while True:
+
+        pairs = {'att_ori': [], 'att_ind': [], 'unatt_ori': [], 'unatt_ind': []}
+
+        for comb in combinations:
+
+            if len(remaining[comb]) == 0:
+                remaining[comb] = list(rng.permutation(shifts[comb]))
+
+            att_ind = np.arange(num_positions[comb[0]])
+
+            pairs['att_ori'].append(np.tile(comb[0], len(att_ind)))
+            pairs['att_ind'].append(att_ind)
+            pairs['unatt_ori'].append(np.tile(comb[1], len(att_ind)))
+            pairs['unatt_ind'].append((att_ind + remaining[comb].pop()) % num_positions[comb[1]])
+
+        yield {key: np.concatenate(val) for key, val in pairs.items()}
+
+
+def get_run_bar_pairs(num_positions, run_index, blocks_per_run, orientations = ['vertical','horizontal'], seed = 0):
+
+    """ get balanced chunk of bar position pairs for one run.
+    All runs take consecutive chunks from the same stream (made with seed),
+    so pairs are spread across runs. Blocks of earlier runs are generated and skipped (cheap)
+
+    Parameters
+    ----------
+    num_positions : dict
+        number of bar positions per orientation, ex: {'horizontal': 8, 'vertical': 8}
+    run_index : int
+        index of run chunk in stream
+    blocks_per_run : int
+        number of balanced blocks per run
+    orientations: list/array
+        possible bar orientations
+    seed : int
+        seed of pair stream (same for all runs)
+
+    Returns
+    -------
+    pairs : dict
+        'att_ori', 'att_ind', 'unatt_ori', 'unatt_ind' arrays of run
+    """
+
+    stream = iter_balanced_bar_pairs(num_positions, orientations = orientations, rng = np.random.default_rng(seed))
+    blocks = list(itertools.islice(stream, run_index * blocks_per_run, (run_index + 1) * blocks_per_run))
+
+    return {key: np.concatenate([block[key] for block in blocks]) for key in blocks[0].keys()}
+
+
+def get_run_number(output_str):
+
+    """ get run number from output string (ex: 'sub-001_ses-1_task-FA_run-2' -> 2), 0 if not there """
+
+    match = re.search(r'run-(\d+)', output_str)
+
+    return int(match.group(1)) if match else 0
+
+
 def set_bar_positions(pos_dict = {'horizontal': [], 'vertical': []},
                      attend_condition = 'color_red', unattend_condition = 'color_green',
                       attend_orientation = ['vertical','horizontal'],
-                      unattend_orientation = ['vertical','horizontal']):
+                      unattend_orientation = ['vertical','horizontal'], rng = None, pairs = None):
     
     """ set bar positions for all feature trials
     
@@ -402,58 +812,48 @@ def set_bar_positions(pos_dict = {'horizontal': [], 'vertical': []},
         possible bar orientations for attended condition
     unattend_orientation: list/array
         possible bar orientations for UNattended condition
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
+    pairs: dict/None
+        position pairs to use (as given by get_run_bar_pairs). If None, uses all possible pairs
         
     """
-    
-    # total number of trials
-    num_trials = len(attend_orientation)*(pos_dict['horizontal'].shape[0] * pos_dict['vertical'].shape[0] + \
-                                          pos_dict['horizontal'].shape[0] * (pos_dict['horizontal'].shape[0]-1))
-
-    print('number of bar trials is %i'%num_trials)
-    
-    # define dictionary to save positions and directions
-    # of all bars
-    output_dict = {'attended_bar': {'color': attend_condition,
-                                   'bar_midpoint_at_TR': [],
-                                   'bar_pass_direction_at_TR': []},
-                   'unattended_bar': {'color': unattend_condition,
-                                      'bar_midpoint_at_TR': [],
-                                      'bar_pass_direction_at_TR': []}
-                  }
 
-    # append all postions in dict 
-    for att_ori in attend_orientation:
-
-        for unatt_ori in unattend_orientation:
-
-            if att_ori != unatt_ori: # if bar orientations orthogonal
-
-                indice_pairs = list((x,y) for x in np.arange(pos_dict[att_ori].shape[0]) for y in np.arange(pos_dict[unatt_ori].shape[0]))
-
-            else: # if bar orientations the same
+    rng = np.random.default_rng() if rng is None else rng
 
-                indice_pairs = list(itertools.permutations(np.arange(pos_dict[att_ori].shape[0]), 2))
+    if pairs is None:
+        pairs = get_all_bar_pairs({ori: pos_dict[ori].shape[0] for ori in pos_dict.keys()},
+                                  attend_orientation = attend_orientation,
+                                  unattend_orientation = unattend_orientation)
+    
+    # total number of trials
+    num_trials = len(pairs['att_ind'])
 
-            # fill attended dict
-            output_dict['attended_bar']['bar_midpoint_at_TR'].append(np.array([pos_dict[att_ori][i] for i in np.array(indice_pairs)[...,0]]))
-            output_dict['attended_bar']['bar_pass_direction_at_TR'].append(np.tile(att_ori, np.array(indice_pairs).shape[0]))
+    logger.info('number of bar trials is %i', num_trials)
 
-            # fill unattended dict
-            output_dict['unattended_bar']['bar_midpoint_at_TR'].append(np.array([pos_dict[unatt_ori][i] for i in np.array(indice_pairs)[...,-1]]))
-            output_dict['unattended_bar']['bar_pass_direction_at_TR'].append(np.tile(unatt_ori, np.array(indice_pairs).shape[0]))
+    # position of each pair
+    att_midpoints = np.zeros((num_trials, 2))
+    unatt_midpoints = np.zeros((num_trials, 2))
 
-    ## reshape and reorder arrays
+    for ori in pos_dict.keys():
+        att_midpoints[pairs['att_ori'] == ori] = np.asarray(pos_dict[ori])[pairs['att_ind'][pairs['att_ori'] == ori]]
+        unatt_midpoints[pairs['unatt_ori'] == ori] = np.asarray(pos_dict[ori])[pairs['unatt_ind'][pairs['unatt_ori'] == ori]]
 
     # make random indices
     random_ind = np.arange(num_trials)
-    np.random.shuffle(random_ind)  
-
-    for key in output_dict.keys():
-
-        output_dict[key]['bar_midpoint_at_TR'] = np.vstack([v for v in output_dict[key]['bar_midpoint_at_TR']])[random_ind]
-        output_dict[key]['bar_pass_direction_at_TR'] = np.hstack([v for v in output_dict[key]['bar_pass_direction_at_TR']])[random_ind]
-    
+    rng.shuffle(random_ind)  
 
+    # define dictionary to save positions and directions
+    # of all bars (and index of position, in table of its orientation)
+    output_dict = {'attended_bar': {'color': attend_condition,
+                                   'bar_midpoint_at_TR': att_midpoints[random_ind],
+                                   'bar_pass_direction_at_TR': pairs['att_ori'][random_ind],
+                                   'bar_position_ind_at_TR': pairs['att_ind'][random_ind]},
+                   'unattended_bar': {'color': unattend_condition,
+                                      'bar_midpoint_at_TR': unatt_midpoints[random_ind],
+                                      'bar_pass_direction_at_TR': pairs['unatt_ori'][random_ind],
+                                      'bar_position_ind_at_TR': pairs['unatt_ind'][random_ind]}
+                  }
 
     return(output_dict)
 
@@ -536,51 +936,7 @@ def gradual_shift(curr_point,
     return x_next, y_next
     
 
-def draw_instructions(win, instructions, keys = ['b'], visual_obj = [], 
-                      color = (1, 1, 1), font = 'Helvetica Neue', pos = (0, 0), height = 40, #.65,
-                        italic = True, anchorHoriz  = 'center', anchorVert = 'center'):
-    
-    """ draw instructions on screen
-    
-    Parameters
-    ----------
-    win : object
-        window object to draw on
-    instructions : str
-        instruction string to draw 
-    key: list
-        list of keys to skip instructions
-    visual_obj: list
-        if not empty, should have psychopy visual objects (to add to the display ex: side rectangles to limit display)
-        
-    """
-    
-    text = visual.TextStim(win = win,
-                        text = instructions,
-                        color = color, 
-                        font = font, 
-                        pos = pos, 
-                        height = height,
-                        italic = italic, 
-                        anchorHoriz = anchorHoriz, 
-                        anchorVert = anchorVert
-                        )
-    
-    # draw text again
-    text.draw()
-
-    if len(visual_obj)>0:
-        for w in range(len(visual_obj)):
-            visual_obj[w].draw()
-            
-    win.flip()
-
-    key_pressed = event.waitKeys(keyList = keys)
-
-    return(key_pressed)
-
-
-def randomize_conditions(cond_list):
+def randomize_conditions(cond_list, rng=None):
     
     """ randomize condition names to attend in block
     
@@ -588,57 +944,27 @@ def randomize_conditions(cond_list):
     ----------
     cond_list : array/list
         List/array (N,) of strings with condition names        
+    rng: numpy Generator/None
+        random generator to use (if None, uses a new unseeded one)
     """
 
+    rng = np.random.default_rng() if rng is None else rng
+
     key_list = []
     for key in cond_list:
         if key != 'background': # we don't want to show background gabors
             key_list.append(key)
 
-    np.random.shuffle(key_list)
+    rng.shuffle(key_list)
     
     return np.array(key_list)
 
 
-def save_bar_position(bar_dict, output_path):
-    
-    """ get bar position dictionary (with all positions for whole run), convert to pandas df and 
-    save into appropriate output folder
-    
-    Parameters
-    ----------
-    bar_dict : dict
-        position dictionary
-    num_miniblock: int
-        number of miniblocks
-    output_path: str
-        absolute path to output file
-        
-    """
-    
-    df_bar_position = pd.DataFrame(columns=['attend_condition', 'color', 'bar_midpoint_at_TR', 'bar_pass_direction_at_TR'])
-
-    for key in bar_dict.keys():
-
-        attend = 1 if key == 'attended_bar' else 0 
-
-        df_bar_position = pd.concat([df_bar_position, pd.DataFrame({'attend_condition': [attend],
-                                                        'color': [bar_dict[key]['color']],
-                                                        'bar_midpoint_at_TR': [bar_dict[key]['bar_midpoint_at_TR']],
-                                                        'bar_pass_direction_at_TR': [bar_dict[key]['bar_pass_direction_at_TR']]
-                                                        })], 
-                                    ignore_index=True)  
-
-    df_bar_position.to_pickle(output_path)
+def make_feature_trial_arrays(bar_pass_direction, bar_dict, empty_TR = 20, task_trial_TR = 2):
 
+    """ make fixed type arrays with trial type, bar direction and bar midpoint of all TRs
+    of feature run, in one pass (no per TR loop)
 
-
-def define_feature_trials(bar_pass_direction, bar_dict, empty_TR = 20, task_trial_TR = 2):
-    
-    """ create feature trials based on order of "type of stimuli" throught experiment  
-    and bar positions in run. Outputs number and type of trials, and bar direction and midpoint position
-    per trial
-    
     Parameters
     ----------
     bar_pass_direction: array/list
@@ -649,128 +975,106 @@ def define_feature_trials(bar_pass_direction, bar_dict, empty_TR = 20, task_tria
         number of TRs for empty intervals of experiment
     task_trial_TR: int
         number of TRs for task trials of experiment (bar presentation + ITI)
-    mini_block_trials: int
-        number of trials for a miniblock of experiment
-        
+
+    Returns
+    -------
+    trial_arrays : dict
+        'trial_type_codes' (TR,) - index of trial type in 'trial_type_names' (0 is 'empty'),
+        'direction_codes' (TR, bars) - index of bar direction in BAR_DIRECTIONS (-1 if no bar),
+        'midpoints' (TR, bars, [x,y]) - bar midpoint (nan if no bar)
     """
-    
+
+    bar_keys = list(bar_dict.keys())
+
     # number of trials for actual task (Note - can be different than TR)
     num_task_trials = len(bar_dict['attended_bar']['bar_pass_direction_at_TR'])
-    
-    # create as many trials as TRs
-    trial_number = 0
-    bar_pass_direction_all = [] # list of lists with bar orientation at all TRs
-    bar_pos_array = [] # list of lists with bar midpoint (x,y) for all TRs (if nan, then show background)
-    trial_type_all = [] # list of lists with trial type at all TRs,
 
-    for _,bartype in enumerate(bar_pass_direction):
-        if bartype in np.array(['empty']): # empty screen
-            trial_number += empty_TR
-            trial_type_all = trial_type_all + np.repeat(bartype,empty_TR).tolist()
-            bar_pass_direction_all = bar_pass_direction_all + np.repeat(bartype,empty_TR).tolist()
+    # trial type names, 'empty' first
+    trial_type_names = ['empty'] + [b for b in dict.fromkeys(bar_pass_direction) if b != 'empty']
 
-            for i in range(empty_TR):
-                temp_pos_list = []
-                for _,key in enumerate(bar_dict.keys()):
-                    temp_pos_list.append(np.array([np.nan,np.nan], dtype=float)) 
-                bar_pos_array.append(np.array(temp_pos_list).astype('float'))
+    ## TRs of each block (one feature trial is 1TR of bar display + task_trial_TR-1 TRs of empty screen)
+    task_block = np.array(['task' in b for b in bar_pass_direction])
+    block_TR = np.where(task_block, task_trial_TR * num_task_trials, 
+                        np.where(np.array(bar_pass_direction) == 'empty', empty_TR, 0))
+    trial_number = int(block_TR.sum())
 
-        elif 'task' in bartype: # bars on screen
-            trial_number += task_trial_TR * num_task_trials # NOTE one feature trial is 1TR of bar display + 1TR of empty screen
-            trial_type_all = trial_type_all + list([bartype]+list(np.tile('empty', task_trial_TR-1))) * num_task_trials
+    block_start = np.cumsum(block_TR) - block_TR
+    TR_block = np.repeat(np.arange(len(block_TR)), block_TR)
+    TR_offset = np.arange(trial_number) - block_start[TR_block]
 
-            for t in range(num_task_trials):
+    # TRs where bars are shown, and which task trial they show
+    bar_TR = task_block[TR_block] & (TR_offset % task_trial_TR == 0)
+    task_trial_ind = TR_offset[bar_TR] // task_trial_TR
 
-                temp_dir_list = [] # temporary helper lists
-                temp_pos_list = [] 
+    trial_type_codes = np.array([trial_type_names.index(b) for b in bar_pass_direction], dtype = np.int8)[TR_block]
+    trial_type_codes[task_block[TR_block] & ~bar_TR] = 0
 
-                for _,key in enumerate(bar_dict.keys()):
-                    temp_dir_list.append(bar_dict[key]['bar_pass_direction_at_TR'][t])
-                    temp_pos_list.append(bar_dict[key]['bar_midpoint_at_TR'][t])
+    ## bar direction and midpoint of all TRs (padded with -1/nan)
+    direction_codes = np.full((trial_number, len(bar_keys)), -1, dtype = np.int8)
+    midpoints = np.full((trial_number, len(bar_keys), 2), np.nan)
 
+    for i, key in enumerate(bar_keys):
+        bar_directions, bar_direction_ind = np.unique(bar_dict[key]['bar_pass_direction_at_TR'], return_inverse = True)
+        bar_direction_codes = np.array([BAR_DIRECTIONS.index(d) for d in bar_directions], dtype = np.int8)[bar_direction_ind]
 
-                bar_pass_direction_all.append(temp_dir_list)
-                bar_pos_array.append(np.array(temp_pos_list).astype('float'))
-                
-                # rest of TRs will be empty
-                for i in range(task_trial_TR-1):
-                    bar_pass_direction_all.append('empty')
-                    
-                    temp_pos_list = []
-                    for _,key in enumerate(bar_dict.keys()):
-                        temp_pos_list.append(np.array([np.nan,np.nan], dtype=float)) 
-                    bar_pos_array.append(np.array(temp_pos_list).astype('float'))
+        direction_codes[bar_TR, i] = bar_direction_codes[task_trial_ind]
+        midpoints[bar_TR, i] = np.asarray(bar_dict[key]['bar_midpoint_at_TR'], dtype = float)[task_trial_ind]
+
+    return {'trial_number': trial_number,
+            'trial_type_names': trial_type_names,
+            'trial_type_codes': trial_type_codes,
+            'direction_codes': direction_codes,
+            'midpoints': midpoints}
 
-    return trial_number, np.array(trial_type_all), np.array(bar_pass_direction_all, dtype=object), np.array(bar_pos_array)
 
+def decode_feature_trial_arrays(trial_arrays):
 
+    """ get trial type names (TR,) and bar direction names (TR, bars) from codes
+    (as given by make_feature_trial_arrays), 'empty' when there is no bar """
 
-def save_all_TR_info(bar_dict = [], trial_type = [], ecc_ind = {},
-                     task_colors = {}, task_color_ind = {}, crossing_ind = [], output_path = ''):
+    trial_type_all = np.array(trial_arrays['trial_type_names'])[trial_arrays['trial_type_codes']]
+
+    # code -1 indexes last name, 'empty'
+    bar_pass_direction_all = np.array(BAR_DIRECTIONS + ['empty'])[trial_arrays['direction_codes']]
+
+    return trial_type_all, bar_pass_direction_all
+
+
+def define_feature_trials(bar_pass_direction, bar_dict, empty_TR = 20, task_trial_TR = 2):
     
-    """ save all relevant trial infos in pandas df and 
-    save into appropriate output folder
+    """ create feature trials based on order of "type of stimuli" throught experiment  
+    and bar positions in run. Outputs number and type of trials, and bar direction and midpoint position
+    per trial
     
     Parameters
     ----------
+    bar_pass_direction: array/list
+        list with order of "type of stimuli" throught experiment
     bar_dict : dict
         position dictionary
-    trial_type : list/arr
-        list of type of trial ('empty', 'task') for all TRs
-    attend_color: str
-        name of color that is attended
-    output_path: str
-        absolute path to output file
-    hemifield: list/arr
-        list of hemifield placement of attended bar, for all TRS (if no bar on screen then nan)
-    crossing_ind: list/arr
-        list of lists with plotting indices,for all TRS (if no bar on screen then nan)
-        [useful for crossings (to know which bars on top)]
-        
+    empty_TR: int
+        number of TRs for empty intervals of experiment
+    task_trial_TR: int
+        number of TRs for task trials of experiment (bar presentation + ITI)
+
+    Returns
+    -------
+    trial_number : int
+        number of TRs
+    trial_type_all : arr
+        trial type (ex: 'empty', 'task') of all TRs
+    bar_pass_direction_all : arr
+        bar direction (TR, bars), 'empty' if no bar
+    bar_midpoint_all : arr
+        bar midpoint (TR, bars, [x,y]), nan if no bar
     """
-    
-    # get colors for attended task
-    c_att = np.array([task_colors[bar_dict['attended_bar']['color']][v] for v in task_color_ind[bar_dict['attended_bar']['color']]])
-    attend_task_color = np.full(len(trial_type), None)
-    attend_task_color[np.where(trial_type == 'task')[0]] = c_att
-
-    # do same for unattended task
-    c_unatt = np.array([task_colors[bar_dict['unattended_bar']['color']][v] for v in task_color_ind[bar_dict['unattended_bar']['color']]])
-    unattend_task_color = np.full(len(trial_type), None)
-    unattend_task_color[np.where(trial_type == 'task')[0]] = c_unatt
-    
-    # get ecc - attended
-    ecc_att = ecc_ind[bar_dict['attended_bar']['color']]
-    attend_ecc = np.full(len(trial_type), None)
-    attend_ecc[np.where(trial_type == 'task')[0]] = ecc_att
 
-    # get ecc - unattended
-    ecc_unatt = ecc_ind[bar_dict['unattended_bar']['color']]
-    unattend_ecc = np.full(len(trial_type), None)
-    unattend_ecc[np.where(trial_type == 'task')[0]] = ecc_unatt
+    trial_arrays = make_feature_trial_arrays(bar_pass_direction, bar_dict, empty_TR = empty_TR, task_trial_TR = task_trial_TR)
+
+    trial_type_all, bar_pass_direction_all = decode_feature_trial_arrays(trial_arrays)
+
+    return trial_arrays['trial_number'], trial_type_all, bar_pass_direction_all, trial_arrays['midpoints']
 
-    
-    df_out = pd.DataFrame(columns=['trial_num','trial_type', 
-                                   'attend_color', 'attend_task_color',
-                                   'unattend_color', 'unattend_task_color',
-                                   'bars', 'attend_ecc_ind', 'unattend_ecc_ind', 'crossing_ind'])
-    
-    for trl in range(len(trial_type)):
-        
-        df_out = pd.concat([df_out, pd.DataFrame({'trial_num': [trl], 
-                                                'trial_type': [trial_type[trl]],
-                                                'attend_color': [bar_dict['attended_bar']['color']],
-                                                'attend_task_color' : [attend_task_color[trl]],
-                                                'unattend_color': [bar_dict['unattended_bar']['color']],
-                                                'unattend_task_color': [unattend_task_color[trl]],
-                                                'bars': [bar_dict.keys()],
-                                                'attend_ecc_ind':[attend_ecc[trl]], 
-                                                'unattend_ecc_ind': [unattend_ecc[trl]],
-                                                'crossing_ind': [crossing_ind[trl]],
-                                            })], 
-                            ignore_index=True) 
-        
-    df_out.to_csv(output_path, index = False, header=True)
 
 
 def get_square_positions(grid_pos, ecc_midpoint_at_trial, bar_width_pix, screen=np.array([1680,1050])):
@@ -853,113 +1157,127 @@ def get_square_positions(grid_pos, ecc_midpoint_at_trial, bar_width_pix, screen=
 
 
 
-def get_average_color(filedir, settings, updated_color_names = ['orange','yellow','blue'],
-                     color_categories = ['color_red', 'color_green'], average_ecc = True, ecc_ind = [0,1,2]):
+def get_true_responses(bar_responses,drop_nan = False):
     
-    """ get average color 
+    """
+    given array of trial position of attended bar
+    output array of true responses for run
+    (same vs dif, nan for first trial if drop_nan = False)
+    """
     
+    bar_responses = np.asarray(bar_responses)
+
+    true_responses = np.where(bar_responses[1:] == bar_responses[:-1], 'same', 'different')
+    if drop_nan == False and len(bar_responses) > 0:
+        true_responses = np.array([np.nan] + true_responses.tolist())
+
+    return true_responses
+
+
+def check_prf_response(event_key, phase_names, keys = {}):
+
+    """ score a pRF task response, given the color category of the bar
+    (shared by PRFTrial and simulated observers, bar window of response given by session timeline)
+
     Parameters
     ----------
-    filedir : str
-        absolute directory where the new settings files are
-    settings: dict
-        settings dict, to be updated
-    updated_color_names: array/list
-        array of strings with names of colors to be updated
-    color_categories: array/list
-        names of general color categories, for bookeeping
-    average_ecc: bool
-        average over eccentricities?
-    ecc_ind: array/list
-        eccentricity indices to consider
-            
+    event_key : str
+        key pressed by participant
+    phase_names : list/arr
+        list of condition names shown in the bar trial (color of the bar)
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
+
+    Returns
+    -------
+    correct : int
+        1 if response was correct, 0 otherwise
     """
-    
-    # get settings files for all trials of flicker task
-    flicker_files = [op.join(filedir,x) for _,x in enumerate(os.listdir(filedir)) if 'trial' in x and x.endswith('_updated_settings.yml')]
-    all_trials = []
-        
-    for col in updated_color_names:
-        
-        new_color = []
-        
-        # loop over eccentricities
-        for e in ecc_ind:
-            
-            # filenames for that color and ecc
-            c_files = [file for file in flicker_files if col in file and 'ecc-%i'%e in file]
 
-            if len(c_files) == 0:
-                print('No files found for color %s and ecc %i, keeping initial settings'%(col, e))
-            else:
-                ecc_color = []
-                for file in c_files:
-                
-                    # load updated settings for each trial 
-                    with open(file, 'r', encoding='utf8') as f_in:
-                        updated_settings = yaml.safe_load(f_in)
+    correct = 0
 
-                    if col in color_categories: # if general color category (red, green)
-                        ecc_color.append(updated_settings[col]['element_color'])
-                    
-                    elif col in ['pink','orange']: # if color variant from red
-                        ecc_color.append(updated_settings['color_red']['task_color'][col]['element_color'])
-                    
-                    elif col in ['yellow','blue']: # if color variant from red
-                        ecc_color.append(updated_settings['color_green']['task_color'][col]['element_color'])
-                
-                new_color.append(list(np.mean(ecc_color, axis=0)))
-            
-                # if we want to average over eccentricities
-                if average_ecc: 
-                    # actually update color in settings file
-                    mean_col = list(np.mean(new_color, axis=0))
-                    if col in color_categories:
-                        settings['stimuli']['conditions'][col]['element_color'] = mean_col
-                        print('new rgb255 for %s is %s'%(col,str(settings['stimuli']['conditions'][col]['element_color'])))
-                    elif col in ['pink','orange']:
-                        settings['stimuli']['conditions']['color_red']['task_color'][col]['element_color'] = mean_col
-                        print('new rgb255 for %s is %s'%(col,str(settings['stimuli']['conditions']['color_red']['task_color'][col]['element_color'])))
-                    elif col in ['yellow','blue']:
-                        settings['stimuli']['conditions']['color_green']['task_color'][col]['element_color'] = mean_col
-                        print('new rgb255 for %s is %s'%(col,str(settings['stimuli']['conditions']['color_green']['task_color'][col]['element_color'])))
-
-                else:
-                    all_trials.append(ecc_color)
-                    print('NOT IMPLEMENTED YET - decide where to store ecc colors!!')
-        
-    ###### for now, to check, NEED TO CHANGE #######
-    if average_ecc: 
-        return settings
-    else: 
-        return all_trials 
+    if (event_key in keys['right_index']) and \
+        (('color_green' in phase_names) or ('yellow' in phase_names) or ('blue' in phase_names)):
+        correct = 1
 
+    elif (event_key in keys['left_index']) and \
+        (('color_red' in phase_names) or ('orange' in phase_names) or ('pink' in phase_names)):
+        correct = 1
 
-def get_true_responses(bar_responses,drop_nan = False):
-    
+    return correct
+
+
+def get_feature_response(event_key, task_color, keys = {}):
+
+    """ check if feature task response matches the hue of the attended bar
+    (left index - blue/pink, right index - yellow/orange)
+
+    Parameters
+    ----------
+    event_key : str
+        key pressed by participant
+    task_color : str
+        name of task color of attended bar
+    keys : dict
+        settings dict with key mapping (with 'left_index' and 'right_index' lists)
     """
-    given array of trial position of attended bar
-    output array of true responses for run
-    (same vs dif, nan for first trial if drop_nan = False)
+
+    if (event_key in keys['left_index']) and (task_color in ['blue', 'pink']):
+        response = 1
+    elif (event_key in keys['right_index']) and (task_color in ['yellow', 'orange']):
+        response = 1
+    else:
+        response = 0
+
+    return response
+
+
+def log_event(global_log, trial_nr, onset, event_type, phase, response, parameters = {}):
+
+    """ append one event (response/pulse/etc) to session data frame
+
+    Parameters
+    ----------
+    global_log : pandas DataFrame
+        session data frame where all events are logged
+    trial_nr : int
+        trial identifier
+    onset : float
+        time of event (relative to session clock)
+    event_type : str
+        type of event (ex: 'response', 'pulse')
+    phase : int
+        phase of trial when event occured
+    response : str
+        key pressed
+    parameters : dict
+        extra trial parameters to log
     """
-    
-    true_responses = []
-    for i in range(len(bar_responses)):
 
-        if i == 0:
-            if drop_nan == False:
-                true_responses.append(np.nan)
+    idx = global_log.shape[0]
+    global_log.loc[idx, 'trial_nr'] = trial_nr
+    global_log.loc[idx, 'onset'] = onset
+    global_log.loc[idx, 'event_type'] = event_type
+    global_log.loc[idx, 'phase'] = phase
+    global_log.loc[idx, 'response'] = response
 
-        elif bar_responses[i] == bar_responses[i-1]:
-            true_responses.append('same')
+    for param, val in parameters.items():
+        global_log.loc[idx, param] = val
+
+    return idx
+
+
+def get_position_eccentricity(num_positions):
+
+    """ eccentricity indice of each bar position (positions sorted along axis),
+    with 0 - nearest and num_positions/2 - 1 furthest (ex: 6 positions -> [2,1,0,0,1,2])
+    """
+
+    val = np.arange(num_positions) - num_positions/2
+
+    return np.where(val < 0, np.abs(val) - 1, val).astype(int)
 
-        elif bar_responses[i] != bar_responses[i-1]:
-            true_responses.append('different')
-    true_responses = np.array(true_responses)
-    
-    return true_responses
 
-    
 def get_bar_eccentricity(all_bar_pos, 
                         hor_bar_pos_pix = [], 
                         ver_bar_pos_pix = [], 
@@ -967,29 +1285,37 @@ def get_bar_eccentricity(all_bar_pos,
 
     """
     get eccentricity indice for bars on all trials
-    returns array of ecc, with 0 - nearest and 2 being furthest
+    returns array of ecc, with 0 - nearest and 2 being furthest.
+    Uses position indices of bars (as given by set_bar_positions), to gather eccentricity 
+    from table of eccentricity per orientation and position
+    (if bar dict has no indices, ex: older bar positions files, they are recovered from midpoints)
     """
 
-    ecc_trials = []
+    directions = np.asarray(all_bar_pos[bar_key]['bar_pass_direction_at_TR'])
 
-    for t, bpos in enumerate(all_bar_pos[bar_key]['bar_midpoint_at_TR']):
+    # eccentricity table (orientation, position), 0 - horizontal, 1 - vertical
+    pos_tables = [np.asarray(hor_bar_pos_pix), np.asarray(ver_bar_pos_pix)]
+    ecc_table = np.zeros((2, max(len(table) for table in pos_tables)), dtype = int)
+    for i, table in enumerate(pos_tables):
+        ecc_table[i, :len(table)] = get_position_eccentricity(len(table))
 
-        if all_bar_pos[bar_key]['bar_pass_direction_at_TR'][t] == 'horizontal':
+    ori_ind = (directions == 'vertical').astype(int)
 
-            ind_pos = np.where(np.sum(hor_bar_pos_pix == bpos, axis = -1) == 2)[0][0]
+    if 'bar_position_ind_at_TR' in all_bar_pos[bar_key]:
+        pos_ind = np.asarray(all_bar_pos[bar_key]['bar_position_ind_at_TR'])
+    else:
+        midpoints = np.asarray(all_bar_pos[bar_key]['bar_midpoint_at_TR'])
+        pos_ind = np.zeros(len(directions), dtype = int)
+        for i, table in enumerate(pos_tables):
+            mask = ori_ind == i
+            matches = np.all(midpoints[mask][:, np.newaxis] == table[np.newaxis], axis = -1)
 
-        elif all_bar_pos[bar_key]['bar_pass_direction_at_TR'][t] == 'vertical':
+            if not matches.any(axis = 1).all():
+                raise ValueError('Bar midpoints %s not in table of bar positions'%midpoints[mask][~matches.any(axis = 1)].tolist())
 
-            ind_pos = np.where(np.sum(ver_bar_pos_pix == bpos, axis = -1) == 2)[0][0]
+            pos_ind[mask] = matches.argmax(axis = 1)
 
-        # adjust ecc indice to be between 0 and 2 (0 - nearest, 2 - furthest)
-        val = ind_pos - len(ver_bar_pos_pix)/2
-        if val < 0: 
-            val = np.abs(val)-1
-
-        ecc_trials.append(int(val))
-        
-    return np.array(ecc_trials)
+    return ecc_table[ori_ind, pos_ind]
 
 
 class StaircaseCostum():
@@ -1098,39 +1424,3 @@ class StaircaseCostum():
         
         return np.array(self.intensities).std()
 
-
-def make_lum_plots(all_ecc_colors, out_dir = '', updated_color_names = ['orange','yellow','blue'], num_ecc = 3):
-    
-    # tile the keys, to make it easier to make dataframe
-    color_names = np.repeat(updated_color_names, num_ecc)
-    
-    all_ecc_dict = {'color': [], 'ecc': [], 'R': [], 'G': [], 'B': [], 'luminance': []}
-    for i, name in enumerate(color_names):
-        
-        if name == 'orange':
-            ecc = i
-        elif name == 'yellow':
-            ecc = i-3
-        elif name == 'blue':
-            ecc = i-3*2
-        
-        for t in range(np.array(all_ecc_colors[i]).shape[0]):
-
-            all_ecc_dict['color'].append(name)
-            all_ecc_dict['ecc'].append(int(ecc))
-            all_ecc_dict['R'].append(np.array(all_ecc_colors[i])[...,0][t])
-            all_ecc_dict['G'].append(np.array(all_ecc_colors[i])[...,1][t])
-            all_ecc_dict['B'].append(np.array(all_ecc_colors[i])[...,2][t])
-            all_ecc_dict['luminance'].append(rgb255_2_hsv(all_ecc_colors[i][t])[-1])
-        
-    # convert to dataframe
-    df_colors = pd.DataFrame(all_ecc_dict)
-    
-    ## make quick bar plot
-    ax = sns.barplot(x = 'color', y = 'luminance', data = df_colors, hue = 'ecc')
-    fig = ax.get_figure()
-    fig.savefig(op.join(out_dir,"luminance_across_ecc.png")) 
-
-    return df_colors
- 
-        
\ No newline at end of file